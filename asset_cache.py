@@ -0,0 +1,166 @@
+"""
+In-memory cache of the noVNC web client
+Files are read and compressed once, served with strong ETags, and module
+imports are rewritten to versioned URLs that browsers may cache forever
+"""
+
+import re
+import gzip
+import time
+import hashlib
+import threading
+import mimetypes
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+WEB_DIRS = ("app", "core", "vendor")
+WEB_FILES = ("vnc.html", "vnc_lite.html", "package.json", "defaults.json", "mandatory.json")
+WEB_SUFFIXES = {".html", ".js", ".css", ".svg", ".png", ".ico", ".json", ".woff", ".woff2",
+                ".ttf", ".ogg", ".mp3"}
+COMPRESSIBLE = {".html", ".js", ".css", ".svg", ".json", ".ico", ".ttf"}
+MIN_COMPRESS = 512                 # smaller files are not worth a variant
+MAX_CACHED = 8 * 1024 * 1024       # larger files are streamed from disk
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Relative module specifiers in import/export statements and dynamic import()
+IMPORT_RE = re.compile(r"""(\bfrom\s*|\bimport\s*\(?\s*)(["'])(\.{1,2}/[^"'?#\s]+\.js)\2""")
+# Local scripts, styles and images referenced from HTML
+HTML_REF_RE = re.compile(
+    r"""(\b(?:src|href)=)(["'])((?![a-z]+:|/|#)[^"'?#\s]+\.(?:js|css|svg|png|ico))\2""")
+
+
+class Asset:
+    __slots__ = ("content_type", "body", "gzip", "br", "etag", "signature")
+
+    def __init__(self, content_type, body, signature):
+        self.content_type = content_type
+        self.body = body
+        self.signature = signature
+        self.etag = f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+        self.gzip = None
+        self.br = None
+
+    def variant(self, accept_encoding):
+        """(body, content-encoding, etag) for the best encoding the client accepts"""
+        accepted = set()
+        for item in accept_encoding.split(","):
+            name, _, params = item.strip().partition(";")
+            if params.replace(" ", "") not in ("q=0", "q=0.0"):
+                accepted.add(name.strip().lower())
+        if self.br is not None and "br" in accepted:
+            return self.br, "br", self.etag[:-1] + '-br"'
+        if self.gzip is not None and "gzip" in accepted:
+            return self.gzip, "gzip", self.etag[:-1] + '-gz"'
+        return self.body, None, self.etag
+
+
+def _signature(path):
+    st = path.stat()
+    return st.st_mtime_ns, st.st_size
+
+
+def _versioned(match, version):
+    prefix, quote, target = match.groups()
+    return f"{prefix}{quote}{target}?v={version}{quote}"
+
+
+class AssetCache:
+    def __init__(self, root, check_interval=1.0):
+        self.root = Path(root).resolve()
+        self.check_interval = check_interval
+        self.assets = {}
+        self.version = None
+        self.checked = 0.0
+        self.building = False
+        self.lock = threading.Lock()
+
+    def _files(self):
+        for name in WEB_FILES:
+            path = self.root / name
+            if path.is_file():
+                yield path
+        for directory in WEB_DIRS:
+            for path in sorted((self.root / directory).rglob("*")):
+                if path.suffix in WEB_SUFFIXES and path.is_file():
+                    yield path
+
+    def build(self):
+        """Read, rewrite and compress every web asset, then swap the table in"""
+        sources = {}
+        for path in self._files():
+            try:
+                signature = _signature(path)
+                if signature[1] > MAX_CACHED:
+                    continue
+                sources["/" + path.relative_to(self.root).as_posix()] = (path, path.read_bytes(), signature)
+            except OSError:
+                continue
+        # One version for the whole client: any change moves every URL
+        digest = hashlib.blake2b(digest_size=8)
+        for url, (_, data, _) in sorted(sources.items()):
+            digest.update(url.encode() + b"\0" + hashlib.blake2b(data).digest())
+        version = digest.hexdigest()
+
+        assets = {}
+        for url, (path, data, signature) in sources.items():
+            if path.suffix in (".js", ".html"):
+                text = data.decode("utf-8", "surrogateescape")
+                text = IMPORT_RE.sub(lambda m: _versioned(m, version), text)
+                if path.suffix == ".html":
+                    text = HTML_REF_RE.sub(lambda m: _versioned(m, version), text)
+                data = text.encode("utf-8", "surrogateescape")
+            content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            if content_type.startswith("text/") or content_type.endswith(("javascript", "json")):
+                content_type += "; charset=utf-8"
+            asset = Asset(content_type, data, signature)
+            if path.suffix in COMPRESSIBLE and len(data) >= MIN_COMPRESS:
+                compressed = gzip.compress(data, 9, mtime=0)
+                if len(compressed) < len(data):
+                    asset.gzip = compressed
+                if brotli is not None:
+                    compressed = brotli.compress(data, quality=11)
+                    if len(compressed) < len(data):
+                        asset.br = compressed
+            assets[url] = (path, asset)
+
+        with self.lock:
+            self.assets = assets
+            self.version = version
+            self.checked = time.monotonic()
+            self.building = False
+        return len(assets)
+
+    def start(self):
+        """Build in the background; requests go to disk until the cache is ready"""
+        self.building = True
+        threading.Thread(target=self.build, name="asset-cache", daemon=True).start()
+
+    def _check(self):
+        """Drop changed files and rebuild; at most once per check_interval"""
+        self.checked = time.monotonic()
+        stale = []
+        for url, (path, asset) in list(self.assets.items()):
+            try:
+                if _signature(path) != asset.signature:
+                    stale.append(url)
+            except OSError:
+                stale.append(url)
+        if stale:
+            with self.lock:
+                for url in stale:
+                    self.assets.pop(url, None)
+                if not self.building:
+                    self.start()
+
+    def lookup(self, url):
+        """Cached asset for a URL path, or None to serve it from disk"""
+        if not self.building and time.monotonic() - self.checked >= self.check_interval:
+            self._check()
+        entry = self.assets.get(url)
+        return entry[1] if entry else None
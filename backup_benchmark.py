@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark: tar/gzip versus the parallel backup engine
+Builds a synthetic Firefox profile and times backup and restore for both paths
+"""
+
+import sys
+import time
+import shutil
+import random
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+from backup_engine import BackupEngine
+from snapshot_store import available_codecs
+
+WORDS = [b"session", b"cookie", b"places", b"moz_", b"https://", b"example.org",
+         b"favicon", b"history", b"form", b"value", b"{", b"}", b"\"", b":"]
+
+
+def _text(size, rng):
+    out = bytearray()
+    while len(out) < size:
+        out += rng.choice(WORDS)
+    return bytes(out[:size])
+
+
+def build_profile(root, size_mb, seed=1):
+    """Mix of SQLite-like databases, compressible JSON and incompressible cache files"""
+    rng = random.Random(seed)
+    root = Path(root)
+    (root / "cache2" / "entries").mkdir(parents=True, exist_ok=True)
+    (root / "storage" / "default").mkdir(parents=True, exist_ok=True)
+    budget = size_mb * 1024 * 1024
+    databases = ["places.sqlite", "cookies.sqlite", "formhistory.sqlite",
+                 "favicons.sqlite", "webappsstore.sqlite"]
+    for name in databases:
+        size = budget // 10
+        half = size // 2
+        (root / name).write_bytes(_text(half, rng) + rng.randbytes(size - half))
+    (root / "sessionstore.jsonlz4").write_bytes(_text(budget // 20, rng))
+    (root / "prefs.js").write_bytes(_text(64 * 1024, rng))
+    cache_budget = budget - budget // 2 - budget // 20
+    index = 0
+    while cache_budget > 0:
+        size = min(cache_budget, rng.randint(4 * 1024, 256 * 1024))
+        (root / "cache2" / "entries" / f"{index:08X}").write_bytes(rng.randbytes(size))
+        cache_budget -= size
+        index += 1
+
+
+def touch_some(root, fraction, seed=2):
+    """Rewrite a fraction of the files to simulate a browsing session"""
+    rng = random.Random(seed)
+    files = sorted(p for p in Path(root).rglob("*") if p.is_file())
+    for path in rng.sample(files, max(1, int(len(files) * fraction))):
+        data = bytearray(path.read_bytes())
+        if data:
+            data[rng.randrange(len(data))] ^= 0xFF
+        path.write_bytes(bytes(data))
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def run(size_mb, workers, codec, level, keep):
+    work = Path(tempfile.mkdtemp(prefix="backup_bench_"))
+    try:
+        profile = work / "firefox_profile"
+        build_profile(profile, size_mb)
+        results = []
+
+        archive = work / "profile.tar.gz"
+        results.append(("tar -czf (full)", timed(lambda: subprocess.run(
+            ["tar", "-czf", str(archive), "-C", str(work), "firefox_profile"], check=True))))
+        out = work / "tar_out"
+        out.mkdir()
+        results.append(("tar -xzf", timed(lambda: subprocess.run(
+            ["tar", "-xzf", str(archive), "-C", str(out)], check=True))))
+
+        engine = BackupEngine(work / "store", workers, codec, level)
+        names = []
+        results.append((f"engine snapshot (cold, {engine.workers} workers)",
+                        timed(lambda: names.append(engine.snapshot(profile)[0]))))
+        touch_some(profile, 0.05)
+        results.append(("engine snapshot (5% changed)",
+                        timed(lambda: names.append(engine.snapshot(profile)[0]))))
+        results.append(("engine prune", timed(lambda: engine.prune(keep))))
+        results.append(("engine restore", timed(lambda: engine.restore(names[-1], work / "engine_out"))))
+
+        store_size = sum(p.stat().st_size for p in (work / "store").rglob("*") if p.is_file())
+        print(f"Synthetic profile: {size_mb} MiB, codec {codec}, level {level or 'default'}")
+        print("-" * 60)
+        for label, seconds in results:
+            print(f"{label:<45} {seconds:8.3f} s")
+        print("-" * 60)
+        print(f"{'tar.gz size':<45} {archive.stat().st_size / 1048576:8.1f} MiB")
+        print(f"{'snapshot store size (2 snapshots)':<45} {store_size / 1048576:8.1f} MiB")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare tar/gzip with the parallel backup engine")
+    parser.add_argument("--size", type=int, default=200, help="Synthetic profile size in MiB")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes")
+    parser.add_argument("--codec", default="zlib", choices=available_codecs())
+    parser.add_argument("--level", type=int, default=None)
+    parser.add_argument("--keep", type=int, default=5)
+
+    args = parser.parse_args()
+    run(args.size, args.workers, args.codec, args.level, args.keep)
+    sys.exit(0)
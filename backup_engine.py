@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Parallel backup engine for Firefox profile snapshots
+Compresses changed chunks and restores files across a process pool
+"""
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from snapshot_store import (SnapshotStore, CHUNK_SIZE, KEEP_SNAPSHOTS,
+                            available_codecs)
+from sqlite_backup import is_database_name, discard_sidecars
+from metrics import BACKUP_SECONDS, BACKUP_BYTES
+
+# Chunks handed to one worker task; large files are split across tasks
+CHUNKS_PER_TASK = 8
+
+
+def _create_pool(workers):
+    # forkserver: the launcher runs proxy and startup threads, forking it is unsafe
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("forkserver"))
+
+
+def _store_range(store_dir, chunk_size, codec, level, path, offset, count):
+    """Worker: read count chunks of path from offset and store them"""
+    store = SnapshotStore(store_dir, chunk_size, codec, level)
+    digests = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for _ in range(count):
+            data = f.read(chunk_size)
+            if not data:
+                break
+            digests.append(store.put_chunk(data))
+    return digests
+
+
+def _restore_file(store_dir, path, digests, mode, mtime_ns):
+    """Worker: stream chunks into one file, one decompressed chunk at a time"""
+    store = SnapshotStore(store_dir)
+    with open(path, "wb") as f:
+        for digest in digests:
+            f.write(store.get_chunk(digest))
+    os.chmod(path, mode)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+    if is_database_name(path):
+        discard_sidecars(path)
+    return len(digests)
+
+
+class BackupEngine:
+    def __init__(self, store_dir=None, workers=None, codec="zlib", level=None,
+                 chunk_size=CHUNK_SIZE):
+        if codec not in available_codecs():
+            raise ValueError(f"Codec {codec} is not available here: {available_codecs()}")
+        self.store = SnapshotStore(store_dir, chunk_size, codec, level)
+        self.workers = workers or os.cpu_count() or 1
+        self.codec = codec
+        self.level = level
+
+    def snapshot(self, source_dir):
+        """Snapshot source_dir, compressing changed chunks in parallel"""
+        started = time.perf_counter()
+        name, stats = self._snapshot(Path(source_dir))
+        BACKUP_SECONDS.labels("snapshot").observe(time.perf_counter() - started)
+        BACKUP_BYTES.labels("snapshot").set(stats["bytes"])
+        return name, stats
+
+    def _snapshot(self, source_dir):
+        # Shared store lock from planning to commit: gc() must not collect in between
+        with self.store.lock():
+            return self._snapshot_locked(source_dir)
+
+    def _snapshot_locked(self, source_dir):
+        store = self.store
+        manifest, changed = store.plan(source_dir)
+        if self.workers == 1 or not changed:
+            # Not worth a pool: chunk in this process, reusing the plan above
+            stats = store.store_changed(source_dir, manifest, changed)
+            return store.commit(manifest), stats
+        changed_bytes = sum(manifest["files"][rel]["size"] for rel in changed)
+
+        span = store.chunk_size * CHUNKS_PER_TASK
+        databases = [rel for rel in changed if is_database_name(rel)]
+        with _create_pool(self.workers) as pool:
+            jobs = {}
+            for rel in changed:
+                if is_database_name(rel):
+                    continue
+                size = manifest["files"][rel]["size"]
+                jobs[rel] = [
+                    pool.submit(_store_range, str(store.store_dir), store.chunk_size,
+                                self.codec, self.level, str(source_dir / rel),
+                                offset, CHUNKS_PER_TASK)
+                    for offset in range(0, max(size, 1), span)
+                ]
+            # Databases are copied through SQLite here while the pool chunks the rest
+            for rel in databases:
+                try:
+                    manifest["files"][rel]["chunks"] = store.store_file(source_dir / rel)
+                except FileNotFoundError:
+                    del manifest["files"][rel]
+            for rel, futures in jobs.items():
+                digests = []
+                try:
+                    for future in futures:
+                        digests.extend(future.result())
+                except FileNotFoundError:
+                    del manifest["files"][rel]
+                    continue
+                manifest["files"][rel]["chunks"] = digests
+
+        stats = {"files": len(manifest["files"]), "chunked": len(changed),
+                 "reused": len(manifest["files"]) - len(changed), "bytes": changed_bytes}
+        return store.commit(manifest), stats
+
+    def restore(self, name, target_dir):
+        """Restore a snapshot, writing files in parallel"""
+        started = time.perf_counter()
+        manifest = self._restore(name, target_dir)
+        BACKUP_SECONDS.labels("restore").observe(time.perf_counter() - started)
+        BACKUP_BYTES.labels("restore").set(sum(e["size"] for e in manifest["files"].values()))
+        return manifest
+
+    def _restore(self, name, target_dir):
+        manifest = self.store.load_manifest(name)
+        target_dir = Path(target_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        for rel in manifest["dirs"]:
+            (target_dir / rel).mkdir(parents=True, exist_ok=True)
+
+        files = manifest["files"]
+        if self.workers == 1:
+            for rel, entry in files.items():
+                (target_dir / rel).parent.mkdir(parents=True, exist_ok=True)
+                _restore_file(self.store.store_dir, target_dir / rel, entry["chunks"],
+                              entry["mode"], entry["mtime_ns"])
+        else:
+            with _create_pool(self.workers) as pool:
+                futures = []
+                # Largest files first so they do not end up last on one worker
+                for rel, entry in sorted(files.items(), key=lambda item: -item[1]["size"]):
+                    (target_dir / rel).parent.mkdir(parents=True, exist_ok=True)
+                    futures.append(pool.submit(
+                        _restore_file, str(self.store.store_dir), str(target_dir / rel),
+                        entry["chunks"], entry["mode"], entry["mtime_ns"]))
+                for future in futures:
+                    future.result()
+
+        for rel, link in manifest["links"].items():
+            path = target_dir / rel
+            if path.is_symlink() or path.exists():
+                path.unlink()
+            os.symlink(link, path)
+        return manifest
+
+    def prune(self, keep=KEEP_SNAPSHOTS):
+        return self.store.prune(keep)
+
+
+def backup_profile(profile_dir=None, store_dir=None, keep=KEEP_SNAPSHOTS,
+                   workers=None, codec="zlib", level=None):
+    """Snapshot the Firefox profile and apply retention"""
+    profile_dir = Path(profile_dir or Path.home() / "firefox_profile")
+    if not profile_dir.exists():
+        return None
+    engine = BackupEngine(store_dir, workers, codec, level)
+    name, stats = engine.snapshot(profile_dir)
+    removed = engine.prune(keep)
+    print(f"✓ تم حفظ جلسة Firefox: {name} "
+          f"({stats['chunked']} changed, {stats['reused']} unchanged, {removed} chunks collected)")
+    return name
+
+
+def restore_profile(profile_dir=None, store_dir=None, name=None, workers=None):
+    """Restore the newest (or named) snapshot into the profile directory"""
+    profile_dir = Path(profile_dir or Path.home() / "firefox_profile")
+    engine = BackupEngine(store_dir, workers)
+    name = name or engine.store.latest()
+    if not name:
+        return None
+    engine.restore(name, profile_dir)
+    return name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental Firefox profile snapshots")
+    parser.add_argument("command", choices=["snapshot", "restore", "list", "prune"])
+    parser.add_argument("--profile", default=None, help="Profile directory")
+    parser.add_argument("--store", default=None, help="Snapshot store directory")
+    parser.add_argument("--name", default=None, help="Snapshot to restore")
+    parser.add_argument("--keep", type=int, default=KEEP_SNAPSHOTS, help="Snapshots to keep")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--codec", default="zlib", choices=available_codecs(), help="Chunk codec")
+    parser.add_argument("--level", type=int, default=None, help="Compression level")
+
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        ok = backup_profile(args.profile, args.store, args.keep,
+                            args.workers, args.codec, args.level)
+    elif args.command == "restore":
+        ok = restore_profile(args.profile, args.store, args.name, args.workers)
+        if ok:
+            print(f"✓ تم استعادة {ok}")
+    elif args.command == "list":
+        for name in SnapshotStore(args.store).list_snapshots():
+            print(name)
+        ok = True
+    else:
+        print(f"✓ {SnapshotStore(args.store).prune(args.keep)} chunks collected")
+        ok = True
+    sys.exit(0 if ok else 1)
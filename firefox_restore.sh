@@ -3,19 +3,21 @@
 
 PROFILE_DIR="$HOME/firefox_profile"
 BACKUP_DIR="$HOME/firefox_backups"
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
 
 echo "🔄 استعادة بيانات فايرفوكس..."
 
-# العثور على أحدث نسخة احتياطية
+# العثور على أحدث لقطة
+LATEST_SNAPSHOT=$(python3 "$SCRIPT_DIR/backup_engine.py" list --store "$BACKUP_DIR/store" | tail -n1)
+
+# العثور على أحدث نسخة احتياطية بالتنسيق القديم
 LATEST_BACKUP=$(ls -t "$BACKUP_DIR"/firefox_backup_*.tar.gz 2>/dev/null | head -n1)
 
-if [ -z "$LATEST_BACKUP" ]; then
+if [ -z "$LATEST_SNAPSHOT" ] && [ -z "$LATEST_BACKUP" ]; then
     echo "❌ لا توجد نسخ احتياطية متاحة"
     exit 1
 fi
 
-echo "📂 استعادة من: $(basename $LATEST_BACKUP)"
-
 # حذف المجلد الحالي إذا كان موجوداً
 if [ -d "$PROFILE_DIR" ]; then
     rm -rf "$PROFILE_DIR"
@@ -23,7 +25,14 @@ if [ -d "$PROFILE_DIR" ]; then
 fi
 
 # استعادة النسخة الاحتياطية
-tar -xzf "$LATEST_BACKUP" -C "$HOME"
+if [ -n "$LATEST_SNAPSHOT" ]; then
+    echo "📂 استعادة من: $LATEST_SNAPSHOT"
+    python3 "$SCRIPT_DIR/backup_engine.py" restore \
+        --profile "$PROFILE_DIR" --store "$BACKUP_DIR/store" --name "$LATEST_SNAPSHOT"
+else
+    echo "📂 استعادة من: $(basename $LATEST_BACKUP)"
+    tar -xzf "$LATEST_BACKUP" -C "$HOME"
+fi
 
 if [ $? -eq 0 ]; then
     echo "✅ تم استعادة بيانات فايرفوكس بنجاح"
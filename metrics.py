@@ -0,0 +1,368 @@
+"""
+Metrics for the launcher, proxy and backups
+Counters, gauges and histograms rendered in the Prometheus text format
+and served over HTTP on localhost
+"""
+
+import os
+import math
+import bisect
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+METRICS_PORT = 9150
+
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format(value):
+    """Sample value, exactly: integral values as integers, others as repr(float)"""
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Child:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0.0
+
+
+class _CounterChild(_Child):
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class _GaugeChild(_Child):
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Metric:
+    kind = "untyped"
+    child_class = _Child
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _new_child(self):
+        return self.child_class()
+
+    def labels(self, *values):
+        """Child for one label combination; callers on hot paths should keep it"""
+        values = tuple(str(v) for v in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def remove(self, *values):
+        self.children.pop(tuple(str(v) for v in values), None)
+
+    def __getattr__(self, name):
+        # Unlabelled metrics forward inc/set/observe to their single child
+        if name in ("inc", "dec", "set", "observe") and not self.labelnames:
+            return getattr(self.labels(), name)
+        raise AttributeError(name)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self.children.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} {_format(child.value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+    child_class = _CounterChild
+
+
+class Gauge(Metric):
+    kind = "gauge"
+    child_class = _GaugeChild
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS,
+                 registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for values, child in sorted(self.children.items()):
+            with child.lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _format(bound)
+                lines.append(f"{self.name}_bucket"
+                             f"{_labels(self.labelnames, values, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, values)} {_format(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+
+    def add_collector(self, func):
+        """Call func() before every scrape to refresh gauges"""
+        with self.lock:
+            self.collectors.append(func)
+
+    def render(self):
+        for func in list(self.collectors):
+            try:
+                func()
+            except Exception:
+                pass
+        lines = []
+        for metric in list(self.metrics):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def snapshot_metrics(metrics):
+    """Plain-data copy of metric values that can be sent to another process"""
+    out = {}
+    for metric in metrics:
+        children = {}
+        for values, child in list(metric.children.items()):
+            if isinstance(child, _HistogramChild):
+                with child.lock:
+                    children[values] = (list(child.counts), child.sum)
+            else:
+                children[values] = child.value
+        out[metric.name] = (metric.kind, children)
+    return out
+
+
+def merge_snapshots(snapshots, gauges=True):
+    """Sum snapshots from several processes; gauges are left out when gauges=False"""
+    merged = {}
+    for snapshot in snapshots:
+        for name, (kind, children) in snapshot.items():
+            if kind == "gauge" and not gauges:
+                continue
+            target = merged.setdefault(name, (kind, {}))[1]
+            for values, value in children.items():
+                old = target.get(values)
+                if old is None:
+                    target[values] = value
+                elif kind == "histogram":
+                    target[values] = ([a + b for a, b in zip(old[0], value[0])], old[1] + value[1])
+                else:
+                    target[values] = old + value
+    return merged
+
+
+def apply_snapshot(metrics, snapshot):
+    """Overwrite the values of metrics with a (merged) snapshot"""
+    for metric in metrics:
+        _, children = snapshot.get(metric.name, (None, {}))
+        for values in list(metric.children):
+            if values not in children:
+                metric.remove(*values)
+        for values, value in children.items():
+            child = metric.labels(*values)
+            with child.lock:
+                if isinstance(child, _HistogramChild):
+                    child.counts, child.sum = list(value[0]), value[1]
+                else:
+                    child.value = value
+
+
+REGISTRY = Registry()
+
+STARTUP_PHASE_SECONDS = Gauge(
+    "vnc_startup_phase_seconds", "Wall time of each startup phase", ["phase"])
+STARTUP_TOTAL_SECONDS = Gauge(
+    "vnc_startup_total_seconds", "Wall time from launch until every startup phase finished")
+PROXY_CONNECTIONS = Gauge(
+    "vnc_proxy_active_connections", "Open WebSocket connections relayed by the proxy")
+PROXY_BYTES = Counter(
+    "vnc_proxy_bytes_total", "Payload bytes relayed by the proxy", ["direction"])
+PROXY_MESSAGES = Counter(
+    "vnc_proxy_messages_total", "Messages relayed by the proxy", ["direction"])
+PROXY_RELAY_SECONDS = Histogram(
+    "vnc_proxy_relay_seconds", "Time from receiving data to handing it to the other side",
+    ["direction"], buckets=LATENCY_BUCKETS)
+PROXY_TRANSCODE_BYTES = Counter(
+    "vnc_proxy_transcode_bytes_total",
+    "Framebuffer update bytes before (raw) and after (encoded) proxy transcoding", ["stage"])
+PROXY_DEFLATE_BYTES = Counter(
+    "vnc_proxy_deflate_bytes_total",
+    "permessage-deflate bytes: raw and compressed for deflated messages, skipped when sent as is",
+    ["stage"])
+PROXY_DEFLATE_SECONDS = Counter(
+    "vnc_proxy_deflate_cpu_seconds_total", "CPU time spent in permessage-deflate", ["direction"])
+PROXY_BROADCAST_VIEWERS = Gauge(
+    "vnc_proxy_broadcast_viewers", "View-only viewers attached to shared sessions")
+PROXY_BROADCAST_UPDATES = Counter(
+    "vnc_proxy_broadcast_updates_total",
+    "Shared-session updates encoded for a viewer, or shared with one owed the same area",
+    ["source"])
+PROXY_BROADCAST_MERGED = Counter(
+    "vnc_proxy_broadcast_merged_total",
+    "Desktop updates folded into a later one for a viewer that was not ready")
+BACKUP_SECONDS = Histogram(
+    "vnc_backup_duration_seconds", "Duration of profile backup and restore operations",
+    ["operation"])
+BACKUP_BYTES = Gauge(
+    "vnc_backup_last_bytes", "Bytes read (snapshot) or written (restore) by the last operation",
+    ["operation"])
+BACKUP_SQLITE_COPIES = Counter(
+    "vnc_backup_sqlite_copies_total",
+    "SQLite databases copied through the backup API (online) or as recovered files (file)",
+    ["method"])
+PROFILE_TMPFS_BYTES = Gauge(
+    "vnc_profile_tmpfs_bytes", "Size of the Firefox profile held in tmpfs")
+SESSION_FROZEN = Gauge(
+    "vnc_session_frozen", "1 while the idle desktop is frozen")
+SESSION_HIBERNATIONS = Counter(
+    "vnc_session_hibernations_total", "Times the desktop was frozen for lack of viewers")
+SESSION_CPU_SECONDS = Gauge(
+    "vnc_session_cpu_seconds_total", "CPU time of a desktop session's cgroup", ["session"])
+SESSION_MEMORY_BYTES = Gauge(
+    "vnc_session_memory_bytes", "Memory charged to a desktop session's cgroup", ["session"])
+SESSION_IO_BYTES = Gauge(
+    "vnc_session_io_bytes_total", "Block IO of a desktop session's cgroup",
+    ["session", "direction"])
+LOG_LINES = Counter(
+    "vnc_service_log_lines_total", "Output lines captured from a desktop service", ["service"])
+LOG_DROPPED = Counter(
+    "vnc_service_log_dropped_total", "Captured lines not written to a log file in time", ["service"])
+PROCESS_RSS_BYTES = Gauge(
+    "vnc_process_resident_memory_bytes", "Resident set size of a desktop service", ["service"])
+PROCESS_CPU_SECONDS = Gauge(
+    "vnc_process_cpu_seconds_total", "User plus system CPU time of a desktop service",
+    ["service"])
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def process_stats(pid):
+    """(rss_bytes, cpu_seconds) from /proc, or None if the process is gone"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    # fields[0] is the state (field 3); utime and stime are fields 14 and 15
+    cpu = (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+    return rss_pages * _PAGE_SIZE, cpu
+
+
+def watch_services(services):
+    """Export RSS and CPU for the Popen handles in a service-name dict"""
+    def collect():
+        for name, handle in list(services.items()):
+            stats = process_stats(handle.pid) if hasattr(handle, "pid") else None
+            if stats is None:
+                PROCESS_RSS_BYTES.remove(name)
+                PROCESS_CPU_SECONDS.remove(name)
+                continue
+            PROCESS_RSS_BYTES.labels(name).set(stats[0])
+            PROCESS_CPU_SECONDS.labels(name).set(stats[1])
+    REGISTRY.add_collector(collect)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    def __init__(self, port=METRICS_PORT, host="127.0.0.1"):
+        self.port = port
+        self.host = host
+        self.server = None
+        self.thread = None
+
+    def start_in_thread(self):
+        self.server = ThreadingHTTPServer((self.host, self.port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name="metrics", daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
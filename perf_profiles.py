@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Declarative performance profiles
+One named profile (lan, wan, mobile, ...) from perf_profiles.json tunes the
+Xvnc arguments and the matching noVNC client defaults together
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+PROFILES_FILE = ROOT / "perf_profiles.json"
+CLIENT_DEFAULTS = ROOT / "defaults.json"
+
+# Profile key: (Xvnc option, allowed range)
+XVNC_OPTIONS = {
+    "depth": ("-depth", (8, 32)),
+    "compare_fb": ("-CompareFB", (0, 2)),
+    "zlib_level": ("-ZlibLevel", (0, 9)),
+    "frame_rate": ("-FrameRate", (1, 240)),
+    "max_cut_text": ("-MaxCutText", (0, 1 << 30)),
+}
+# Profile key: allowed range of the noVNC setting of the same name
+CLIENT_OPTIONS = {
+    "quality": (0, 9),
+    "compression": (0, 9),
+}
+
+
+class PerfProfile:
+    def __init__(self, name, settings, xvnc="Xvnc", vncpasswd="vncpasswd"):
+        self.name = name
+        self.settings = settings
+        self.description = settings.get("description", "")
+        self.geometry = settings.get("geometry", "1024x768")
+        self.transcode = bool(settings.get("transcode", False))
+        # permessage-deflate between the proxy and the browser
+        self.deflate = bool(settings.get("deflate", False))
+        self.xvnc = xvnc
+        self.vncpasswd = vncpasswd
+
+    def xvnc_args(self):
+        """Xvnc options for this profile, in the order they are declared"""
+        args = []
+        for key, value in self.settings.items():
+            if key in XVNC_OPTIONS:
+                args += [XVNC_OPTIONS[key][0], str(value)]
+        return args
+
+    def client_defaults(self):
+        return {key: self.settings[key] for key in CLIENT_OPTIONS if key in self.settings}
+
+    def write_client_defaults(self, path=CLIENT_DEFAULTS):
+        """Merge the profile's noVNC settings into defaults.json; True if it changed"""
+        path = Path(path)
+        try:
+            defaults = json.loads(path.read_text() or "{}")
+        except FileNotFoundError:
+            defaults = {}
+        updated = {**defaults, **self.client_defaults()}
+        if updated == defaults and path.exists():
+            return False
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(updated, indent=4) + "\n")
+        os.replace(tmp, path)
+        return True
+
+
+def _check(name, key, value, bounds):
+    low, high = bounds
+    if not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high:
+        raise ValueError(f"profile {name}: {key} must be an integer in {low}..{high}, got {value!r}")
+
+
+def _executable(configured, fallback):
+    if configured and Path(configured).exists():
+        return configured
+    return shutil.which(fallback) or configured or fallback
+
+
+def load_profiles(path=PROFILES_FILE):
+    """(default profile name, {name: settings}, config) from the profiles file"""
+    config = json.loads(Path(path).read_text())
+    profiles = config.get("profiles") or {}
+    if not profiles:
+        raise ValueError(f"{path} defines no profiles")
+    for name, settings in profiles.items():
+        for key, (_, bounds) in XVNC_OPTIONS.items():
+            if key in settings:
+                _check(name, key, settings[key], bounds)
+        for key, bounds in CLIENT_OPTIONS.items():
+            if key in settings:
+                _check(name, key, settings[key], bounds)
+    return config.get("profile") or next(iter(profiles)), profiles, config
+
+
+def load_profile(name=None, path=PROFILES_FILE):
+    """The named profile, else VNC_PERF_PROFILE, else the file's default"""
+    default, profiles, config = load_profiles(path)
+    name = name or os.environ.get("VNC_PERF_PROFILE") or default
+    if name not in profiles:
+        raise ValueError(f"Unknown performance profile {name!r} (available: {', '.join(profiles)})")
+    return PerfProfile(name, profiles[name],
+                       _executable(config.get("xvnc"), "Xvnc"),
+                       _executable(config.get("vncpasswd"), "vncpasswd"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or apply performance profiles")
+    parser.add_argument("command", choices=["list", "show", "apply"])
+    parser.add_argument("name", nargs="?", default=None, help="Profile (default: configured)")
+    parser.add_argument("--config", default=str(PROFILES_FILE), help="Profiles file")
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == "list":
+            default, profiles, _ = load_profiles(args.config)
+            for name, settings in profiles.items():
+                marker = "*" if name == default else " "
+                print(f"{marker} {name:<10}{settings.get('description', '')}")
+            sys.exit(0)
+        profile = load_profile(args.name, args.config)
+    except ValueError as e:
+        print(f"✗ {e}")
+        sys.exit(1)
+    if args.command == "show":
+        print(f"{profile.name}: {profile.description}")
+        print(f"  Xvnc:  {' '.join(profile.xvnc_args())}")
+        print(f"  noVNC: {json.dumps(profile.client_defaults())}")
+        print(f"  Proxy transcoding: {'on' if profile.transcode else 'off'}")
+        print(f"  permessage-deflate: {'on' if profile.deflate else 'off'}")
+    else:
+        changed = profile.write_client_defaults()
+        print(f"✓ {CLIENT_DEFAULTS.name} {'updated' if changed else 'already matches'} for {profile.name}")
+    sys.exit(0)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Benchmark: replay recorded RFB sessions through the noVNC decoders
+Serves tests/vnc_playback.html to a headless browser for every recording in a
+corpus and reports frames per second and decode time per encoding
+"""
+
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from urllib.parse import quote, unquote, urlsplit
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+from session_recorder import RECORDINGS_DIR
+
+ROOT = Path(__file__).resolve().parent
+BROWSERS = ["firefox", "chromium", "chromium-browser", "google-chrome"]
+
+
+class PlaybackHandler(SimpleHTTPRequestHandler):
+    """Serves the repository, the corpus under /recordings/ and takes results"""
+    corpus = {}
+    results = {}
+    done = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=str(ROOT), **kwargs)
+
+    def translate_path(self, path):
+        parts = unquote(urlsplit(path).path).split("/")
+        if len(parts) == 3 and parts[1] == "recordings" and parts[2] in self.corpus:
+            return str(self.corpus[parts[2]])
+        return super().translate_path(path)
+
+    def do_POST(self):
+        name = unquote(urlsplit(self.path).path).rsplit("/", 1)[-1]
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            self.results[name] = json.loads(body)
+        except ValueError:
+            self.results[name] = {"error": "malformed report"}
+        self.send_response(204)
+        self.end_headers()
+        self.done.set()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def find_browser(name=None):
+    for candidate in [name] if name else BROWSERS:
+        path = shutil.which(candidate)
+        if path:
+            return path
+    return None
+
+
+def browser_command(browser, url, profile):
+    if "firefox" in Path(browser).name:
+        return [browser, "--headless", "--no-remote", "--profile", profile, url]
+    return [browser, "--headless=new", "--disable-gpu", "--no-first-run",
+            f"--user-data-dir={profile}", url]
+
+
+def replay(browser, port, name, iterations, realtime, timeout):
+    """Play one recording; returns the page's report or None on timeout"""
+    PlaybackHandler.done = threading.Event()
+    mode = "realtime" if realtime else "perftest"
+    report = quote(f"/results/{name}", safe="")
+    url = (f"http://127.0.0.1:{port}/tests/vnc_playback.html?data={quote(name)}"
+           f"&iterations={iterations}&mode={mode}&autostart=1&report={report}")
+    with tempfile.TemporaryDirectory(prefix="playback_browser_") as profile:
+        process = subprocess.Popen(browser_command(browser, url, profile),
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            PlaybackHandler.done.wait(timeout)
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    return PlaybackHandler.results.get(name)
+
+
+def summarize(result):
+    """(average ms, fps, {encoding: (rects, ms)}) over the iterations of one report"""
+    runs = result.get("iterations") or []
+    if not runs:
+        return None
+    duration = sum(run["duration"] for run in runs)
+    updates = sum(run["updates"] for run in runs)
+    encodings = {}
+    for run in runs:
+        for name, enc in run["encodings"].items():
+            rects, ms = encodings.get(name, (0, 0.0))
+            encodings[name] = (rects + enc["rects"], ms + enc["ms"])
+    return duration / len(runs), updates * 1000 / max(duration, 1), encodings
+
+
+def print_table(title, encodings):
+    print(title)
+    print(f"  {'encoding':<12}{'rects':>10}{'decode ms':>12}{'us/rect':>10}")
+    for name, (rects, ms) in sorted(encodings.items(), key=lambda item: -item[1][1]):
+        per_rect = ms * 1000 / rects if rects else 0
+        print(f"  {name:<12}{rects:>10}{ms:>12.1f}{per_rect:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded sessions and time the decoders")
+    parser.add_argument("corpus", nargs="*", default=[str(RECORDINGS_DIR)],
+                        help="Recording files or directories (default: recordings/)")
+    parser.add_argument("--iterations", type=int, default=3, help="Replays per recording")
+    parser.add_argument("--realtime", action="store_true",
+                        help="Honour recorded timestamps instead of replaying at full speed")
+    parser.add_argument("--browser", default=None, help="Browser executable (default: auto)")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds allowed per recording")
+    parser.add_argument("--port", type=int, default=0, help="HTTP port (default: any free port)")
+    args = parser.parse_args()
+
+    corpus = {}
+    for entry in map(Path, args.corpus):
+        for path in sorted(entry.glob("*.js")) if entry.is_dir() else [entry]:
+            corpus[path.name] = path.resolve()
+    if not corpus:
+        print("✗ No recordings found; start the desktop with --record to create some")
+        return False
+    browser = find_browser(args.browser)
+    if not browser:
+        print(f"✗ No headless browser found (tried {', '.join(BROWSERS)})")
+        return False
+
+    PlaybackHandler.corpus = corpus
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), PlaybackHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    print(f"Replaying {len(corpus)} recordings x{args.iterations} with {Path(browser).name}")
+
+    totals = {}
+    ok = True
+    try:
+        for name in corpus:
+            result = replay(browser, port, name, args.iterations, args.realtime, args.timeout)
+            if result is None or "error" in result:
+                print(f"✗ {name}: {result['error'] if result else 'timed out'}")
+                ok = False
+                continue
+            summary = summarize(result)
+            if summary is None:
+                print(f"✗ {name}: no iterations completed")
+                ok = False
+                continue
+            average, fps, encodings = summary
+            print_table(f"\n{name}: {average:.0f} ms per replay, {fps:.1f} fps", encodings)
+            for enc, (rects, ms) in encodings.items():
+                total_rects, total_ms = totals.get(enc, (0, 0.0))
+                totals[enc] = (total_rects + rects, total_ms + ms)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    if len(corpus) > 1 and totals:
+        print_table("\nCorpus total", totals)
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
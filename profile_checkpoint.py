@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Background checkpointing of the Firefox profile
+Watches the profile with inotify, collects dirty paths and writes small
+incremental snapshots on a debounce timer at idle I/O priority
+"""
+
+import os
+import sys
+import time
+import errno
+import ctypes
+import select
+import struct
+import argparse
+import platform
+import threading
+from pathlib import Path
+
+from snapshot_store import SnapshotStore, KEEP_SNAPSHOTS, CHECKPOINT_TAG, snapshot_tag
+from sqlite_backup import is_sidecar
+from metrics import BACKUP_SECONDS, BACKUP_BYTES
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+# Events that mean a -wal/-journal file's contents changed
+SIDECAR_MASK = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT = struct.Struct("iIII")
+
+DEBOUNCE = 5.0          # seconds without changes before a checkpoint
+MAX_DELAY = 30.0        # checkpoint at least this often while changes keep coming
+READ_RATE = 16 * 1024 * 1024   # bytes per second read while checkpointing
+PRUNE_EVERY = 20        # checkpoints between retention passes
+KEEP_CHECKPOINTS = 50   # checkpoints kept, besides the session snapshots (KEEP_SNAPSHOTS)
+
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_SET = {"x86_64": 251, "aarch64": 30, "i686": 289, "armv7l": 314}
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+def set_idle_priority():
+    """Move the calling thread to the idle I/O class and lowest CPU priority"""
+    tid = threading.get_native_id()
+    number = IOPRIO_SET.get(platform.machine())
+    if number is not None:
+        _libc.syscall(number, IOPRIO_WHO_PROCESS, tid, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT)
+    try:
+        os.setpriority(os.PRIO_PROCESS, tid, 19)
+    except OSError:
+        pass
+
+
+class IOThrottle:
+    """Sleep as needed to keep reads under rate bytes per second"""
+
+    def __init__(self, rate=READ_RATE):
+        self.rate = rate
+        self.started = None
+        self.total = 0
+
+    def reset(self):
+        self.started = time.monotonic()
+        self.total = 0
+
+    def __call__(self, nbytes):
+        if self.started is None:
+            self.reset()
+        self.total += nbytes
+        ahead = self.total / self.rate - (time.monotonic() - self.started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+class Inotify:
+    def __init__(self):
+        self.fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.paths = {}
+
+    def add(self, path):
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return None
+            raise OSError(err, f"inotify_add_watch {path}: {os.strerror(err)}")
+        self.paths[wd] = Path(path)
+        return wd
+
+    def add_tree(self, root):
+        self.add(root)
+        for directory, dirnames, _ in os.walk(root):
+            for name in dirnames:
+                path = Path(directory) / name
+                if not path.is_symlink():
+                    self.add(path)
+
+    def read(self):
+        """Pending events as (directory, mask, name)"""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, pos)
+            pos += EVENT.size
+            name = data[pos:pos + length].rstrip(b"\0")
+            pos += length
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+            events.append((self.paths.get(wd), mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ProfileCheckpointer:
+    def __init__(self, profile_dir=None, store_dir=None, debounce=DEBOUNCE, max_delay=MAX_DELAY,
+                 read_rate=READ_RATE, keep=KEEP_SNAPSHOTS, keep_checkpoints=KEEP_CHECKPOINTS):
+        self.profile_dir = Path(profile_dir or Path.home() / "firefox_profile").resolve()
+        self.store = SnapshotStore(store_dir)
+        self.store.throttle = IOThrottle(read_rate) if read_rate else None
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.keep = keep
+        self.keep_checkpoints = keep_checkpoints
+        self.dirty = set()
+        self.rescan = False
+        self.first_change = None
+        self.last_change = None
+        self.checkpoints = 0
+        self.lock = threading.Lock()
+        self.inotify = None
+        self.thread = None
+        self.wake_r, self.wake_w = os.pipe()
+        self.running = False
+
+    def _rel(self, path):
+        return str(path.relative_to(self.profile_dir))
+
+    def _mark(self, rel):
+        now = time.monotonic()
+        with self.lock:
+            self.dirty.add(rel)
+            self.first_change = self.first_change or now
+            self.last_change = now
+
+    def _handle(self, directory, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            # Events were lost: the next checkpoint walks the whole profile
+            self.rescan = True
+            self._mark(".")
+            return
+        if directory is None or not name:
+            return
+        if is_sidecar(name) and (name.endswith("-shm") or not mask & SIDECAR_MASK):
+            # SQLite's wal-index is never stored, and readers (the database
+            # copies taken here included) open and chown the other sidecars
+            return
+        path = directory / name
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            self.inotify.add_tree(path)
+        self._mark(self._rel(path))
+
+    def _due(self):
+        with self.lock:
+            if self.first_change is None:
+                return None
+            return min(self.last_change + self.debounce, self.first_change + self.max_delay)
+
+    def _run(self):
+        set_idle_priority()
+        while self.running:
+            due = self._due()
+            timeout = None if due is None else max(due - time.monotonic(), 0)
+            readable, _, _ = select.select([self.inotify.fd, self.wake_r], [], [], timeout)
+            if self.inotify.fd in readable:
+                for event in self.inotify.read():
+                    self._handle(*event)
+            if self.wake_r in readable:
+                os.read(self.wake_r, 64)
+            due = self._due()
+            if due is not None and time.monotonic() >= due:
+                try:
+                    self.checkpoint()
+                except Exception as e:
+                    print(f"⚠ Profile checkpoint failed: {e}")
+
+    def checkpoint(self, session=False):
+        """Snapshot the dirty paths now; returns the snapshot name or None
+
+        Checkpoints are tagged and pruned to ``keep_checkpoints`` on their
+        own.  The first one (the state the session started from) and, with
+        ``session``, the last one are session snapshots instead, kept like
+        any other backup, so the profile can be rolled back past this session.
+        """
+        # The baseline is the first checkpoint
+        session = session or self.checkpoints == 0
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            rescan, self.rescan = self.rescan, False
+            self.first_change = self.last_change = None
+        if not dirty and not rescan:
+            latest = self.store.latest()
+            if not session or latest is None or snapshot_tag(latest) != CHECKPOINT_TAG:
+                return None
+            # Nothing changed since the last checkpoint: record it again as a session snapshot
+        started = time.perf_counter()
+        if self.store.throttle:
+            self.store.throttle.reset()
+        paths = None if rescan or "." in dirty else dirty
+        try:
+            name, stats = self.store.snapshot(self.profile_dir, paths,
+                                              "" if session else CHECKPOINT_TAG)
+        except Exception:
+            # Keep the paths dirty so the next checkpoint retries them
+            with self.lock:
+                self.dirty |= dirty
+                self.rescan = self.rescan or rescan
+            raise
+        BACKUP_SECONDS.labels("checkpoint").observe(time.perf_counter() - started)
+        BACKUP_BYTES.labels("checkpoint").set(stats["bytes"])
+        self.checkpoints += 1
+        if self.checkpoints % PRUNE_EVERY == 0:
+            self.store.prune(self.keep_checkpoints, CHECKPOINT_TAG)
+        return name
+
+    def start(self):
+        """Take a baseline snapshot, then watch the profile in a background thread"""
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        self.inotify = Inotify()
+        # Watch first so nothing written during the baseline is missed
+        self.inotify.add_tree(self.profile_dir)
+        self.running = True
+        self.rescan = True
+        self._mark(".")
+        self.thread = threading.Thread(target=self._run, name="profile-checkpoint", daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self, flush=True):
+        """Stop watching; with flush, write whatever changed since the last checkpoint"""
+        if not self.running:
+            return None
+        self.running = False
+        os.write(self.wake_w, b"x")
+        self.thread.join()
+        for event in self.inotify.read():
+            self._handle(*event)
+        self.inotify.close()
+        if not flush:
+            return None
+        # Full speed now: shutdown is waiting on this
+        self.store.throttle = None
+        name = self.checkpoint(session=True)
+        self.store.prune(self.keep_checkpoints, CHECKPOINT_TAG)
+        self.store.prune(self.keep)
+        return name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checkpoint the Firefox profile as it changes")
+    parser.add_argument("--profile", default=None, help="Profile directory")
+    parser.add_argument("--store", default=None, help="Snapshot store directory")
+    parser.add_argument("--debounce", type=float, default=DEBOUNCE,
+                        help="Quiet seconds before a checkpoint")
+    parser.add_argument("--rate", type=int, default=READ_RATE // (1024 * 1024),
+                        help="Read limit in MiB/s while checkpointing (0: unlimited)")
+
+    args = parser.parse_args()
+
+    checkpointer = ProfileCheckpointer(args.profile, args.store, args.debounce,
+                                       read_rate=args.rate * 1024 * 1024)
+    checkpointer.start()
+    print(f"✓ Checkpointing {checkpointer.profile_dir}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        name = checkpointer.stop()
+        print(f"\n✓ Final checkpoint: {name or 'nothing changed'}")
+    sys.exit(0)
@@ -0,0 +1,134 @@
+"""
+Lazy restore of the Firefox profile
+Stages the newest backup in a side directory while the desktop starts,
+then swaps it in with a directory rename just before Firefox launches
+"""
+
+import os
+import time
+import ctypes
+import shutil
+import subprocess
+import threading
+from pathlib import Path
+
+from backup_engine import BackupEngine
+
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _renameat2 = _libc.renameat2
+    _renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int,
+                           ctypes.c_char_p, ctypes.c_uint]
+except (OSError, AttributeError):
+    _renameat2 = None
+
+
+def exchange_directories(a, b):
+    """Atomically swap two paths with renameat2(RENAME_EXCHANGE); False if unsupported"""
+    if _renameat2 is None:
+        return False
+    result = _renameat2(AT_FDCWD, os.fsencode(a), AT_FDCWD, os.fsencode(b), RENAME_EXCHANGE)
+    return result == 0
+
+
+def delete_in_background(*paths):
+    """Remove directories on a background thread instead of inline"""
+    def remove():
+        for path in paths:
+            shutil.rmtree(path, ignore_errors=True)
+    thread = threading.Thread(target=remove, name="profile-cleanup", daemon=True)
+    thread.start()
+    return thread
+
+
+class LazyProfileRestore:
+    def __init__(self, profile_dir=None, backup_dir=None):
+        self.profile_dir = Path(profile_dir or Path.home() / "firefox_profile")
+        self.backup_dir = Path(backup_dir or Path.home() / "firefox_backups")
+        self.staging_root = self.profile_dir.parent / ".firefox_restore"
+        self.staged_dir = self.staging_root / self.profile_dir.name
+        self.trash_prefix = f".{self.profile_dir.name}_trash_"
+        self.thread = None
+        self.source = None
+        self.error = None
+        self.staged = False
+
+    def find_source(self):
+        """Newest snapshot name, else the newest legacy tar.gz archive"""
+        engine = BackupEngine(self.backup_dir / "store")
+        latest = engine.store.latest()
+        if latest:
+            return latest
+        if self.backup_dir.exists():
+            archives = list(self.backup_dir.glob("firefox_session_*.tar.gz"))
+            if archives:
+                return max(archives, key=lambda x: x.stat().st_mtime)
+        return None
+
+    def start(self):
+        """Begin staging in the background; returns False when there is nothing to restore"""
+        # Leftovers from a previous run that exited before cleanup finished
+        leftovers = list(self.profile_dir.parent.glob(f"{self.trash_prefix}*"))
+        if leftovers:
+            delete_in_background(*leftovers)
+
+        self.source = self.find_source()
+        if self.source is None:
+            return False
+        self.thread = threading.Thread(target=self._stage, name="profile-restore", daemon=True)
+        self.thread.start()
+        return True
+
+    def _stage(self):
+        try:
+            shutil.rmtree(self.staging_root, ignore_errors=True)
+            self.staging_root.mkdir(parents=True)
+            if isinstance(self.source, Path):
+                subprocess.run(["tar", "-xzf", str(self.source), "-C", str(self.staging_root)],
+                               capture_output=True, check=True)
+            else:
+                BackupEngine(self.backup_dir / "store").restore(self.source, self.staged_dir)
+            self.staged = self.staged_dir.is_dir()
+        except Exception as e:
+            self.error = e
+
+    def finish(self, timeout=None):
+        """Wait for staging, then swap the staged profile into place"""
+        if self.thread is None:
+            return False
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            return False
+        if not self.staged:
+            # Staging failed (see error): nothing will be swapped in
+            self.thread = None
+            delete_in_background(self.staging_root)
+            return False
+
+        trash = self.profile_dir.parent / f"{self.trash_prefix}{int(time.time() * 1000)}"
+        if self.profile_dir.exists():
+            if exchange_directories(self.staged_dir, self.profile_dir):
+                os.rename(self.staged_dir, trash)
+            else:
+                os.rename(self.profile_dir, trash)
+                os.rename(self.staged_dir, self.profile_dir)
+            delete_in_background(trash, self.staging_root)
+        else:
+            os.rename(self.staged_dir, self.profile_dir)
+            delete_in_background(self.staging_root)
+        self.thread = None
+        self.staged = False
+        return True
+
+    def pending(self):
+        """True while the restore is staging or its staged profile awaits the swap
+
+        The on-disk profile is not the user's until then, so it must not be
+        backed up; a failed staging is not pending.
+        """
+        if self.thread is None:
+            return False
+        return self.thread.is_alive() or self.staged
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Load generator for the WebSocket proxy
+Ramps up concurrent RFB viewers through the proxy port step by step and
+reports throughput, per-connection update latency and the proxy's CPU and
+memory at each step
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+from metrics import process_stats
+from rfb_client import RFBClient, ENCODINGS, AuthenticationError
+from rfb_benchmark import XWorkload, WORKLOADS, percentile
+
+TCP_LISTEN = "0A"
+
+
+class Viewer(threading.Thread):
+    """One simulated noVNC client requesting updates as fast as they arrive"""
+
+    def __init__(self, args):
+        super().__init__(name="viewer", daemon=True)
+        self.args = args
+        self.samples = []
+        self.error = None
+        self.running = True
+        self.client = None
+
+    def take(self):
+        """Samples since the last call: [(latency seconds, RFB bytes, bytes on the wire)]"""
+        samples, self.samples = self.samples, []
+        return samples
+
+    def run(self):
+        args = self.args
+        try:
+            self.client = RFBClient.connect_websocket(args.host, args.port, args.path,
+                                                      args.password, timeout=args.timeout,
+                                                      deflate=args.deflate)
+            self.client.use_encoding(args.encoding, args.quality, args.compression)
+            transport = self.client.transport
+            incremental = False
+            while self.running:
+                started = time.perf_counter()
+                wire = transport.wire_received
+                self.client.request_update(incremental)
+                rects, nbytes = self.client.read_update()
+                self.samples.append((time.perf_counter() - started, nbytes,
+                                     transport.wire_received - wire))
+                incremental = args.request == "incremental"
+        except (OSError, AuthenticationError) as e:
+            if self.running:
+                self.error = e
+        finally:
+            if self.client:
+                self.client.close()
+
+    def stop(self):
+        self.running = False
+        if self.client:
+            # Unblocks a viewer waiting on the socket
+            self.client.close()
+
+
+def listening_pids(port):
+    """PIDs of the processes with a listening TCP socket on port"""
+    inodes = set()
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if fields[3] == TCP_LISTEN and int(fields[1].rsplit(":", 1)[1], 16) == port:
+                        inodes.add(fields[9])
+        except OSError:
+            continue
+    pids = set()
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            for fd in os.listdir(f"/proc/{pid}/fd"):
+                link = os.readlink(f"/proc/{pid}/fd/{fd}")
+                if link.startswith("socket:[") and link[8:-1] in inodes:
+                    pids.add(int(pid))
+                    break
+        except OSError:
+            continue
+    return sorted(pids)
+
+
+def proxy_usage(pids):
+    """(rss bytes, cpu seconds) summed over the proxy processes"""
+    rss = cpu = 0
+    for pid in pids:
+        stats = process_stats(pid)
+        if stats:
+            rss += stats[0]
+            cpu += stats[1]
+    return rss, cpu
+
+
+def run_step(viewers, duration, pids):
+    for viewer in viewers:
+        viewer.take()
+    _, cpu_before = proxy_usage(pids)
+    started = time.perf_counter()
+    time.sleep(duration)
+    elapsed = time.perf_counter() - started
+    rss, cpu_after = proxy_usage(pids)
+
+    latencies, worst, total, wire, updates = [], 0.0, 0, 0, 0
+    for viewer in viewers:
+        samples = viewer.take()
+        times = [s[0] for s in samples]
+        latencies += times
+        worst = max(worst, percentile(times, 99))
+        total += sum(s[1] for s in samples)
+        wire += sum(s[2] for s in samples)
+        updates += len(samples)
+    return {
+        "viewers": len(viewers),
+        "errors": sum(1 for v in viewers if v.error),
+        "updates_per_s": updates / elapsed,
+        "mib_per_s": total / elapsed / (1024 * 1024),
+        "wire_mib_per_s": wire / elapsed / (1024 * 1024),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "worst_p99_ms": worst * 1000,
+        "proxy_cpu_pct": (cpu_after - cpu_before) / elapsed * 100 if pids else None,
+        "proxy_rss_mib": rss / (1024 * 1024) if pids else None,
+    }
+
+
+def print_row(row):
+    cpu = f"{row['proxy_cpu_pct']:.0f}" if row["proxy_cpu_pct"] is not None else "-"
+    rss = f"{row['proxy_rss_mib']:.0f}" if row["proxy_rss_mib"] is not None else "-"
+    print(f"  {row['viewers']:>7}{row['errors']:>7}{row['updates_per_s']:>10.0f}"
+          f"{row['mib_per_s']:>9.1f}{row['wire_mib_per_s']:>9.1f}{row['p50_ms']:>9.1f}"
+          f"{row['p99_ms']:>9.1f}{row['worst_p99_ms']:>11.1f}{cpu:>8}{rss:>8}")
+
+
+def compare(rows, baseline_file, tolerance):
+    """Steps whose throughput fell more than tolerance below the baseline"""
+    with open(baseline_file) as f:
+        baseline = {row["viewers"]: row for row in json.load(f)["steps"]}
+    regressions = []
+    for row in rows:
+        base = baseline.get(row["viewers"])
+        if base and row["mib_per_s"] < base["mib_per_s"] * (1 - tolerance):
+            regressions.append((row["viewers"], base["mib_per_s"], row["mib_per_s"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ramp concurrent viewers through the WebSocket proxy")
+    parser.add_argument("--host", default="localhost", help="Proxy host")
+    parser.add_argument("--port", type=int, default=5000, help="Proxy port")
+    parser.add_argument("--path", default="/websockify", help="WebSocket path (add ?token=... if routed)")
+    parser.add_argument("--password", default=os.environ.get("VNC_PASSWORD", "vnc123"),
+                        help="VncAuth password")
+    parser.add_argument("--steps", default="1,2,4,8,16,32", help="Viewer counts to ramp through")
+    parser.add_argument("--step-duration", type=float, default=10, help="Seconds measured per step")
+    parser.add_argument("--encoding", choices=list(ENCODINGS), default="tight")
+    parser.add_argument("--quality", type=int, default=6, help="Tight JPEG quality level 0-9")
+    parser.add_argument("--compression", type=int, default=2, help="Compression level 0-9")
+    parser.add_argument("--request", choices=["incremental", "full"], default="incremental",
+                        help="Update requests each viewer sends (full keeps data flowing on a static screen)")
+    parser.add_argument("--workload", choices=WORKLOADS, default="rects",
+                        help="Synthetic drawing on --display while measuring")
+    parser.add_argument("--workload-fps", type=float, default=30)
+    parser.add_argument("--display", default=":1", help="X display for the workload")
+    parser.add_argument("--proxy-pid", type=int, action="append", default=None,
+                        help="Proxy process to sample (default: whoever listens on --port)")
+    parser.add_argument("--deflate", action="store_true",
+                        help="Offer permessage-deflate like a browser; 'wire' shows the compressed rate")
+    parser.add_argument("--timeout", type=float, default=10, help="Socket timeout per viewer")
+    parser.add_argument("--json", default=None, metavar="FILE", help="Write the steps as JSON")
+    parser.add_argument("--baseline", default=None, metavar="FILE",
+                        help="Earlier --json output; exit non-zero on throughput regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Allowed throughput drop against --baseline (fraction)")
+    args = parser.parse_args()
+
+    steps = sorted({int(n) for n in args.steps.split(",") if n.strip()})
+    pids = args.proxy_pid or listening_pids(args.port)
+    if not pids:
+        print(f"⚠ No local process listens on port {args.port}; proxy CPU and memory not sampled")
+
+    workload = None
+    if args.workload != "none":
+        workload = XWorkload(args.display, args.workload, args.workload_fps)
+        try:
+            workload.start()
+        except OSError as e:
+            print(f"⚠ No workload on {args.display} ({e}); use --request full on a static screen")
+            workload = None
+
+    print(f"Proxy {args.host}:{args.port}{args.path}, {args.encoding}, "
+          f"{args.request} requests{', deflate' if args.deflate else ''}, "
+          f"{args.step_duration:g} s per step")
+    print(f"  {'viewers':>7}{'errors':>7}{'updates/s':>10}{'MiB/s':>9}{'wire':>9}{'p50 ms':>9}"
+          f"{'p99 ms':>9}{'worst p99':>11}{'CPU %':>8}{'RSS MiB':>8}")
+    viewers, rows = [], []
+    try:
+        for target in steps:
+            while len(viewers) < target:
+                viewer = Viewer(args)
+                viewer.start()
+                viewers.append(viewer)
+            # Let new viewers finish the handshake and their first full update
+            time.sleep(min(1.0, args.step_duration / 4))
+            failed = [v for v in viewers if v.error]
+            if failed and isinstance(failed[0].error, AuthenticationError):
+                print(f"✗ Authentication failed: {failed[0].error}")
+                return False
+            row = run_step(viewers, args.step_duration, pids)
+            rows.append(row)
+            print_row(row)
+            if row["errors"] == len(viewers):
+                print(f"✗ Every viewer failed: {viewers[0].error}")
+                break
+    except KeyboardInterrupt:
+        print("\nStopped")
+    finally:
+        for viewer in viewers:
+            viewer.stop()
+        if workload:
+            workload.stop()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"encoding": args.encoding, "request": args.request, "deflate": args.deflate,
+                       "steps": rows}, f, indent=2)
+    if args.baseline:
+        regressions = compare(rows, args.baseline, args.tolerance)
+        for count, before, after in regressions:
+            print(f"✗ {count} viewers: {after:.1f} MiB/s, baseline {before:.1f} MiB/s")
+        if regressions:
+            return False
+    return bool(rows) and all(row["errors"] == 0 for row in rows)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Multi-process WebSocket proxy
+Runs several VNCProxy worker processes on one port with SO_REUSEPORT so the
+kernel spreads connections across cores; workers stream their metrics to
+the parent, which serves the totals
+"""
+
+import os
+import sys
+import time
+import signal
+import asyncio
+import argparse
+import threading
+import multiprocessing
+import multiprocessing.connection
+from pathlib import Path
+
+from token_routes import TokenRouter
+from vnc_proxy import (VNCProxy, PROXY_CONNECTIONS, PROXY_BYTES, PROXY_MESSAGES,
+                       PROXY_RELAY_SECONDS, PROXY_TRANSCODE_BYTES)
+from ws_deflate import add_deflate_arguments, deflate_from_args
+from metrics import (REGISTRY, PROXY_DEFLATE_BYTES, PROXY_DEFLATE_SECONDS, PROXY_BROADCAST_VIEWERS,
+                     PROXY_BROADCAST_UPDATES, PROXY_BROADCAST_MERGED, snapshot_metrics,
+                     merge_snapshots, apply_snapshot)
+
+PROXY_METRICS = (PROXY_CONNECTIONS, PROXY_BYTES, PROXY_MESSAGES, PROXY_RELAY_SECONDS,
+                 PROXY_TRANSCODE_BYTES, PROXY_DEFLATE_BYTES, PROXY_DEFLATE_SECONDS,
+                 PROXY_BROADCAST_VIEWERS, PROXY_BROADCAST_UPDATES, PROXY_BROADCAST_MERGED)
+STATS_INTERVAL = 1.0       # seconds between metric reports from a worker
+START_TIMEOUT = 15.0
+
+
+def _worker_main(index, conn, options):
+    """Worker process: one VNCProxy on the shared port, reporting metrics to the parent"""
+    # Ctrl-C goes to the whole process group; the parent decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    routes = options.pop("routes", None)
+    proxy = VNCProxy(**options, router=TokenRouter(routes) if routes else None, reuse_port=True)
+
+    def viewers_changed(count):
+        # The parent thaws a hibernating desktop; Xvnc's listen backlog holds
+        # the connection until then
+        try:
+            conn.send(("viewers", count))
+        except OSError:
+            pass
+
+    proxy.on_viewers = viewers_changed
+
+    async def report():
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            conn.send(("stats", snapshot_metrics(PROXY_METRICS)))
+
+    async def main():
+        try:
+            await proxy.start()
+        except OSError as e:
+            conn.send(("error", str(e)))
+            return
+        conn.send(("ready", os.getpid()))
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, proxy.shutdown)
+        reporter = asyncio.ensure_future(report())
+        async with proxy.server:
+            try:
+                await proxy.server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+        reporter.cancel()
+        conn.send(("stats", snapshot_metrics(PROXY_METRICS)))
+
+    try:
+        asyncio.run(main())
+    finally:
+        if proxy.pool:
+            proxy.pool.shutdown(wait=False, cancel_futures=True)
+        conn.close()
+
+
+class ProxyWorker:
+    """Handle for one worker process; looks like a Popen to the supervisor"""
+
+    def __init__(self, index, process):
+        self.index = index
+        self.process = process
+        self.pid = process.pid
+
+    def poll(self):
+        return None if self.process.is_alive() else self.process.exitcode
+
+    def wait(self, timeout=None):
+        self.process.join(timeout)
+        return self.process.exitcode
+
+
+class ProxyWorkers:
+    def __init__(self, workers=None, routes=None, **options):
+        """``options`` are VNCProxy arguments; ``routes`` is a token file path"""
+        self.count = workers or os.cpu_count() or 1
+        if options.get("transcode") and not options.get("transcode_workers"):
+            # One encoder pool per worker: share the cores instead of oversubscribing
+            options["transcode_workers"] = max(1, (os.cpu_count() or 1) // self.count)
+        if "web_dir" in options:
+            options["web_dir"] = str(Path(options["web_dir"]).resolve())
+        self.options = dict(options, routes=str(routes) if routes else None)
+        self.port = options.get("port", 5000)
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = [None] * self.count
+        self.stats = {}
+        self.viewer_counts = {}
+        # Called with the total WebSocket count across workers when it changes
+        self.on_viewers = None
+        # Counters of workers that exited, so totals never go backwards
+        self.retired = {}
+        self.lock = threading.Lock()
+        self.stopping = False
+        REGISTRY.add_collector(self.collect)
+
+    def start_worker(self, index):
+        """Start (or replace) worker index; returns its handle once it is accepting"""
+        receiver, sender = self.context.Pipe(duplex=False)
+        process = self.context.Process(target=_worker_main, args=(index, sender, dict(self.options)),
+                                       name=f"vnc-proxy-{index}")
+        process.start()
+        sender.close()
+        if not receiver.poll(START_TIMEOUT):
+            process.kill()
+            process.join()
+            raise OSError(f"proxy worker {index} did not start")
+        try:
+            kind, value = receiver.recv()
+        except EOFError:
+            process.join()
+            raise OSError(f"proxy worker {index} exited with {process.exitcode}")
+        if kind == "error":
+            process.join()
+            raise OSError(value)
+        worker = ProxyWorker(index, process)
+        self.workers[index] = worker
+        threading.Thread(target=self._read_stats, args=(worker, receiver),
+                         name=f"vnc-proxy-{index}-stats", daemon=True).start()
+        return worker
+
+    def _read_stats(self, worker, receiver):
+        while True:
+            try:
+                kind, value = receiver.recv()
+            except (EOFError, OSError):
+                break
+            if kind == "stats":
+                with self.lock:
+                    self.stats[worker] = value
+            elif kind == "viewers":
+                with self.lock:
+                    self.viewer_counts[worker] = value
+                self._viewers_changed()
+        receiver.close()
+        with self.lock:
+            last = self.stats.pop(worker, None)
+            if last:
+                self.retired = merge_snapshots([self.retired, last], gauges=False)
+            dropped = self.viewer_counts.pop(worker, 0)
+        if dropped:
+            self._viewers_changed()
+
+    def viewers(self):
+        with self.lock:
+            return sum(self.viewer_counts.values())
+
+    def _viewers_changed(self):
+        if self.on_viewers:
+            self.on_viewers(self.viewers())
+
+    def start(self):
+        for index in range(self.count):
+            self.start_worker(index)
+        return self
+
+    def restart_worker(self, index):
+        """Supervisor hook: replace a dead worker; the others keep their connections"""
+        if self.stopping:
+            return None
+        try:
+            return self.start_worker(index)
+        except OSError as e:
+            print(f"⚠ Proxy worker {index} restart failed: {e}")
+            return None
+
+    def totals(self):
+        """Metric snapshot summed over live and exited workers"""
+        with self.lock:
+            return merge_snapshots([self.retired, *self.stats.values()])
+
+    def collect(self):
+        apply_snapshot(PROXY_METRICS, self.totals())
+
+    def is_running(self):
+        return any(w and w.process.is_alive() for w in self.workers)
+
+    def stop(self, timeout=5):
+        """SIGTERM every worker, kill those still running after timeout"""
+        self.stopping = True
+        for worker in self.workers:
+            if worker and worker.process.is_alive():
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker:
+                worker.process.join(timeout)
+                if worker.process.is_alive():
+                    worker.process.kill()
+                    worker.process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WebSocket proxy across several worker processes")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--port", type=int, default=5000, help="Listening port")
+    parser.add_argument("--target", type=int, default=5901, help="VNC server port")
+    parser.add_argument("--target-host", default="localhost", help="VNC server host")
+    parser.add_argument("--web", default=".", help="Directory served over HTTP")
+    parser.add_argument("--heartbeat", type=int, default=None, help="Ping interval in seconds")
+    parser.add_argument("--routes", default=None,
+                        help="Token file (token: host:port per line) to route by URL token")
+    parser.add_argument("--transcode", action="store_true",
+                        help="Re-encode Raw updates as Tight before sending them to the browser")
+    add_deflate_arguments(parser)
+
+    args = parser.parse_args()
+
+    workers = ProxyWorkers(args.workers, routes=args.routes, port=args.port,
+                           target_host=args.target_host, target_port=args.target,
+                           web_dir=args.web, heartbeat=args.heartbeat, transcode=args.transcode,
+                           deflate=deflate_from_args(args))
+    try:
+        workers.start()
+    except OSError as e:
+        print(f"✗ {e}")
+        workers.stop()
+        sys.exit(1)
+    print(f"✓ {workers.count} proxy workers on port {args.port} -> {args.target_host}:{args.target}")
+    try:
+        # Restart workers as they die until interrupted
+        while True:
+            for index, worker in enumerate(workers.workers):
+                if worker.poll() is not None:
+                    print(f"🔄 Proxy worker {index} exited ({worker.wait()}), restarting")
+                    if not workers.restart_worker(index):
+                        time.sleep(1)
+            multiprocessing.connection.wait([w.process.sentinel for w in workers.workers])
+    except KeyboardInterrupt:
+        workers.stop()
+        totals = workers.totals()
+        relayed = sum(totals.get(PROXY_BYTES.name, (None, {}))[1].values())
+        print(f"\nProxy workers stopped, {relayed / (1024 * 1024):.1f} MiB relayed")
@@ -0,0 +1,161 @@
+"""
+Readiness probes for the desktop services
+Each probe polls a real signal (socket, RFB banner, frames, root window property)
+and returns True once the service is usable, False on timeout or once
+the service's process has exited
+"""
+
+import os
+import time
+import socket
+import struct
+from pathlib import Path
+
+from rfb_client import probe_frames
+
+POLL_INTERVAL = 0.02
+
+
+def _until(check, timeout, interval=POLL_INTERVAL, process=None):
+    """Poll check until it is true; False on timeout or as soon as process has exited"""
+    deadline = time.monotonic() + timeout
+    while True:
+        if process is not None and process.poll() is not None:
+            return False
+        try:
+            if check():
+                return True
+        except OSError:
+            pass
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+
+
+def display_number(display):
+    return int(display.lstrip(":").split(".")[0])
+
+
+def x_socket_path(display):
+    return Path(f"/tmp/.X11-unix/X{display_number(display)}")
+
+
+def wait_for_x_socket(display, timeout=10, process=None):
+    """X server is accepting clients once its Unix socket exists"""
+    path = x_socket_path(display)
+    return _until(path.exists, timeout, process=process)
+
+
+def read_rfb_banner(host, port, timeout=1.0):
+    """Connect and return the server's 12-byte ProtocolVersion message"""
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        banner = b""
+        while len(banner) < 12:
+            data = sock.recv(12 - len(banner))
+            if not data:
+                break
+            banner += data
+        return banner
+
+
+def wait_for_rfb(host, port, timeout=10, process=None):
+    """TCP port accepts and the server speaks RFB"""
+    return _until(lambda: read_rfb_banner(host, port).startswith(b"RFB "),
+                  timeout, process=process)
+
+
+def wait_for_frames(host, port, password=None, timeout=10, process=None):
+    """Server completes the handshake and delivers a framebuffer update
+
+    Raises AuthenticationError at once if the password is rejected.
+    """
+    return _until(lambda: probe_frames(host, port, password), timeout, 0.05, process)
+
+
+class XConnection:
+    """Just enough of the X11 core protocol to read root window properties"""
+
+    def __init__(self, display, timeout=1.0):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(str(x_socket_path(display)))
+        # Little-endian setup request, protocol 11.0, no authorization
+        self.sock.sendall(struct.pack("<BxHHHHxx", ord("l"), 11, 0, 0, 0))
+        head = self._recv(8)
+        if head[0] != 1:
+            self.close()
+            raise OSError("X server refused the connection")
+        extra = self._recv(struct.unpack_from("<H", head, 6)[0] * 4)
+        self.id_base, self.id_mask = struct.unpack_from("<II", extra, 4)
+        vendor_len, self.max_request = struct.unpack_from("<HH", extra, 16)
+        formats = extra[21]
+        offset = 32 + ((vendor_len + 3) & ~3) + formats * 8
+        self.root = struct.unpack_from("<I", extra, offset)[0]
+        self.width, self.height = struct.unpack_from("<HH", extra, offset + 20)
+        self.depth = extra[offset + 38]
+
+    def _recv(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise OSError("X connection closed")
+            data += chunk
+        return data
+
+    def _reply(self):
+        while True:
+            head = self._recv(32)
+            if head[0] == 0:
+                raise OSError(f"X error {head[1]}")
+            extra = struct.unpack_from("<I", head, 4)[0] * 4 if head[0] == 1 else 0
+            body = self._recv(extra) if extra else b""
+            if head[0] == 1:
+                return head, body
+
+    def intern_atom(self, name, only_if_exists=True):
+        data = name.encode()
+        pad = (4 - len(data) % 4) % 4
+        self.sock.sendall(struct.pack("<BBHHxx", 16, only_if_exists, 2 + (len(data) + pad) // 4,
+                                      len(data)) + data + b"\0" * pad)
+        head, _ = self._reply()
+        return struct.unpack_from("<I", head, 8)[0]
+
+    def get_property(self, window, atom):
+        """Return the raw value of a window property, or None when unset"""
+        self.sock.sendall(struct.pack("<BBHIIIII", 20, 0, 6, window, atom, 0, 0, 1024))
+        head, body = self._reply()
+        prop_type = struct.unpack_from("<I", head, 8)[0]
+        if prop_type == 0:
+            return None
+        fmt = head[1]
+        length = struct.unpack_from("<I", head, 16)[0] * max(fmt // 8, 1)
+        return body[:length]
+
+    def close(self):
+        self.sock.close()
+
+
+def window_manager_running(display):
+    """EWMH window managers announce themselves with _NET_SUPPORTING_WM_CHECK on the root"""
+    conn = XConnection(display)
+    try:
+        atom = conn.intern_atom("_NET_SUPPORTING_WM_CHECK")
+        return atom != 0 and bool(conn.get_property(conn.root, atom))
+    finally:
+        conn.close()
+
+
+def wait_for_window_manager(display, timeout=10, process=None):
+    return _until(lambda: window_manager_running(display), timeout, 0.05, process)
+
+
+def wait_for_port(host, port, timeout=10):
+    def check():
+        with socket.create_connection((host, port), timeout=0.5):
+            return True
+    return _until(check, timeout)
+
+
+def wait_for_path(path, timeout=10):
+    return _until(lambda: os.path.exists(path), timeout)
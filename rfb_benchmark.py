@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Benchmark: how fast Xvnc serves framebuffer updates, per encoding
+Draws a synthetic workload on the display over the X protocol while a
+headless RFB client times full and incremental update requests
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import select
+import struct
+import argparse
+import threading
+import subprocess
+
+from readiness import XConnection
+from rfb_client import RFBClient, ENCODINGS, AuthenticationError, measure
+
+WORKLOADS = ("rects", "scroll", "noise", "none")
+
+X_CREATE_WINDOW = 1
+X_MAP_WINDOW = 8
+X_CREATE_GC = 55
+X_CHANGE_GC = 56
+X_COPY_AREA = 62
+X_POLY_FILL_RECTANGLE = 70
+X_PUT_IMAGE = 72
+CW_BACK_PIXEL = 0x2
+CW_OVERRIDE_REDIRECT = 0x200
+GC_FOREGROUND = 0x4
+
+
+class XWorkload:
+    """Redraws a full-screen override-redirect window at a fixed rate"""
+
+    def __init__(self, display, mode="rects", fps=30, seed=1):
+        self.display = display
+        self.mode = mode
+        self.fps = fps
+        self.rng = random.Random(seed)
+        self.conn = None
+        self.thread = None
+        self.running = False
+        self.frames = 0
+
+    def _send(self, data):
+        self.conn.sock.sendall(data)
+        # Errors and events are not needed; keep the socket from backing up
+        while select.select([self.conn.sock], [], [], 0)[0]:
+            if not self.conn.sock.recv(65536):
+                raise OSError("X connection closed")
+
+    def start(self):
+        conn = self.conn = XConnection(self.display, timeout=5.0)
+        self.window = conn.id_base | 1
+        self.gc = conn.id_base | 2
+        self.width, self.height = conn.width, conn.height
+        self._send(struct.pack("<BBHIIhhHHHHIIII", X_CREATE_WINDOW, 0, 10, self.window, conn.root,
+                               0, 0, self.width, self.height, 0, 1, 0,
+                               CW_BACK_PIXEL | CW_OVERRIDE_REDIRECT, 0, 1))
+        self._send(struct.pack("<BxHI", X_MAP_WINDOW, 2, self.window))
+        self._send(struct.pack("<BxHIIII", X_CREATE_GC, 5, self.gc, self.window, GC_FOREGROUND, 0))
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="x-workload", daemon=True)
+        self.thread.start()
+
+    def _colour(self, colour):
+        self._send(struct.pack("<BxHIII", X_CHANGE_GC, 4, self.gc, GC_FOREGROUND, colour))
+
+    def _fill(self, rects):
+        body = b"".join(struct.pack("<hhHH", *rect) for rect in rects)
+        self._send(struct.pack("<BxHII", X_POLY_FILL_RECTANGLE, 3 + len(rects) * 2,
+                               self.window, self.gc) + body)
+
+    def _random_rects(self, count, max_w, max_h, y0=0, height=None):
+        height = height or self.height
+        for _ in range(count):
+            w, h = self.rng.randint(8, max_w), self.rng.randint(8, max_h)
+            x = self.rng.randrange(max(self.width - w, 1))
+            y = y0 + self.rng.randrange(max(height - h, 1))
+            self._colour(self.rng.getrandbits(24))
+            self._fill([(x, y, w, h)])
+
+    def _noise(self, w, h):
+        """Incompressible pixels in strips that fit the maximum request length"""
+        x = self.rng.randrange(max(self.width - w, 1))
+        y0 = self.rng.randrange(max(self.height - h, 1))
+        rows = max((self.conn.max_request * 4 - 24) // (w * 4), 1)
+        for y in range(0, h, rows):
+            n = min(rows, h - y)
+            data = self.rng.randbytes(w * n * 4)
+            self._send(struct.pack("<BBHIIHHhhBBxx", X_PUT_IMAGE, 2, 6 + len(data) // 4,
+                                   self.window, self.gc, w, n, x, y0 + y, 0, self.conn.depth) + data)
+
+    def _scroll(self, step=16):
+        self._send(struct.pack("<BxHIIIhhhhHH", X_COPY_AREA, 7, self.window, self.window, self.gc,
+                               0, step, 0, 0, self.width, self.height - step))
+        self._colour(0xFFFFFF)
+        self._fill([(0, self.height - step, self.width, step)])
+        self._random_rects(4, self.width // 4, step, self.height - step, step)
+
+    def _run(self):
+        interval = 1.0 / self.fps
+        next_frame = time.monotonic()
+        while self.running:
+            try:
+                if self.mode == "rects":
+                    self._random_rects(8, self.width // 3, self.height // 3)
+                elif self.mode == "scroll":
+                    self._scroll()
+                elif self.mode == "noise":
+                    self._noise(min(320, self.width), min(240, self.height))
+            except OSError as e:
+                print(f"⚠ Workload stopped: {e}")
+                return
+            self.frames += 1
+            next_frame += interval
+            time.sleep(max(next_frame - time.monotonic(), 0))
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+        if self.conn:
+            # Closing the connection destroys the window
+            self.conn.close()
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def summarize(samples, elapsed):
+    frames = [s for s in samples if s[1]]
+    latencies = [s[0] for s in samples]
+    total = sum(s[2] for s in frames)
+    return {
+        "updates": len(samples),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "fps": len(frames) / elapsed if elapsed else 0.0,
+        "bytes_per_frame": total / len(frames) if frames else 0,
+        "bytes": total,
+    }
+
+
+def bench_encoding(host, port, password, name, full, duration, quality, compression):
+    client = RFBClient.connect(host, port, password)
+    try:
+        client.use_encoding(name, quality, compression)
+        started = time.perf_counter()
+        full_samples = measure(client, False, count=full)
+        full_elapsed = time.perf_counter() - started
+        started = time.perf_counter()
+        incremental = measure(client, True, duration=duration)
+        incremental_elapsed = time.perf_counter() - started
+    finally:
+        client.close()
+    return {"full": summarize(full_samples, full_elapsed),
+            "incremental": summarize(incremental, incremental_elapsed)}
+
+
+def print_table(results):
+    print(f"  {'encoding':<10}{'request':<13}{'updates':>8}{'p50 ms':>9}{'p90 ms':>9}"
+          f"{'p99 ms':>9}{'fps':>8}{'KiB/frame':>11}")
+    for name, kinds in results.items():
+        for kind, row in kinds.items():
+            print(f"  {name:<10}{kind:<13}{row['updates']:>8}{row['p50_ms']:>9.1f}"
+                  f"{row['p90_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['fps']:>8.1f}"
+                  f"{row['bytes_per_frame'] / 1024:>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time Xvnc framebuffer updates per encoding")
+    parser.add_argument("--host", default="localhost", help="VNC server host")
+    parser.add_argument("--port", type=int, default=5901, help="VNC server port")
+    parser.add_argument("--display", default=":1", help="X display to draw the workload on")
+    parser.add_argument("--password", default=os.environ.get("VNC_PASSWORD", "vnc123"),
+                        help="VncAuth password (default: the launcher's)")
+    parser.add_argument("--encodings", default="raw,hextile,zrle,tight",
+                        help=f"Comma-separated, from: {', '.join(ENCODINGS)}")
+    parser.add_argument("--workload", choices=WORKLOADS, default="rects",
+                        help="Synthetic drawing while measuring")
+    parser.add_argument("--workload-fps", type=float, default=30, help="Workload redraw rate")
+    parser.add_argument("--workload-cmd", default=None,
+                        help="Run this command on the display instead of drawing")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of incremental updates")
+    parser.add_argument("--full", type=int, default=10, help="Full (non-incremental) requests")
+    parser.add_argument("--quality", type=int, default=None, help="Tight JPEG quality level 0-9")
+    parser.add_argument("--compression", type=int, default=None, help="Compression level 0-9")
+    parser.add_argument("--json", default=None, metavar="FILE", help="Also write results as JSON")
+    args = parser.parse_args()
+
+    names = [name.strip().lower() for name in args.encodings.split(",") if name.strip()]
+    unknown = [name for name in names if name not in ENCODINGS]
+    if unknown:
+        print(f"✗ Unknown encodings: {', '.join(unknown)}")
+        return False
+
+    workload = command = None
+    if args.workload_cmd:
+        command = subprocess.Popen(args.workload_cmd, shell=True, env={**os.environ, "DISPLAY": args.display},
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                   start_new_session=True)
+    elif args.workload != "none":
+        workload = XWorkload(args.display, args.workload, args.workload_fps)
+        try:
+            workload.start()
+        except OSError as e:
+            print(f"✗ Cannot draw on {args.display}: {e}")
+            return False
+
+    results = {}
+    ok = True
+    try:
+        for name in names:
+            try:
+                results[name] = bench_encoding(args.host, args.port, args.password, name, args.full,
+                                               args.duration, args.quality, args.compression)
+            except AuthenticationError as e:
+                print(f"✗ Authentication failed: {e}")
+                return False
+            except TimeoutError:
+                print(f"✗ {name}: no update within the timeout (is anything changing on screen?)")
+                ok = False
+            except OSError as e:
+                print(f"✗ {name}: {e}")
+                ok = False
+    finally:
+        if workload:
+            workload.stop()
+        if command:
+            os.killpg(command.pid, 15)
+            command.wait()
+
+    label = args.workload_cmd or f"{args.workload} at {args.workload_fps:g} fps"
+    print(f"Xvnc {args.host}:{args.port}, workload: {label}")
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"workload": label, "results": results}, f, indent=2)
+    return ok and bool(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,552 @@
+#!/usr/bin/env python3
+"""
+Shared-session fan-out for the WebSocket proxy
+Holds one RFB connection per desktop and a framebuffer in the proxy; view-only
+viewers get a full frame when they join, then updates encoded once for all of
+them, merged per region for viewers that fall behind
+"""
+
+import hmac
+import os
+import struct
+import asyncio
+import argparse
+
+from vnc_proxy import VNCProxy
+from ws_deflate import add_deflate_arguments, deflate_from_args
+from rfb_client import (RFBClient, RFBError, AuthenticationError, vnc_auth_response,
+                        PIXEL_FORMAT, BYTES_PER_PIXEL, MSG_COLOUR_MAP, MSG_BELL, MSG_CUT_TEXT)
+from rfb_transcoder import (MSG_FRAMEBUFFER_UPDATE, MSG_SET_PIXEL_FORMAT, MSG_SET_ENCODINGS,
+                            ENC_RAW, ENC_COPYRECT, ENC_TIGHT, ENC_DESKTOP_SIZE, ENC_LAST_RECT,
+                            QUALITY_0, QUALITY_9, COMPRESS_0, COMPRESS_9, DEFAULT_LEVEL,
+                            SECURITY_NONE, SECURITY_VNC_AUTH, pixel_offsets, tight_rect,
+                            assemble_update)
+from metrics import PROXY_BROADCAST_VIEWERS, PROXY_BROADCAST_UPDATES, PROXY_BROADCAST_MERGED
+
+SERVER_VERSION = b"RFB 003.008\n"
+# Xvnc encodes each change once, as cheaply as it can; the proxy does the rest
+UPSTREAM_ENCODINGS = (ENC_COPYRECT, ENC_RAW, ENC_DESKTOP_SIZE, ENC_LAST_RECT)
+FB_OFFSETS = pixel_offsets(PIXEL_FORMAT)[1]
+TILE = 64                 # granularity of each viewer's dirty region
+LINGER = 10.0             # seconds the upstream connection outlives its last viewer
+
+MSG_UPDATE_REQUEST = 3
+MSG_KEY_EVENT = 4
+MSG_POINTER_EVENT = 5
+MSG_CLIENT_CUT_TEXT = 6
+
+# Metric children resolved once, they are updated on every fanned-out update
+ENCODED_UPDATES = PROXY_BROADCAST_UPDATES.labels("encoded")
+SHARED_UPDATES = PROXY_BROADCAST_UPDATES.labels("shared")
+
+
+def convert_pixels(pixels, offsets):
+    """Framebuffer pixels in another 32 bpp true colour layout"""
+    if offsets == FB_OFFSETS:
+        return pixels
+    out = bytearray(len(pixels))
+    for source, target in zip(FB_OFFSETS, offsets):
+        out[target::4] = pixels[source::4]
+    return bytes(out)
+
+
+class Framebuffer:
+    """The desktop's pixels in PIXEL_FORMAT, kept current from Raw and CopyRect rects"""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.stride = width * BYTES_PER_PIXEL
+        self.data = bytearray(self.stride * height)
+
+    def contains(self, x, y, w, h):
+        return x + w <= self.width and y + h <= self.height
+
+    def put(self, x, y, w, h, pixels):
+        row = w * BYTES_PER_PIXEL
+        if x == 0 and w == self.width:
+            start = y * self.stride
+            self.data[start:start + row * h] = pixels
+            return
+        for line in range(h):
+            start = (y + line) * self.stride + x * BYTES_PER_PIXEL
+            self.data[start:start + row] = pixels[line * row:(line + 1) * row]
+
+    def get(self, x, y, w, h):
+        row = w * BYTES_PER_PIXEL
+        if x == 0 and w == self.width:
+            start = y * self.stride
+            return bytes(self.data[start:start + row * h])
+        start = y * self.stride + x * BYTES_PER_PIXEL
+        return b"".join(self.data[start + line * self.stride:start + line * self.stride + row]
+                        for line in range(h))
+
+    def copy(self, x, y, w, h, source_x, source_y):
+        # Through a copy, so overlapping moves come out right
+        self.put(x, y, w, h, self.get(source_x, source_y, w, h))
+
+
+class DirtyRegion:
+    """Area a viewer has not been sent yet, as a grid of TILE x TILE cells
+
+    However many updates a slow viewer misses, this stays one byte per cell:
+    they are merged per region instead of queued.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.columns = (width + TILE - 1) // TILE
+        self.rows = (height + TILE - 1) // TILE
+        self.cells = bytearray(self.columns * self.rows)
+
+    def __bool__(self):
+        return 1 in self.cells
+
+    def add(self, x, y, w, h):
+        if w <= 0 or h <= 0 or x >= self.width or y >= self.height:
+            return
+        first, last = x // TILE, min((x + w - 1) // TILE, self.columns - 1)
+        for row in range(y // TILE, min((y + h - 1) // TILE, self.rows - 1) + 1):
+            start = row * self.columns
+            self.cells[start + first:start + last + 1] = b"\x01" * (last - first + 1)
+
+    def add_all(self):
+        self.cells[:] = b"\x01" * len(self.cells)
+
+    def _runs(self, row):
+        start, runs = row * self.columns, []
+        column = 0
+        while column < self.columns:
+            if self.cells[start + column]:
+                first = column
+                while column < self.columns and self.cells[start + column]:
+                    column += 1
+                runs.append((first, column))
+            column += 1
+        return runs
+
+    def take(self):
+        """The dirty area as pixel rects and clear it; equal runs on adjacent rows are joined"""
+        rects, open_runs = [], {}
+        for row in range(self.rows + 1):
+            runs = self._runs(row) if row < self.rows else []
+            for run in [run for run in open_runs if run not in runs]:
+                top = open_runs.pop(run)
+                x, y = run[0] * TILE, top * TILE
+                rects.append((x, y, min(run[1] * TILE, self.width) - x,
+                              min(row * TILE, self.height) - y))
+            for run in runs:
+                open_runs.setdefault(run, row)
+        self.cells[:] = bytes(len(self.cells))
+        return rects
+
+
+class Viewer:
+    """Server side of RFB towards one view-only browser"""
+
+    def __init__(self, session, conn):
+        self.session = session
+        self.conn = conn
+        self.buffer = bytearray()
+        self.state = "version"
+        self.minor = 8
+        self.challenge = None
+        self.offsets = FB_OFFSETS
+        self.tight = False
+        self.quality = None
+        self.level = DEFAULT_LEVEL
+        self.desktop_size = False
+        self.dirty = None
+        self.resized = False
+        self.requested = False
+        self.sending = False
+        self.congested = False
+        conn.send_message(SERVER_VERSION)
+
+    # browser -> proxy
+
+    def from_client(self, data):
+        buf = self.buffer
+        buf += data
+        while buf and self.state != "closed":
+            length = self._length(buf)
+            if length is None or len(buf) < length:
+                return
+            message = bytes(buf[:length])
+            del buf[:length]
+            self._message(message)
+
+    def _length(self, buf):
+        state = self.state
+        if state == "version":
+            return 12
+        if state in ("security", "init"):
+            return 1
+        if state == "auth":
+            return 16
+        if state == "waiting":
+            return None
+        kind = buf[0]
+        if kind == MSG_SET_PIXEL_FORMAT:
+            return 20
+        if kind == MSG_SET_ENCODINGS:
+            return 4 + 4 * struct.unpack_from("!H", buf, 2)[0] if len(buf) >= 4 else None
+        if kind == MSG_UPDATE_REQUEST:
+            return 10
+        if kind == MSG_KEY_EVENT:
+            return 8
+        if kind == MSG_POINTER_EVENT:
+            return 6
+        if kind == MSG_CLIENT_CUT_TEXT:
+            return 8 + abs(struct.unpack_from("!i", buf, 4)[0]) if len(buf) >= 8 else None
+        self._fail(f"unsupported client message {kind}")
+        return None
+
+    def _message(self, message):
+        state = self.state
+        if state == "version":
+            if not message.startswith(b"RFB 003.") or int(message[8:11]) < 7:
+                self._fail(f"unsupported RFB version {message[:11]!r}")
+                return
+            self.minor = min(int(message[8:11]), 8)
+            security = SECURITY_VNC_AUTH if self.session.hub.password is not None else SECURITY_NONE
+            self.conn.send_message(bytes([1, security]))
+            self.state = "security"
+        elif state == "security":
+            if self.session.hub.password is not None:
+                if message[0] != SECURITY_VNC_AUTH:
+                    self._refuse("VNC authentication required")
+                    return
+                self.challenge = os.urandom(16)
+                self.conn.send_message(self.challenge)
+                self.state = "auth"
+                return
+            if message[0] != SECURITY_NONE:
+                self._refuse("unsupported security type")
+                return
+            if self.minor >= 8:
+                self.conn.send_message(struct.pack("!I", 0))
+            self.state = "init"
+        elif state == "auth":
+            expected = vnc_auth_response(self.session.hub.password, self.challenge)
+            if not hmac.compare_digest(message, expected):
+                self._refuse("authentication failed")
+                return
+            self.conn.send_message(struct.pack("!I", 0))
+            self.state = "init"
+        elif state == "init":
+            # Every viewer shares the desktop, whatever it asked for
+            self.state = "waiting"
+            if self.session.fb is not None:
+                self.server_init()
+        elif message[0] == MSG_SET_PIXEL_FORMAT:
+            bpp, offsets = pixel_offsets(message[4:20])
+            if offsets is None:
+                self._fail(f"unsupported pixel format ({bpp * 8} bpp)")
+                return
+            self.offsets = offsets
+        elif message[0] == MSG_SET_ENCODINGS:
+            count = struct.unpack_from("!H", message, 2)[0]
+            requested = struct.unpack_from(f"!{count}i", message, 4)
+            self.tight = ENC_TIGHT in requested
+            self.desktop_size = ENC_DESKTOP_SIZE in requested
+            self.quality = next((e - QUALITY_0 for e in requested
+                                 if QUALITY_0 <= e <= QUALITY_9), None)
+            level = next((e - COMPRESS_0 for e in requested
+                          if COMPRESS_0 <= e <= COMPRESS_9), DEFAULT_LEVEL)
+            self.level = max(level, 1)
+        elif message[0] == MSG_UPDATE_REQUEST:
+            incremental, x, y, w, h = struct.unpack_from("!BHHHH", message, 1)
+            if not incremental:
+                self.dirty.add(x, y, w, h)
+            self.requested = True
+            self.flush()
+        # Key, pointer and clipboard input is dropped: viewers only watch
+
+    def _refuse(self, reason):
+        self.conn.send_message(struct.pack("!I", 1))
+        if self.minor >= 8:
+            text = reason.encode()
+            self.conn.send_message(struct.pack("!I", len(text)) + text)
+        self._fail(reason)
+
+    def _fail(self, reason):
+        print(f"⚠ Shared-session viewer dropped: {reason}")
+        self.state = "closed"
+        self.conn.close(1003)
+
+    # proxy -> browser
+
+    def server_init(self):
+        """Describe the desktop; the whole frame is owed to a viewer that just joined"""
+        fb = self.session.fb
+        name = self.session.name.encode()
+        self.conn.send_message(struct.pack("!HH", fb.width, fb.height) + PIXEL_FORMAT
+                               + struct.pack("!I", len(name)) + name)
+        self.dirty = DirtyRegion(fb.width, fb.height)
+        self.dirty.add_all()
+        self.state = "messages"
+        if self.buffer:
+            self.from_client(b"")
+
+    def resize(self, width, height):
+        if self.state != "messages":
+            return
+        if not self.desktop_size:
+            self._fail("the desktop was resized and the viewer cannot follow")
+            return
+        self.dirty = DirtyRegion(width, height)
+        self.dirty.add_all()
+        self.resized = True
+        self.flush()
+
+    def changed(self, rects):
+        if self.state != "messages":
+            return
+        if self.dirty:
+            # Still owed an earlier update: this one is folded into it
+            PROXY_BROADCAST_MERGED.inc()
+        for rect in rects:
+            self.dirty.add(*rect)
+        self.flush()
+
+    def pause(self):
+        self.congested = True
+
+    def resume(self):
+        self.congested = False
+        self.flush()
+
+    def flush(self):
+        """Send the dirty area if the browser asked for it and can take it"""
+        if (self.state != "messages" or not self.requested or self.sending or self.congested
+                or not (self.dirty or self.resized)):
+            return
+        resize = (self.session.fb.width, self.session.fb.height) if self.resized else None
+        task = self.session.encode(self.dirty.take(), self._encoding(), resize)
+        self.requested = self.resized = False
+        self.sending = True
+        task.add_done_callback(self._sent)
+
+    def _encoding(self):
+        if self.tight:
+            return ENC_TIGHT, self.quality, self.level
+        return ENC_RAW, self.offsets
+
+    def _sent(self, task):
+        self.sending = False
+        if task.cancelled() or self.state != "messages":
+            return
+        if task.exception():
+            self._fail(f"encoding failed: {task.exception()}")
+            return
+        self.conn.send_message(task.result())
+        self.flush()
+
+    def detach(self):
+        self.state = "closed"
+        self.session.detach(self)
+
+
+class BroadcastSession:
+    """One desktop: the upstream RFB connection, its framebuffer and its viewers"""
+
+    def __init__(self, hub, host, port, pool=None):
+        self.hub = hub
+        self.host = host
+        self.port = port
+        self.pool = pool
+        self.viewers = set()
+        self.fb = None
+        self.name = ""
+        self.generation = 0
+        self.encoded = {}
+        self.writer = None
+        self.task = None
+        self.linger = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+        return self
+
+    def attach(self, conn):
+        if self.linger:
+            self.linger.cancel()
+            self.linger = None
+        viewer = Viewer(self, conn)
+        self.viewers.add(viewer)
+        PROXY_BROADCAST_VIEWERS.inc()
+        return viewer
+
+    def detach(self, viewer):
+        if viewer not in self.viewers:
+            return
+        self.viewers.discard(viewer)
+        PROXY_BROADCAST_VIEWERS.dec()
+        if not self.viewers and self.task:
+            self.linger = asyncio.get_running_loop().call_later(self.hub.linger, self.close)
+
+    def close(self):
+        if self.task:
+            self.task.cancel()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        key = (self.host, self.port)
+        try:
+            # The handshake is a few round trips on localhost: done blocking, off the loop
+            client = await loop.run_in_executor(None, RFBClient.connect, self.host, self.port,
+                                                self.hub.password)
+            client.set_encodings(UPSTREAM_ENCODINGS)
+            client.request_update(False)
+            client.transport.sock.settimeout(None)
+            reader, self.writer = await asyncio.open_connection(sock=client.transport.sock)
+            self.fb = Framebuffer(client.width, client.height)
+            self.name = client.name
+            print(f"✓ Shared session {self.host}:{self.port} connected "
+                  f"({client.width}x{client.height})")
+            for viewer in list(self.viewers):
+                if viewer.state == "waiting":
+                    viewer.server_init()
+            while True:
+                await self._read_message(reader)
+        except (OSError, EOFError, AuthenticationError) as e:
+            print(f"⚠ Shared session {self.host}:{self.port} lost: {e}")
+        finally:
+            if self.hub.sessions.get(key) is self:
+                del self.hub.sessions[key]
+            if self.linger:
+                self.linger.cancel()
+            if self.writer:
+                self.writer.close()
+            for viewer in list(self.viewers):
+                viewer.conn.close(1011)
+
+    async def _read_message(self, reader):
+        kind = (await reader.readexactly(1))[0]
+        if kind == MSG_FRAMEBUFFER_UPDATE:
+            count, = struct.unpack("!xH", await reader.readexactly(3))
+            changed = []
+            for _ in range(count):
+                x, y, w, h, encoding = struct.unpack("!HHHHi", await reader.readexactly(12))
+                if encoding == ENC_LAST_RECT:
+                    break
+                if encoding == ENC_DESKTOP_SIZE:
+                    self._resize(w, h)
+                    continue
+                if not self.fb.contains(x, y, w, h):
+                    raise RFBError(f"rect {w}x{h}+{x}+{y} outside the framebuffer")
+                if encoding == ENC_RAW:
+                    self.fb.put(x, y, w, h, await reader.readexactly(w * h * BYTES_PER_PIXEL))
+                elif encoding == ENC_COPYRECT:
+                    source_x, source_y = struct.unpack("!HH", await reader.readexactly(4))
+                    if not self.fb.contains(source_x, source_y, w, h):
+                        raise RFBError("CopyRect source outside the framebuffer")
+                    self.fb.copy(x, y, w, h, source_x, source_y)
+                else:
+                    raise RFBError(f"unexpected encoding {encoding}")
+                changed.append((x, y, w, h))
+            # Ask for the next one before fanning this one out
+            self.writer.write(struct.pack("!BBHHHH", MSG_UPDATE_REQUEST, 1, 0, 0,
+                                          self.fb.width, self.fb.height))
+            if changed:
+                self._changed(changed)
+        elif kind == MSG_COLOUR_MAP:
+            _, count = struct.unpack("!xHH", await reader.readexactly(5))
+            await reader.readexactly(count * 6)
+        elif kind == MSG_BELL:
+            pass
+        elif kind == MSG_CUT_TEXT:
+            # The desktop's clipboard is not shared with viewers
+            length, = struct.unpack("!3xI", await reader.readexactly(7))
+            await reader.readexactly(length)
+        else:
+            raise RFBError(f"unexpected server message {kind}")
+
+    def _resize(self, width, height):
+        self.fb = Framebuffer(width, height)
+        self.generation += 1
+        self.encoded.clear()
+        for viewer in list(self.viewers):
+            viewer.resize(width, height)
+
+    def _changed(self, rects):
+        self.generation += 1
+        self.encoded.clear()
+        for viewer in list(self.viewers):
+            viewer.changed(rects)
+
+    def encode(self, rects, encoding, resize=None):
+        """A task building the update for rects; viewers owed the same area share it"""
+        key = (self.generation, tuple(rects), encoding, resize)
+        task = self.encoded.get(key)
+        if task is not None:
+            SHARED_UPDATES.inc()
+            return task
+        pieces = []
+        if resize:
+            pieces.append(struct.pack("!HHHHi", 0, 0, *resize, ENC_DESKTOP_SIZE))
+        for x, y, w, h in rects:
+            # Pixels are copied now: the framebuffer moves on while the pool encodes
+            pixels = self.fb.get(x, y, w, h)
+            if encoding[0] == ENC_TIGHT:
+                pieces += tight_rect(pixels, x, y, w, h, FB_OFFSETS, encoding[1], encoding[2],
+                                     self.pool, asyncio.get_running_loop())
+            else:
+                pieces.append(struct.pack("!HHHHi", x, y, w, h, ENC_RAW)
+                              + convert_pixels(pixels, encoding[1]))
+        task = self.encoded[key] = asyncio.ensure_future(assemble_update(pieces))
+        ENCODED_UPDATES.inc()
+        return task
+
+
+class BroadcastHub:
+    def __init__(self, password=None, linger=LINGER):
+        """Shared sessions for VNCProxy(broadcast=...), one per backend
+
+        ``password`` logs in to Xvnc and is asked of every viewer; with None
+        both sides go without authentication.
+        """
+        self.password = password
+        self.linger = linger
+        self.sessions = {}
+
+    def attach(self, conn, backend):
+        """A Viewer for a freshly upgraded ProxyConnection"""
+        session = self.sessions.get(backend)
+        if session is None:
+            session = self.sessions[backend] = BroadcastSession(
+                self, *backend, pool=conn.proxy.pool).start()
+        return session.attach(conn)
+
+    def viewers(self):
+        return sum(len(session.viewers) for session in self.sessions.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WebSocket proxy sharing one Xvnc connection "
+                                                 "among view-only viewers")
+    parser.add_argument("--port", type=int, default=5000, help="Listening port")
+    parser.add_argument("--target", type=int, default=5901, help="VNC server port")
+    parser.add_argument("--target-host", default="localhost", help="VNC server host")
+    parser.add_argument("--web", default=".", help="Directory served over HTTP")
+    parser.add_argument("--password", default=os.environ.get("VNC_PASSWORD"),
+                        help="VNC password for Xvnc and the viewers (default: VNC_PASSWORD)")
+    parser.add_argument("--linger", type=float, default=LINGER,
+                        help="Seconds the Xvnc connection stays open after the last viewer")
+    parser.add_argument("--transcode-workers", type=int, default=None,
+                        help="Tight encoder processes (default: encode on the event loop)")
+    add_deflate_arguments(parser)
+    args = parser.parse_args()
+
+    hub = BroadcastHub(args.password, args.linger)
+    proxy = VNCProxy(args.port, args.target_host, args.target, args.web,
+                     transcode=bool(args.transcode_workers),
+                     transcode_workers=args.transcode_workers,
+                     deflate=deflate_from_args(args), broadcast=hub)
+    print(f"✓ Shared-session proxy on port {args.port} -> {args.target_host}:{args.target}")
+    try:
+        proxy.run()
+    except KeyboardInterrupt:
+        print("\nProxy stopped by user")
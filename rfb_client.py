@@ -0,0 +1,504 @@
+"""
+Headless RFB client
+Enough of the protocol to authenticate (None or VncAuth), negotiate one
+encoding and time FramebufferUpdates without decoding pixels, directly or
+through the WebSocket proxy; used by the benchmarks, the load generator and
+as a readiness probe that the server really serves frames
+"""
+
+import os
+import time
+import zlib
+import base64
+import socket
+import struct
+
+from vnc_proxy import (OP_CONTINUATION, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG,
+                       unmask, accept_key)
+from rfb_transcoder import (ENC_RAW, ENC_COPYRECT, ENC_TIGHT, ENC_DESKTOP_SIZE, ENC_LAST_RECT,
+                            ENC_EXT_DESKTOP_SIZE, QUALITY_0, COMPRESS_0,
+                            SECURITY_NONE, SECURITY_VNC_AUTH)
+
+ENC_RRE = 2
+ENC_CORRE = 4
+ENC_HEXTILE = 5
+ENC_ZLIB = 6
+ENC_ZRLE = 16
+ENCODINGS = {"raw": ENC_RAW, "copyrect": ENC_COPYRECT, "rre": ENC_RRE, "hextile": ENC_HEXTILE,
+             "zlib": ENC_ZLIB, "tight": ENC_TIGHT, "zrle": ENC_ZRLE}
+# Pseudo-encodings sent with every encoding so the parser never sees others
+PSEUDO = [ENC_DESKTOP_SIZE, ENC_LAST_RECT, ENC_EXT_DESKTOP_SIZE]
+
+MSG_FRAMEBUFFER_UPDATE = 0
+MSG_COLOUR_MAP = 1
+MSG_BELL = 2
+MSG_CUT_TEXT = 3
+
+# 32 bpp little-endian true colour, the format noVNC asks for
+PIXEL_FORMAT = struct.pack(">BBBBHHHBBBxxx", 32, 24, 0, 1, 255, 255, 255, 16, 8, 0)
+BYTES_PER_PIXEL = 4
+TPIXEL = 3                 # Tight sends 24-bit colours in 32 bpp depth 24 formats
+
+HEXTILE_RAW = 1
+HEXTILE_BACKGROUND = 2
+HEXTILE_FOREGROUND = 4
+HEXTILE_ANY_SUBRECTS = 8
+HEXTILE_SUBRECTS_COLOURED = 16
+
+
+class RFBError(OSError):
+    """Protocol failure; probes treat it like a connection error and retry"""
+
+
+class AuthenticationError(Exception):
+    """The server rejected the credentials; retrying will not help"""
+
+
+# DES, encryption only, as needed for the VncAuth challenge
+
+_PC1 = (57, 49, 41, 33, 25, 17, 9, 1, 58, 50, 42, 34, 26, 18, 10, 2, 59, 51, 43, 35, 27, 19, 11, 3,
+        60, 52, 44, 36, 63, 55, 47, 39, 31, 23, 15, 7, 62, 54, 46, 38, 30, 22, 14, 6, 61, 53, 45,
+        37, 29, 21, 13, 5, 28, 20, 12, 4)
+_PC2 = (14, 17, 11, 24, 1, 5, 3, 28, 15, 6, 21, 10, 23, 19, 12, 4, 26, 8, 16, 7, 27, 20, 13, 2,
+        41, 52, 31, 37, 47, 55, 30, 40, 51, 45, 33, 48, 44, 49, 39, 56, 34, 53, 46, 42, 50, 36,
+        29, 32)
+_SHIFTS = (1, 1, 2, 2, 2, 2, 2, 2, 1, 2, 2, 2, 2, 2, 2, 1)
+_IP = (58, 50, 42, 34, 26, 18, 10, 2, 60, 52, 44, 36, 28, 20, 12, 4, 62, 54, 46, 38, 30, 22, 14, 6,
+       64, 56, 48, 40, 32, 24, 16, 8, 57, 49, 41, 33, 25, 17, 9, 1, 59, 51, 43, 35, 27, 19, 11, 3,
+       61, 53, 45, 37, 29, 21, 13, 5, 63, 55, 47, 39, 31, 23, 15, 7)
+_FP = (40, 8, 48, 16, 56, 24, 64, 32, 39, 7, 47, 15, 55, 23, 63, 31, 38, 6, 46, 14, 54, 22, 62, 30,
+       37, 5, 45, 13, 53, 21, 61, 29, 36, 4, 44, 12, 52, 20, 60, 28, 35, 3, 43, 11, 51, 19, 59, 27,
+       34, 2, 42, 10, 50, 18, 58, 26, 33, 1, 41, 9, 49, 17, 57, 25)
+_E = (32, 1, 2, 3, 4, 5, 4, 5, 6, 7, 8, 9, 8, 9, 10, 11, 12, 13, 12, 13, 14, 15, 16, 17, 16, 17,
+      18, 19, 20, 21, 20, 21, 22, 23, 24, 25, 24, 25, 26, 27, 28, 29, 28, 29, 30, 31, 32, 1)
+_P = (16, 7, 20, 21, 29, 12, 28, 17, 1, 15, 23, 26, 5, 18, 31, 10, 2, 8, 24, 14, 32, 27, 3, 9, 19,
+      13, 30, 6, 22, 11, 4, 25)
+_SBOX = (
+    (14, 4, 13, 1, 2, 15, 11, 8, 3, 10, 6, 12, 5, 9, 0, 7, 0, 15, 7, 4, 14, 2, 13, 1, 10, 6, 12, 11,
+     9, 5, 3, 8, 4, 1, 14, 8, 13, 6, 2, 11, 15, 12, 9, 7, 3, 10, 5, 0, 15, 12, 8, 2, 4, 9, 1, 7, 5,
+     11, 3, 14, 10, 0, 6, 13),
+    (15, 1, 8, 14, 6, 11, 3, 4, 9, 7, 2, 13, 12, 0, 5, 10, 3, 13, 4, 7, 15, 2, 8, 14, 12, 0, 1, 10,
+     6, 9, 11, 5, 0, 14, 7, 11, 10, 4, 13, 1, 5, 8, 12, 6, 9, 3, 2, 15, 13, 8, 10, 1, 3, 15, 4, 2,
+     11, 6, 7, 12, 0, 5, 14, 9),
+    (10, 0, 9, 14, 6, 3, 15, 5, 1, 13, 12, 7, 11, 4, 2, 8, 13, 7, 0, 9, 3, 4, 6, 10, 2, 8, 5, 14,
+     12, 11, 15, 1, 13, 6, 4, 9, 8, 15, 3, 0, 11, 1, 2, 12, 5, 10, 14, 7, 1, 10, 13, 0, 6, 9, 8, 7,
+     4, 15, 14, 3, 11, 5, 2, 12),
+    (7, 13, 14, 3, 0, 6, 9, 10, 1, 2, 8, 5, 11, 12, 4, 15, 13, 8, 11, 5, 6, 15, 0, 3, 4, 7, 2, 12,
+     1, 10, 14, 9, 10, 6, 9, 0, 12, 11, 7, 13, 15, 1, 3, 14, 5, 2, 8, 4, 3, 15, 0, 6, 10, 1, 13, 8,
+     9, 4, 5, 11, 12, 7, 2, 14),
+    (2, 12, 4, 1, 7, 10, 11, 6, 8, 5, 3, 15, 13, 0, 14, 9, 14, 11, 2, 12, 4, 7, 13, 1, 5, 0, 15, 10,
+     3, 9, 8, 6, 4, 2, 1, 11, 10, 13, 7, 8, 15, 9, 12, 5, 6, 3, 0, 14, 11, 8, 12, 7, 1, 14, 2, 13,
+     6, 15, 0, 9, 10, 4, 5, 3),
+    (12, 1, 10, 15, 9, 2, 6, 8, 0, 13, 3, 4, 14, 7, 5, 11, 10, 15, 4, 2, 7, 12, 9, 5, 6, 1, 13, 14,
+     0, 11, 3, 8, 9, 14, 15, 5, 2, 8, 12, 3, 7, 0, 4, 10, 1, 13, 11, 6, 4, 3, 2, 12, 9, 5, 15, 10,
+     11, 14, 1, 7, 6, 0, 8, 13),
+    (4, 11, 2, 14, 15, 0, 8, 13, 3, 12, 9, 7, 5, 10, 6, 1, 13, 0, 11, 7, 4, 9, 1, 10, 14, 3, 5, 12,
+     2, 15, 8, 6, 1, 4, 11, 13, 12, 3, 7, 14, 10, 15, 6, 8, 0, 5, 9, 2, 6, 11, 13, 8, 1, 4, 10, 7,
+     9, 5, 0, 15, 14, 2, 3, 12),
+    (13, 2, 8, 4, 6, 15, 11, 1, 10, 9, 3, 14, 5, 0, 12, 7, 1, 15, 13, 8, 10, 3, 7, 4, 12, 5, 6, 11,
+     0, 14, 9, 2, 7, 11, 4, 1, 9, 12, 14, 2, 0, 6, 10, 13, 15, 3, 5, 8, 2, 1, 14, 7, 4, 10, 8, 13,
+     15, 12, 9, 0, 3, 5, 6, 11),
+)
+
+
+def _permute(value, table, width):
+    out = 0
+    for position in table:
+        out = (out << 1) | ((value >> (width - position)) & 1)
+    return out
+
+
+def _subkeys(key):
+    cd = _permute(int.from_bytes(key, "big"), _PC1, 64)
+    c, d = cd >> 28, cd & 0xFFFFFFF
+    keys = []
+    for shift in _SHIFTS:
+        c = ((c << shift) | (c >> (28 - shift))) & 0xFFFFFFF
+        d = ((d << shift) | (d >> (28 - shift))) & 0xFFFFFFF
+        keys.append(_permute((c << 28) | d, _PC2, 56))
+    return keys
+
+
+def des_encrypt(key, block):
+    """Encrypt one 8-byte block with an 8-byte key"""
+    keys = _subkeys(key)
+    bits = _permute(int.from_bytes(block, "big"), _IP, 64)
+    left, right = bits >> 32, bits & 0xFFFFFFFF
+    for subkey in keys:
+        x = _permute(right, _E, 32) ^ subkey
+        out = 0
+        for i, box in enumerate(_SBOX):
+            six = (x >> (42 - 6 * i)) & 0x3F
+            row = ((six & 0x20) >> 4) | (six & 1)
+            out = (out << 4) | box[row * 16 + ((six >> 1) & 0xF)]
+        left, right = right, left ^ _permute(out, _P, 32)
+    return _permute((right << 32) | left, _FP, 64).to_bytes(8, "big")
+
+
+def vnc_auth_response(password, challenge):
+    """VncAuth: DES-encrypt the 16-byte challenge with the bit-reversed password"""
+    key = password.encode("latin-1")[:8].ljust(8, b"\0")
+    key = bytes(int(f"{byte:08b}"[::-1], 2) for byte in key)
+    return des_encrypt(key, challenge[:8]) + des_encrypt(key, challenge[8:16])
+
+
+class SocketTransport:
+    def __init__(self, sock):
+        self.sock = sock
+        self.received = 0
+
+    def recv_exact(self, size):
+        data = bytearray(size)
+        view = memoryview(data)
+        pos = 0
+        while pos < size:
+            n = self.sock.recv_into(view[pos:])
+            if not n:
+                raise RFBError("server closed the connection")
+            pos += n
+        self.received += size
+        return data
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+
+    def close(self):
+        self.sock.close()
+
+
+class WebSocketTransport:
+    """RFB over the proxy's WebSocket: masked binary frames out, payloads reassembled in"""
+
+    def __init__(self, sock, inflate=None):
+        self.socket = SocketTransport(sock)
+        self.pending = bytearray()
+        self.received = 0
+        # (server_no_context_takeover,) when permessage-deflate was accepted
+        self.inflate = inflate
+        self.decompressor = None
+        self.inflating = False
+
+    @classmethod
+    def open(cls, sock, host, path="/websockify", deflate=False):
+        """Upgrade sock; with deflate offer permessage-deflate like a browser does"""
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        extensions = ("Sec-WebSocket-Extensions: permessage-deflate; client_max_window_bits\r\n"
+                      if deflate else "")
+        sock.sendall((f"GET {path} HTTP/1.1\r\nHost: {host}\r\nUpgrade: websocket\r\n"
+                      f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+                      f"Sec-WebSocket-Version: 13\r\nSec-WebSocket-Protocol: binary\r\n"
+                      f"{extensions}\r\n")
+                     .encode("latin-1"))
+        head = b""
+        while b"\r\n\r\n" not in head:
+            chunk = sock.recv(1)
+            if not chunk or len(head) > 16384:
+                raise RFBError("proxy closed the connection during the upgrade")
+            head += chunk
+        status = head.split(b"\r\n", 1)[0]
+        if b" 101 " not in status + b" ":
+            raise RFBError(f"WebSocket upgrade refused: {status.decode('latin-1')}")
+        if accept_key(key).encode() not in head:
+            raise RFBError("WebSocket upgrade returned a wrong Sec-WebSocket-Accept")
+        inflate = None
+        for line in head.decode("latin-1").split("\r\n"):
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "sec-websocket-extensions" and "permessage-deflate" in value:
+                inflate = ("server_no_context_takeover" in value,)
+        return cls(sock, inflate)
+
+    def _read_frame(self):
+        first, second = self.socket.recv_exact(2)
+        length = second & 0x7F
+        if length == 126:
+            length, = struct.unpack(">H", self.socket.recv_exact(2))
+        elif length == 127:
+            length, = struct.unpack(">Q", self.socket.recv_exact(8))
+        mask = self.socket.recv_exact(4) if second & 0x80 else None
+        payload = self.socket.recv_exact(length) if length else b""
+        if mask:
+            payload = unmask(payload, bytes(mask))
+        opcode = first & 0x0F
+        if opcode in (OP_BINARY, OP_CONTINUATION, OP_TEXT):
+            if opcode != OP_CONTINUATION:
+                self.inflating = bool(first & 0x40 and self.inflate)
+            if self.inflating:
+                payload = self._inflate(payload, first & 0x80)
+            self.pending += payload
+        elif opcode == OP_PING:
+            self._send_frame(OP_PONG, payload)
+        elif opcode == OP_CLOSE:
+            raise RFBError("proxy closed the WebSocket")
+
+    def _inflate(self, payload, fin):
+        if self.decompressor is None:
+            self.decompressor = zlib.decompressobj(-15)
+        data = self.decompressor.decompress(bytes(payload) + b"\x00\x00\xff\xff" if fin else payload)
+        if fin and self.inflate[0]:
+            self.decompressor = None
+        return data
+
+    @property
+    def wire_received(self):
+        """Bytes read off the socket, frame headers and compression included"""
+        return self.socket.received
+
+    def recv_exact(self, size):
+        while len(self.pending) < size:
+            self._read_frame()
+        data = self.pending[:size]
+        del self.pending[:size]
+        self.received += size
+        return data
+
+    def _send_frame(self, opcode, payload):
+        mask = os.urandom(4)
+        length = len(payload)
+        if length < 126:
+            header = struct.pack(">BB", 0x80 | opcode, 0x80 | length)
+        elif length < 65536:
+            header = struct.pack(">BBH", 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack(">BBQ", 0x80 | opcode, 0x80 | 127, length)
+        self.socket.sendall(header + mask + unmask(bytes(payload), mask))
+
+    def sendall(self, data):
+        self._send_frame(OP_BINARY, data)
+
+    def close(self):
+        self.socket.close()
+
+
+class RFBClient:
+    """Blocking RFB client over any transport with recv_exact, sendall and close"""
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.width = 0
+        self.height = 0
+        self.name = ""
+        self.version = None
+
+    @classmethod
+    def connect(cls, host, port, password=None, timeout=10.0, shared=True):
+        sock = socket.create_connection((host, port), timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = cls(SocketTransport(sock))
+        try:
+            client.handshake(password, shared)
+        except BaseException:
+            client.close()
+            raise
+        return client
+
+    @classmethod
+    def connect_websocket(cls, host, port, path="/websockify", password=None, timeout=10.0,
+                          shared=True, deflate=False):
+        """Connect through the WebSocket proxy instead of to Xvnc directly"""
+        sock = socket.create_connection((host, port), timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            client = cls(WebSocketTransport.open(sock, host, path, deflate))
+            client.handshake(password, shared)
+        except BaseException:
+            sock.close()
+            raise
+        return client
+
+    def _recv(self, size):
+        return self.transport.recv_exact(size)
+
+    def _reason(self):
+        length, = struct.unpack(">I", self._recv(4))
+        return self._recv(length).decode("utf-8", "replace")
+
+    def handshake(self, password=None, shared=True):
+        banner = self._recv(12)
+        if not banner.startswith(b"RFB "):
+            raise RFBError(f"not an RFB server: {banner!r}")
+        major, minor = int(banner[4:7]), int(banner[8:11])
+        self.version = (3, 8) if (major, minor) >= (3, 8) else (3, 7) if (major, minor) >= (3, 7) else (3, 3)
+        self.transport.sendall(b"RFB 003.%03d\n" % self.version[1])
+
+        if self.version == (3, 3):
+            security, = struct.unpack(">I", self._recv(4))
+            if security == 0:
+                raise RFBError(f"server refused the connection: {self._reason()}")
+        else:
+            count = self._recv(1)[0]
+            if count == 0:
+                raise RFBError(f"server refused the connection: {self._reason()}")
+            offered = self._recv(count)
+            if password is not None and SECURITY_VNC_AUTH in offered:
+                security = SECURITY_VNC_AUTH
+            elif SECURITY_NONE in offered:
+                security = SECURITY_NONE
+            elif SECURITY_VNC_AUTH in offered:
+                raise AuthenticationError("server requires a VNC password")
+            else:
+                raise RFBError(f"no supported security type among {list(offered)}")
+            self.transport.sendall(bytes([security]))
+
+        if security == SECURITY_VNC_AUTH:
+            if password is None:
+                raise AuthenticationError("server requires a VNC password")
+            self.transport.sendall(vnc_auth_response(password, self._recv(16)))
+        if security == SECURITY_VNC_AUTH or self.version == (3, 8):
+            result, = struct.unpack(">I", self._recv(4))
+            if result != 0:
+                reason = self._reason() if self.version == (3, 8) else "authentication failed"
+                raise AuthenticationError(reason)
+
+        self.transport.sendall(bytes([1 if shared else 0]))
+        self.width, self.height = struct.unpack(">HH", self._recv(4))
+        self._recv(16)          # server pixel format; ours is set below
+        self.name = self._reason()
+        self.transport.sendall(b"\x00\x00\x00\x00" + PIXEL_FORMAT)
+
+    def set_encodings(self, encodings):
+        self.transport.sendall(struct.pack(f">BxH{len(encodings)}i", 2, len(encodings), *encodings))
+
+    def use_encoding(self, name, quality=None, compression=None):
+        """Negotiate exactly one real encoding, plus the pseudo-encodings the parser sizes"""
+        encodings = [ENCODINGS[name]] + PSEUDO
+        if quality is not None:
+            encodings.append(QUALITY_0 + quality)
+        if compression is not None:
+            encodings.append(COMPRESS_0 + compression)
+        self.set_encodings(encodings)
+
+    def request_update(self, incremental=True, x=0, y=0, width=None, height=None):
+        self.transport.sendall(struct.pack(
+            ">BBHHHH", 3, 1 if incremental else 0, x, y,
+            self.width if width is None else width, self.height if height is None else height))
+
+    def pointer(self, x, y, buttons=0):
+        self.transport.sendall(struct.pack(">BBHH", 5, buttons, x, y))
+
+    def read_update(self):
+        """Read server messages up to the next FramebufferUpdate
+
+        Returns (rectangles, bytes) for that update, bytes counting the whole
+        message including its header.
+        """
+        while True:
+            start = self.transport.received
+            kind = self._recv(1)[0]
+            if kind == MSG_FRAMEBUFFER_UPDATE:
+                count, = struct.unpack(">xH", self._recv(3))
+                rects = 0
+                for _ in range(count):
+                    x, y, w, h, encoding = struct.unpack(">HHHHi", self._recv(12))
+                    if encoding == ENC_LAST_RECT:
+                        break
+                    self._skip_rect(encoding, w, h)
+                    if encoding in (ENC_DESKTOP_SIZE, ENC_EXT_DESKTOP_SIZE):
+                        self.width, self.height = w, h
+                    else:
+                        rects += 1
+                return rects, self.transport.received - start
+            elif kind == MSG_COLOUR_MAP:
+                _, count = struct.unpack(">xHH", self._recv(5))
+                self._recv(count * 6)
+            elif kind == MSG_BELL:
+                pass
+            elif kind == MSG_CUT_TEXT:
+                length, = struct.unpack(">3xI", self._recv(7))
+                self._recv(length)
+            else:
+                raise RFBError(f"unexpected server message {kind}")
+
+    def _compact_length(self):
+        length = 0
+        for shift in (0, 7, 14):
+            byte = self._recv(1)[0]
+            if shift == 14:
+                return length | (byte << 14)
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return length
+
+    def _skip_rect(self, encoding, w, h):
+        bpp = BYTES_PER_PIXEL
+        if encoding == ENC_RAW:
+            self._recv(w * h * bpp)
+        elif encoding == ENC_COPYRECT:
+            self._recv(4)
+        elif encoding in (ENC_RRE, ENC_CORRE):
+            count, = struct.unpack(">I", self._recv(4))
+            self._recv(bpp + count * (bpp + (8 if encoding == ENC_RRE else 4)))
+        elif encoding == ENC_HEXTILE:
+            for ty in range(0, h, 16):
+                for tx in range(0, w, 16):
+                    tw, th = min(16, w - tx), min(16, h - ty)
+                    flags = self._recv(1)[0]
+                    if flags & HEXTILE_RAW:
+                        self._recv(tw * th * bpp)
+                        continue
+                    size = (bpp if flags & HEXTILE_BACKGROUND else 0) + \
+                           (bpp if flags & HEXTILE_FOREGROUND else 0)
+                    if size:
+                        self._recv(size)
+                    if flags & HEXTILE_ANY_SUBRECTS:
+                        count = self._recv(1)[0]
+                        self._recv(count * (2 + (bpp if flags & HEXTILE_SUBRECTS_COLOURED else 0)))
+        elif encoding in (ENC_ZLIB, ENC_ZRLE):
+            length, = struct.unpack(">I", self._recv(4))
+            self._recv(length)
+        elif encoding == ENC_TIGHT:
+            self._skip_tight(w, h)
+        elif encoding == ENC_DESKTOP_SIZE:
+            pass
+        elif encoding == ENC_EXT_DESKTOP_SIZE:
+            screens = self._recv(4)[0]
+            self._recv(screens * 16)
+        else:
+            raise RFBError(f"cannot size a rectangle in encoding {encoding}")
+
+    def _skip_tight(self, w, h):
+        control = self._recv(1)[0] >> 4
+        if control == 0x08:                  # fill
+            self._recv(TPIXEL)
+            return
+        if control in (0x09, 0x0A):          # JPEG, PNG
+            self._recv(self._compact_length())
+            return
+        if control & 0x08:
+            raise RFBError(f"invalid Tight control byte {control:#x}")
+        filter_id = self._recv(1)[0] if control & 0x04 else 0
+        row = w * TPIXEL
+        if filter_id == 1:                   # palette
+            colours = self._recv(1)[0] + 1
+            self._recv(colours * TPIXEL)
+            row = (w + 7) // 8 if colours == 2 else w
+        elif filter_id not in (0, 2):
+            raise RFBError(f"invalid Tight filter {filter_id}")
+        size = row * h
+        self._recv(size if size < 12 else self._compact_length())
+
+    def close(self):
+        self.transport.close()
+
+
+def probe_frames(host, port, password=None, timeout=2.0):
+    """True once the server completes the handshake and delivers a framebuffer update"""
+    client = RFBClient.connect(host, port, password, timeout)
+    try:
+        client.use_encoding("raw")
+        client.request_update(False, 0, 0, 1, 1)
+        rects, _ = client.read_update()
+        return rects > 0
+    finally:
+        client.close()
+
+
+def measure(client, incremental, count=None, duration=None):
+    """Time update requests; returns [(latency seconds, rects, bytes)]"""
+    samples = []
+    deadline = time.monotonic() + duration if duration else None
+    while (count is None or len(samples) < count) and (deadline is None or time.monotonic() < deadline):
+        started = time.perf_counter()
+        client.request_update(incremental)
+        rects, nbytes = client.read_update()
+        samples.append((time.perf_counter() - started, rects, nbytes))
+    return samples
@@ -0,0 +1,516 @@
+"""
+RFB-aware transcoding for the WebSocket proxy
+Asks Xvnc for Raw rectangles only and re-encodes them as Tight (zlib or
+JPEG) in a worker pool before they cross the link to the browser
+"""
+
+import io
+import zlib
+import struct
+import asyncio
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+MSG_FRAMEBUFFER_UPDATE = 0
+MSG_SET_PIXEL_FORMAT = 0
+MSG_SET_ENCODINGS = 2
+
+ENC_RAW = 0
+ENC_COPYRECT = 1
+ENC_TIGHT = 7
+ENC_DESKTOP_SIZE = -223
+ENC_LAST_RECT = -224
+ENC_CURSOR = -239
+ENC_QEMU_KEY = -258
+ENC_QEMU_LED = -261
+ENC_DESKTOP_NAME = -307
+ENC_EXT_DESKTOP_SIZE = -308
+ENC_FENCE = -312
+ENC_CONTINUOUS_UPDATES = -313
+ENC_EXT_MOUSE_BUTTONS = -316
+ENC_EXT_CLIPBOARD = 0xc0a1e5ce - (1 << 32)
+QUALITY_0, QUALITY_9 = -32, -23
+COMPRESS_0, COMPRESS_9 = -256, -247
+
+# Pseudo-encodings whose rectangles the parser can size; everything else
+# is dropped from the list Xvnc sees
+FORWARDED_PSEUDO = {ENC_DESKTOP_SIZE, ENC_LAST_RECT, ENC_CURSOR, ENC_QEMU_KEY, ENC_QEMU_LED,
+                    ENC_DESKTOP_NAME, ENC_EXT_DESKTOP_SIZE, ENC_FENCE,
+                    ENC_CONTINUOUS_UPDATES, ENC_EXT_MOUSE_BUTTONS, ENC_EXT_CLIPBOARD}
+
+SECURITY_NONE = 1
+SECURITY_VNC_AUTH = 2
+
+# TigerVNC's JPEG quality for each client quality level
+JPEG_QUALITY = (15, 29, 41, 42, 62, 77, 79, 86, 92, 100)
+DEFAULT_LEVEL = 6
+TILE_PIXELS = 65536        # Tight basic rects stay below this size
+MAX_TILE_WIDTH = 2048
+INLINE_PIXELS = 1024       # smaller rects are encoded on the loop, IPC would cost more
+JPEG_MIN_PIXELS = 4096     # smaller rects stay lossless
+MAX_PENDING_UPDATES = 4    # stop reading Xvnc while this many updates are encoding
+
+
+class Unsupported(Exception):
+    """Stream content the parser cannot size; the session falls back to relaying"""
+
+
+def compact_length(n):
+    """Tight's 1-3 byte length prefix"""
+    out = bytearray([n & 0x7F])
+    if n > 0x7F:
+        out[0] |= 0x80
+        out.append((n >> 7) & 0x7F)
+        if n > 0x3FFF:
+            out[1] |= 0x80
+            out.append((n >> 14) & 0xFF)
+    return bytes(out)
+
+
+def pixel_offsets(fmt):
+    """Byte offsets of red, green and blue in a 32 bpp pixel, or None if not convertible"""
+    bpp, _, big_endian, true_colour, rmax, gmax, bmax, rs, gs, bs = \
+        struct.unpack_from("!BBBBHHHBBB", fmt)
+    if bpp != 32 or not true_colour or (rmax, gmax, bmax) != (255, 255, 255):
+        return bpp // 8, None
+    if any(shift % 8 for shift in (rs, gs, bs)):
+        return bpp // 8, None
+    return 4, tuple(3 - s // 8 if big_endian else s // 8 for s in (rs, gs, bs))
+
+
+def encode_tile(raw, width, height, offsets, quality, level):
+    """Worker: one 32 bpp Raw tile to a Tight payload (control byte onwards)"""
+    r, g, b = offsets
+    rgb = bytearray(width * height * 3)
+    rgb[0::3] = raw[r::4]
+    rgb[1::3] = raw[g::4]
+    rgb[2::3] = raw[b::4]
+    rgb = bytes(rgb)
+    if rgb == rgb[:3] * (width * height):
+        return b"\x80" + rgb[:3]
+    if quality is not None and Image is not None and width * height >= JPEG_MIN_PIXELS:
+        out = io.BytesIO()
+        Image.frombytes("RGB", (width, height), rgb).save(
+            out, "JPEG", quality=JPEG_QUALITY[quality])
+        data = out.getvalue()
+        return b"\x90" + compact_length(len(data)) + data
+    if len(rgb) < 12:
+        return b"\x00" + rgb
+    data = zlib.compress(rgb, level)
+    # Stream 0 is reset for every rect so tiles can be compressed independently
+    return b"\x01" + compact_length(len(data)) + data
+
+
+def tiles(x, y, width, height):
+    """Split a rect into Tight-sized tiles: (x, y, w, h) relative to the rect"""
+    tile_width = min(width, MAX_TILE_WIDTH)
+    rows = max(1, TILE_PIXELS // tile_width)
+    for ty in range(0, height, rows):
+        for tx in range(0, width, tile_width):
+            yield tx, ty, min(tile_width, width - tx), min(rows, height - ty)
+
+
+def tight_rect(body, x, y, w, h, offsets, quality, level, pool=None, loop=None):
+    """Pieces of one 32 bpp Raw rect encoded as Tight tiles
+
+    Small tiles are encoded inline (header + payload bytes), larger ones are
+    submitted to the pool and appear as (header, future) pairs for
+    assemble_update.
+    """
+    pieces = []
+    for tx, ty, tw, th in tiles(x, y, w, h):
+        if tw == w:
+            raw = bytes(body[ty * w * 4:(ty + th) * w * 4])
+        else:
+            raw = b"".join(body[(ty + row) * w * 4 + tx * 4:(ty + row) * w * 4 + (tx + tw) * 4]
+                           for row in range(th))
+        header = struct.pack("!HHHHi", x + tx, y + ty, tw, th, ENC_TIGHT)
+        args = (raw, tw, th, offsets, quality, level)
+        if tw * th <= INLINE_PIXELS or pool is None:
+            pieces.append(header + encode_tile(*args))
+        else:
+            pieces.append((header, loop.run_in_executor(pool, encode_tile, *args)))
+    return pieces
+
+
+async def assemble_update(pieces):
+    """One FramebufferUpdate message from encoded rect pieces, in order"""
+    encoded = iter(await asyncio.gather(*(p[1] for p in pieces if isinstance(p, tuple))))
+    parts = [p[0] + next(encoded) if isinstance(p, tuple) else p for p in pieces]
+    if len(parts) < 0xFFFF:
+        head = struct.pack("!BxH", MSG_FRAMEBUFFER_UPDATE, len(parts))
+    else:
+        head = struct.pack("!BxH", MSG_FRAMEBUFFER_UPDATE, 0xFFFF)
+        parts.append(struct.pack("!HHHHi", 0, 0, 0, 0, ENC_LAST_RECT))
+    return head + b"".join(parts)
+
+
+def create_pool(workers=None):
+    # forkserver: the proxy runs next to other threads, forking it is unsafe
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("forkserver"))
+
+
+class RFBTranscoder:
+    """Follows one RFB session and rewrites its framebuffer updates
+
+    ``from_client`` returns the bytes to forward to Xvnc (SetEncodings is
+    rewritten to ask for Raw); server data goes through ``from_server``
+    and reaches the browser, in order, via ``client.send_message``.
+    """
+
+    def __init__(self, client, pool, on_bytes=None):
+        self.client = client
+        self.pool = pool
+        self.on_bytes = on_bytes
+        self.loop = asyncio.get_running_loop()
+        self.server_buf = bytearray()
+        self.client_buf = bytearray()
+        self.server_state = "version"
+        self.client_state = "version"
+        self.server_passthrough = False
+        self.client_passthrough = False
+        self.version = None
+        self.security = None
+        self.bytes_per_pixel = 4
+        self.offsets = None
+        self.client_format = False
+        self.tight = False
+        self.quality = None
+        self.level = DEFAULT_LEVEL
+        self.extended_pointer = False
+        self.output = deque()
+        self.encoding = 0
+        self.paused = False
+
+    # browser -> Xvnc
+
+    def from_client(self, data):
+        if self.client_passthrough:
+            return data
+        buf = self.client_buf
+        buf += data
+        out = bytearray()
+        while buf and not self.client_passthrough:
+            try:
+                length = self._client_length(buf)
+            except Unsupported:
+                self.client_passthrough = True
+                break
+            if length is None or len(buf) < length:
+                break
+            message = bytes(buf[:length])
+            del buf[:length]
+            out += self._client_message(message)
+        if self.client_passthrough:
+            out += buf
+            buf.clear()
+        self._parse_server()
+        return bytes(out)
+
+    def _client_length(self, buf):
+        state = self.client_state
+        if state == "version":
+            return 12
+        if state == "security":
+            if self.version >= 7:
+                return 1
+            # RFB 3.3: the server picks the security type
+            if self.security is None:
+                return None
+            return self._after_security_length()
+        if state == "auth":
+            return 16
+        if state == "init":
+            return 1
+        kind = buf[0]
+        if kind == MSG_SET_PIXEL_FORMAT:
+            return 20
+        if kind == MSG_SET_ENCODINGS:
+            return 4 + 4 * struct.unpack_from("!H", buf, 2)[0] if len(buf) >= 4 else None
+        if kind == 3:
+            return 10
+        if kind == 4:
+            return 8
+        if kind == 5:
+            if len(buf) < 2:
+                return None
+            return 7 if self.extended_pointer and buf[1] & 0x80 else 6
+        if kind == 6:
+            return 8 + abs(struct.unpack_from("!i", buf, 4)[0]) if len(buf) >= 8 else None
+        if kind == 150:
+            return 10
+        if kind == 248:
+            return 9 + buf[8] if len(buf) >= 9 else None
+        if kind == 250:
+            return 4
+        if kind == 251:
+            return 8 + 16 * buf[6] if len(buf) >= 8 else None
+        if kind == 255:
+            if len(buf) < 2:
+                return None
+            if buf[1] == 0:
+                return 12
+        raise Unsupported(f"client message {kind}")
+
+    def _after_security_length(self):
+        if self.security == SECURITY_VNC_AUTH:
+            self.client_state = "auth"
+            return 16
+        if self.security == SECURITY_NONE:
+            self.client_state = "init"
+            return 1
+        raise Unsupported(f"security type {self.security}")
+
+    def _client_message(self, message):
+        state = self.client_state
+        if state == "version":
+            self.version = int(message[8:11])
+            self.client_state = "security"
+        elif state == "security" and self.version >= 7:
+            self.security = message[0]
+            if self.security not in (SECURITY_NONE, SECURITY_VNC_AUTH):
+                # TLS or another wrapper: nothing after this can be parsed
+                self.client_passthrough = self.server_passthrough = True
+            self.client_state = "auth" if self.security == SECURITY_VNC_AUTH else "init"
+        elif state in ("security", "auth"):
+            self.client_state = "init"
+        elif state == "init":
+            self.client_state = "messages"
+        elif message[0] == MSG_SET_PIXEL_FORMAT:
+            self.bytes_per_pixel, self.offsets = pixel_offsets(message[4:20])
+            self.client_format = True
+        elif message[0] == MSG_SET_ENCODINGS:
+            return self._rewrite_encodings(message)
+        return message
+
+    def _rewrite_encodings(self, message):
+        count = struct.unpack_from("!H", message, 2)[0]
+        requested = struct.unpack_from(f"!{count}i", message, 4)
+        self.tight = ENC_TIGHT in requested and self.offsets is not None
+        if not self.tight:
+            return message
+        self.quality = next((e - QUALITY_0 for e in requested
+                             if QUALITY_0 <= e <= QUALITY_9), None)
+        level = next((e - COMPRESS_0 for e in requested
+                      if COMPRESS_0 <= e <= COMPRESS_9), DEFAULT_LEVEL)
+        self.level = max(level, 1)
+        forwarded = [e for e in requested if e == ENC_COPYRECT or e in FORWARDED_PSEUDO]
+        forwarded.insert(forwarded.count(ENC_COPYRECT), ENC_RAW)
+        return struct.pack(f"!BxH{len(forwarded)}i", MSG_SET_ENCODINGS, len(forwarded), *forwarded)
+
+    # Xvnc -> browser
+
+    def from_server(self, data):
+        if self.server_passthrough:
+            self._emit(bytes(data))
+            return
+        self.server_buf += data
+        self._parse_server()
+
+    def _parse_server(self):
+        buf = self.server_buf
+        while buf and not self.server_passthrough:
+            try:
+                length = self._server_length(buf)
+            except Unsupported:
+                self.server_passthrough = True
+                break
+            if length is None or len(buf) < length:
+                return
+            message = bytes(buf[:length])
+            del buf[:length]
+            self._server_message(message)
+        if self.server_passthrough and buf:
+            self._emit(bytes(buf))
+            buf.clear()
+
+    def _server_length(self, buf):
+        state = self.server_state
+        if state == "version":
+            return 12
+        if state == "security":
+            if self.version is None:
+                return None
+            if self.version < 7:
+                return 4
+            if buf[0] == 0:
+                raise Unsupported("connection refused")
+            return 1 + buf[0]
+        if state == "chosen":
+            if self.security is None:
+                return None
+            if self.security == SECURITY_VNC_AUTH:
+                self.server_state = "challenge"
+                return 16
+            if self.security != SECURITY_NONE:
+                raise Unsupported(f"security type {self.security}")
+            self.server_state = "result" if self.version >= 8 else "init"
+            return self._server_length(buf)
+        if state == "challenge":
+            return 16
+        if state == "result":
+            return 4
+        if state == "init":
+            if len(buf) < 24:
+                return None
+            return 24 + struct.unpack_from("!I", buf, 20)[0]
+        kind = buf[0]
+        if kind == MSG_FRAMEBUFFER_UPDATE:
+            return self._update_length(buf)
+        if kind == 1:
+            return 6 + 6 * struct.unpack_from("!H", buf, 4)[0] if len(buf) >= 6 else None
+        if kind == 2 or kind == 150:
+            return 1
+        if kind == 3:
+            return 8 + abs(struct.unpack_from("!i", buf, 4)[0]) if len(buf) >= 8 else None
+        if kind == 248:
+            return 9 + buf[8] if len(buf) >= 9 else None
+        if kind == 250:
+            return 4
+        raise Unsupported(f"server message {kind}")
+
+    def _rect_length(self, buf, pos, width, height, encoding):
+        """Payload size of one rect at pos, or None if its length is not buffered yet"""
+        if encoding == ENC_RAW:
+            return width * height * self.bytes_per_pixel
+        if encoding == ENC_COPYRECT:
+            return 4
+        if encoding in (ENC_DESKTOP_SIZE, ENC_LAST_RECT, ENC_QEMU_KEY, ENC_EXT_MOUSE_BUTTONS):
+            return 0
+        if encoding == ENC_QEMU_LED:
+            return 1
+        if encoding == ENC_CURSOR:
+            return width * height * self.bytes_per_pixel + (width + 7) // 8 * height
+        if encoding == ENC_DESKTOP_NAME:
+            return 4 + struct.unpack_from("!I", buf, pos)[0] if len(buf) >= pos + 4 else None
+        if encoding == ENC_EXT_DESKTOP_SIZE:
+            return 4 + 16 * buf[pos] if len(buf) > pos else None
+        raise Unsupported(f"encoding {encoding}")
+
+    def _rects(self, buf):
+        """Walk the rects of the update at the start of buf
+
+        Yields (offset, x, y, w, h, encoding, payload length); stops early
+        when the buffer ends before the update does.
+        """
+        if len(buf) < 4:
+            return
+        count = struct.unpack_from("!H", buf, 2)[0]
+        pos, seen = 4, 0
+        while count == 0xFFFF or seen < count:
+            if len(buf) < pos + 12:
+                return
+            x, y, w, h, encoding = struct.unpack_from("!HHHHi", buf, pos)
+            length = self._rect_length(buf, pos + 12, w, h, encoding)
+            if length is None:
+                return
+            yield pos, x, y, w, h, encoding, length
+            pos += 12 + length
+            seen += 1
+            if encoding == ENC_LAST_RECT:
+                return
+
+    def _update_length(self, buf):
+        count = struct.unpack_from("!H", buf, 2)[0] if len(buf) >= 4 else None
+        end, seen, last = 4, 0, False
+        for pos, _, _, _, _, encoding, length in self._rects(buf):
+            end = pos + 12 + length
+            seen += 1
+            last = encoding == ENC_LAST_RECT
+        if count is None or (count == 0xFFFF and not last) or (count != 0xFFFF and seen < count):
+            return None
+        return end
+
+    def _server_message(self, message):
+        state = self.server_state
+        if state == "version":
+            self.server_state = "security"
+        elif state == "security":
+            if self.version < 7:
+                self.security = struct.unpack("!I", message)[0]
+                if self.security == 0:
+                    self.server_passthrough = True
+            self.server_state = "chosen"
+        elif state == "challenge":
+            self.server_state = "result"
+        elif state == "result":
+            if struct.unpack("!I", message)[0] != 0:
+                self.server_passthrough = True
+            self.server_state = "init"
+        elif state == "init":
+            if not self.client_format:
+                self.bytes_per_pixel, self.offsets = pixel_offsets(message[4:20])
+            self.server_state = "messages"
+        elif message[0] == MSG_FRAMEBUFFER_UPDATE:
+            self._transcode_update(message)
+            return
+        self._emit(message)
+
+    def _transcode_update(self, message):
+        pieces = []
+        encoded = False
+        for pos, x, y, w, h, encoding, length in self._rects(message):
+            if encoding == ENC_LAST_RECT:
+                break
+            if encoding == ENC_EXT_MOUSE_BUTTONS:
+                self.extended_pointer = True
+            body = memoryview(message)[pos + 12:pos + 12 + length]
+            if encoding != ENC_RAW or not self.tight or self.offsets is None or not w or not h:
+                pieces.append(message[pos:pos + 12 + length])
+                continue
+            encoded = True
+            pieces += tight_rect(body, x, y, w, h, self.offsets, self.quality, self.level,
+                                 self.pool, self.loop)
+        if not encoded:
+            self._emit(message)
+            return
+        self._emit(self.loop.create_task(self._assemble(pieces, len(message))))
+
+    async def _assemble(self, pieces, raw_size):
+        update = await assemble_update(pieces)
+        if self.on_bytes:
+            self.on_bytes(raw_size, len(update))
+        return update
+
+    # ordered output
+
+    def _emit(self, item):
+        if isinstance(item, asyncio.Future):
+            self.encoding += 1
+            item.add_done_callback(lambda _: self._flush())
+            if self.encoding >= MAX_PENDING_UPDATES and not self.paused:
+                self.paused = True
+                self.client.target.transport.pause_reading()
+        self.output.append(item)
+        self._flush()
+
+    def _flush(self):
+        output = self.output
+        while output:
+            head = output[0]
+            if isinstance(head, asyncio.Future):
+                if not head.done():
+                    return
+                output.popleft()
+                self.encoding -= 1
+                if head.cancelled():
+                    return
+                if head.exception() is not None:
+                    print(f"⚠ Transcoding failed: {head.exception()}")
+                    self.client.close(1011)
+                    return
+                data = head.result()
+            else:
+                data = output.popleft()
+            self.client.send_message(data)
+        if self.paused and self.encoding < MAX_PENDING_UPDATES:
+            self.paused = False
+            target = self.client.target
+            if target and target.transport:
+                target.transport.resume_reading()
@@ -6,9 +6,12 @@ Main entry point for VNC Desktop Remote Access
 
 import os
 import sys
-import subprocess
 from pathlib import Path
 
+# Setup and the launcher run in this interpreter: no extra Python start-ups
+import setup
+import start_vnc
+
 def check_setup():
     """Check if setup has been run"""
     vnc_dir = Path.home() / ".vnc"
@@ -21,19 +24,21 @@ def main():
     print("🚀 مشروع سطح المكتب البعيد - VNC Desktop Remote Access")
     print("=" * 60)
     
-    # Check if setup is needed
-    if not check_setup():
+    # Every launch brings the setup up to date; unchanged steps are skipped
+    # from their fingerprints (setup_state.py), so a warm start costs a few stat()s
+    first_run = not check_setup()
+    if first_run:
         print("🔧 تشغيل الإعداد الأولي...")
-        try:
-            subprocess.run([sys.executable, "setup.py"], check=True)
-        except subprocess.CalledProcessError:
+    if not setup.ensure_setup():
+        if first_run:
             print("❌ فشل في الإعداد الأولي")
             sys.exit(1)
+        print("⚠️  تعذر تحديث الإعداد، المتابعة بالإعداد الحالي")
     
     # Start VNC server
     print("🌟 بدء خدمة سطح المكتب البعيد...")
     try:
-        subprocess.run([sys.executable, "start_vnc.py"])
+        start_vnc.main(sys.argv[1:])
     except KeyboardInterrupt:
         print("\n👋 تم إيقاف الخدمة بواسطة المستخدم")
     except Exception as e:
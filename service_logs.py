@@ -0,0 +1,233 @@
+"""
+Output capture for the desktop services
+One selector thread drains every child's stdout and stderr without blocking,
+keeps the last lines of each service in a ring buffer and hands them to an
+optional writer thread for rotated log files
+"""
+
+import os
+import time
+import queue
+import selectors
+import threading
+from pathlib import Path
+from collections import deque
+
+from metrics import LOG_LINES, LOG_DROPPED
+
+RING_LINES = 200            # lines kept per service
+MAX_LINE = 4096             # longer lines are cut (a child writing no newlines)
+READ_SIZE = 64 * 1024
+WRITE_QUEUE = 1000          # reads waiting for the log files before new ones are dropped
+ROTATE_BYTES = 5 * 1024 * 1024
+ROTATE_KEEP = 3
+
+
+class RotatingFile:
+    """Append-only log file rotated to name.1 .. name.keep by size"""
+
+    def __init__(self, path, max_bytes=ROTATE_BYTES, keep=ROTATE_KEEP):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, "ab")
+
+    def write(self, data):
+        if self.file.tell() + len(data) > self.max_bytes:
+            self.rotate()
+        self.file.write(data)
+
+    def rotate(self):
+        self.file.close()
+        for index in range(self.keep - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{index}")
+            if older.exists():
+                older.replace(self.path.with_name(f"{self.path.name}.{index + 1}"))
+        self.path.replace(self.path.with_name(f"{self.path.name}.1"))
+        self.file = open(self.path, "ab")
+
+    def close(self):
+        self.file.close()
+
+
+class _Stream:
+    def __init__(self, service, name, pipe):
+        self.service = service
+        self.name = name
+        self.pipe = pipe
+        self.partial = b""
+
+
+class LogPipeline:
+    def __init__(self, log_dir=None, ring_lines=RING_LINES):
+        """Capture child output; with ``log_dir`` also write <service>.log files there"""
+        self.log_dir = Path(log_dir) if log_dir else None
+        self.ring_lines = ring_lines
+        self.rings = {}
+        self.open_streams = {}
+        self.lock = threading.Lock()
+        self.closed = threading.Condition(self.lock)
+        self.selector = selectors.DefaultSelector()
+        self.pending = queue.SimpleQueue()
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+        self.files = {}
+        self.writes = queue.Queue(WRITE_QUEUE) if self.log_dir else None
+        self.running = False
+        self.thread = None
+        self.writer = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="service-logs", daemon=True)
+        self.thread.start()
+        if self.writes is not None:
+            self.writer = threading.Thread(target=self._write_files, name="service-log-files",
+                                           daemon=True)
+            self.writer.start()
+        return self
+
+    def attach(self, service, process):
+        """Drain the stdout/stderr pipes of a Popen started with subprocess.PIPE"""
+        for name in ("stdout", "stderr"):
+            pipe = getattr(process, name)
+            if pipe is not None:
+                os.set_blocking(pipe.fileno(), False)
+                with self.lock:
+                    self.open_streams[service] = self.open_streams.get(service, 0) + 1
+                self.pending.put(_Stream(service, name, pipe))
+        self._wake()
+        return process
+
+    def _wake(self):
+        try:
+            os.write(self.wake_w, b"\0")
+        except BlockingIOError:
+            pass    # a wake-up is already pending
+
+    def _run(self):
+        while self.running:
+            for key, _ in self.selector.select():
+                if key.data is None:
+                    self._register_pending()
+                else:
+                    self._read(key.data)
+        for key in list(self.selector.get_map().values()):
+            if key.data is not None:
+                self._close(key.data)
+
+    def _register_pending(self):
+        try:
+            os.read(self.wake_r, 4096)
+        except BlockingIOError:
+            pass
+        while True:
+            try:
+                stream = self.pending.get_nowait()
+            except queue.Empty:
+                return
+            self.selector.register(stream.pipe, selectors.EVENT_READ, stream)
+
+    def _read(self, stream):
+        try:
+            data = os.read(stream.pipe.fileno(), READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(stream)
+            return
+        lines = (stream.partial + data).split(b"\n")
+        stream.partial = lines.pop()
+        if len(stream.partial) > MAX_LINE:
+            lines.append(stream.partial)
+            stream.partial = b""
+        if lines:
+            self._lines(stream, lines)
+
+    def _close(self, stream):
+        if stream.partial:
+            self._lines(stream, [stream.partial])
+            stream.partial = b""
+        self.selector.unregister(stream.pipe)
+        stream.pipe.close()
+        with self.lock:
+            self.open_streams[stream.service] -= 1
+            self.closed.notify_all()
+
+    def _lines(self, stream, lines):
+        """Record one read's worth of lines; they share a timestamp"""
+        # Kept as bytes: decoding waits until a line is actually shown
+        now = time.time()
+        lines = [line[:MAX_LINE].rstrip(b"\r") for line in lines]
+        with self.lock:
+            ring = self.rings.get(stream.service)
+            if ring is None:
+                ring = self.rings[stream.service] = deque(maxlen=self.ring_lines)
+            ring.extend((now, stream.name, line) for line in lines)
+        LOG_LINES.labels(stream.service).inc(len(lines))
+        if self.writes is not None:
+            try:
+                self.writes.put_nowait((stream.service, now, stream.name, lines))
+            except queue.Full:
+                # A slow disk loses log lines, never stalls a child
+                LOG_DROPPED.labels(stream.service).inc(len(lines))
+
+    def _write_files(self):
+        while True:
+            item = self.writes.get()
+            if item is None:
+                break
+            service, timestamp, name, lines = item
+            handle = self.files.get(service)
+            if handle is False:
+                continue
+            try:
+                if handle is None:
+                    handle = self.files[service] = RotatingFile(self.log_dir / f"{service}.log")
+                prefix = format_entry(service, (timestamp, name, b"")).encode()
+                handle.write(b"".join(prefix + line + b"\n" for line in lines))
+                if self.writes.empty():
+                    handle.file.flush()
+            except OSError as e:
+                print(f"⚠ Log file for {service} unavailable, ring buffer only: {e}")
+                self.files[service] = False
+        for handle in self.files.values():
+            if handle:
+                handle.close()
+
+    def wait_closed(self, service, timeout=1.0):
+        """Wait until a service's pipes reached EOF, so tail() has its last words"""
+        with self.lock:
+            return self.closed.wait_for(lambda: not self.open_streams.get(service), timeout)
+
+    def tail(self, service, count=20):
+        """The last count lines of a service, formatted"""
+        with self.lock:
+            entries = list(self.rings.get(service, ()))[-count:]
+        return [format_entry(service, entry) for entry in entries]
+
+    def stop(self, timeout=2.0):
+        """Stop once the children closed their pipes (or after timeout)"""
+        with self.lock:
+            self.closed.wait_for(lambda: not any(self.open_streams.values()), timeout)
+        self.running = False
+        self._wake()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+        if self.writer:
+            self.writes.put(None)
+            self.writer.join(timeout=5)
+            self.writer = None
+
+
+def format_entry(service, entry):
+    timestamp, stream, line = entry
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+    text = line.decode("utf-8", "replace")
+    return f"{stamp}.{int(timestamp % 1 * 1000):03d} [{service}] {stream}: {text}"
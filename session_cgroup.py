@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+cgroup v2 isolation for desktop sessions
+Places each session's Xvnc, fluxbox and Firefox in a cgroup of its own with
+CPU, memory and IO limits, and reads per-session usage back from it
+"""
+
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+
+from metrics import REGISTRY, SESSION_CPU_SECONDS, SESSION_MEMORY_BYTES, SESSION_IO_BYTES
+
+CPU_PERIOD = 100000       # microseconds; cpu.max quotas are cores * period
+LAUNCHER_LEAF = "launcher"
+SIZE_SUFFIXES = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(value):
+    """Bytes from 512M / 2G / 1048576 style strings"""
+    value = str(value).strip().upper().removesuffix("B").removesuffix("I")
+    if value and value[-1] in SIZE_SUFFIXES:
+        return int(float(value[:-1]) * SIZE_SUFFIXES[value[-1]])
+    return int(value)
+
+
+def cgroup2_mount():
+    """Where the unified hierarchy is mounted (also in hybrid setups), or None"""
+    with open("/proc/self/mounts") as f:
+        for line in f:
+            fields = line.split()
+            if fields[2] == "cgroup2":
+                return Path(fields[1])
+    return None
+
+
+def own_cgroup():
+    """The calling process's cgroup v2 directory, or None without cgroup v2"""
+    mount = cgroup2_mount()
+    if mount is None:
+        return None
+    with open("/proc/self/cgroup") as f:
+        for line in f:
+            if line.startswith("0::"):
+                return mount / line.strip()[3:].lstrip("/")
+    return None
+
+
+def block_device(path):
+    """MAJ:MIN of the whole disk holding path (io.max does not take partitions)"""
+    dev = os.stat(path).st_dev
+    major, minor = os.major(dev), os.minor(dev)
+    if major == 0:
+        return None     # tmpfs, overlay and other virtual filesystems
+    sys_dev = Path(f"/sys/dev/block/{major}:{minor}")
+    if (sys_dev / "partition").exists():
+        return (sys_dev.resolve().parent / "dev").read_text().strip()
+    return f"{major}:{minor}"
+
+
+class SessionCgroup:
+    def __init__(self, name, cpu_weight=None, cpu_quota=None, memory_high=None, memory_max=None,
+                 io_weight=None, io_read_bps=None, io_write_bps=None, io_path=None, parent=None):
+        """Limits left at None are not set; ``cpu_quota`` is in cores, sizes take 512M / 2G
+
+        ``io_path`` is a path on the disk that io.max throttles (the profile).
+        """
+        self.name = name
+        self.cpu_weight = cpu_weight
+        self.cpu_quota = cpu_quota
+        self.memory_high = memory_high
+        self.memory_max = memory_max
+        self.io_weight = io_weight
+        self.io_read_bps = io_read_bps
+        self.io_write_bps = io_write_bps
+        self.io_path = io_path
+        self.parent = Path(parent) if parent else None
+        self.path = None
+        self.warnings = []
+        REGISTRY.add_collector(self.collect)
+
+    def _controllers(self):
+        wanted = set()
+        if self.cpu_weight is not None or self.cpu_quota is not None:
+            wanted.add("cpu")
+        if self.memory_high is not None or self.memory_max is not None:
+            wanted.add("memory")
+        if self.io_weight is not None or self.io_read_bps or self.io_write_bps:
+            wanted.add("io")
+        return wanted
+
+    def _delegate(self, base, wanted):
+        """Enable controllers for base's children; returns those available"""
+        available = set((base / "cgroup.controllers").read_text().split())
+        enabled = set((base / "cgroup.subtree_control").read_text().split())
+        missing = wanted & available - enabled
+        if not missing:
+            return wanted & available
+        if base != cgroup2_mount() and (base / "cgroup.procs").read_text().strip():
+            # No processes in inner nodes: move the launcher into a leaf first
+            leaf = base / LAUNCHER_LEAF
+            leaf.mkdir(exist_ok=True)
+            (leaf / "cgroup.procs").write_text(str(os.getpid()))
+        try:
+            (base / "cgroup.subtree_control").write_text(" ".join(f"+{c}" for c in sorted(missing)))
+        except OSError as e:
+            # Other processes still share the parent cgroup
+            self.warnings.append(f"cannot enable {', '.join(sorted(missing))}: {e}")
+            return wanted & enabled
+        return wanted & available
+
+    def _write(self, name, value):
+        try:
+            (self.path / name).write_text(str(value))
+        except OSError as e:
+            self.warnings.append(f"{name}: {e}")
+
+    def create(self):
+        """Create the session cgroup and apply its limits; returns its path"""
+        base = self.parent or own_cgroup()
+        if base is None:
+            raise OSError("cgroup v2 is not mounted")
+        if base.name == LAUNCHER_LEAF:
+            # An earlier session already moved the launcher down
+            base = base.parent
+        wanted = self._controllers()
+        active = self._delegate(base, wanted) if wanted else set()
+        for controller in sorted(wanted - active):
+            self.warnings.append(f"{controller} controller not available, its limits are skipped")
+        self.path = base / self.name
+        self.path.mkdir(exist_ok=True)
+
+        if "cpu" in active:
+            if self.cpu_weight is not None:
+                self._write("cpu.weight", self.cpu_weight)
+            if self.cpu_quota is not None:
+                self._write("cpu.max", f"{int(self.cpu_quota * CPU_PERIOD)} {CPU_PERIOD}")
+        if "memory" in active:
+            # memory.high throttles and reclaims before memory.max OOM-kills
+            if self.memory_high is not None:
+                self._write("memory.high", parse_size(self.memory_high))
+            if self.memory_max is not None:
+                self._write("memory.max", parse_size(self.memory_max))
+        if "io" in active:
+            if self.io_weight is not None:
+                self._write("io.weight", f"default {self.io_weight}")
+            if self.io_read_bps or self.io_write_bps:
+                device = block_device(self.io_path or Path.home())
+                if device is None:
+                    self.warnings.append("io.max: the profile is not on a block device")
+                else:
+                    limits = [f"rbps={parse_size(self.io_read_bps)}" if self.io_read_bps else "",
+                              f"wbps={parse_size(self.io_write_bps)}" if self.io_write_bps else ""]
+                    self._write("io.max", " ".join([device, *filter(None, limits)]))
+        return self.path
+
+    def add(self, pid):
+        """Move a process into the session; its later children start inside it"""
+        with open(self.path / "cgroup.procs", "w") as f:
+            f.write(str(pid))
+
+    def pids(self):
+        try:
+            return [int(pid) for pid in (self.path / "cgroup.procs").read_text().split()]
+        except OSError:
+            return []
+
+    def _stat(self, name):
+        """Key/value pairs of a flat-keyed cgroup file such as cpu.stat"""
+        try:
+            lines = (self.path / name).read_text().splitlines()
+        except OSError:
+            return {}
+        return {key: int(value) for key, value in (line.split() for line in lines)}
+
+    def _value(self, name):
+        try:
+            return int((self.path / name).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def usage(self):
+        """CPU seconds, memory bytes and IO bytes of the whole session so far"""
+        usage = {"cpu_seconds": self._stat("cpu.stat").get("usage_usec", 0) / 1e6}
+        memory = self._value("memory.current")
+        if memory is not None:
+            usage["memory_bytes"] = memory
+            usage["memory_peak_bytes"] = self._value("memory.peak")
+            usage["memory_high_events"] = self._stat("memory.events").get("high", 0)
+        try:
+            io_lines = (self.path / "io.stat").read_text().splitlines()
+        except OSError:
+            io_lines = None
+        if io_lines is not None:
+            read = written = 0
+            for line in io_lines:
+                fields = dict(item.split("=") for item in line.split()[1:])
+                read += int(fields.get("rbytes", 0))
+                written += int(fields.get("wbytes", 0))
+            usage["io_read_bytes"], usage["io_write_bytes"] = read, written
+        return usage
+
+    def collect(self):
+        if self.path is None:
+            return
+        usage = self.usage()
+        SESSION_CPU_SECONDS.labels(self.name).set(usage["cpu_seconds"])
+        if "memory_bytes" in usage:
+            SESSION_MEMORY_BYTES.labels(self.name).set(usage["memory_bytes"])
+        if "io_read_bytes" in usage:
+            SESSION_IO_BYTES.labels(self.name, "read").set(usage["io_read_bytes"])
+            SESSION_IO_BYTES.labels(self.name, "write").set(usage["io_write_bytes"])
+
+    def remove(self, timeout=5.0):
+        """Delete the cgroup once its processes have exited; left in place (and
+        reused by the next start) if they outlive timeout"""
+        if self.path is None:
+            return False
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.path.rmdir()
+                self.path = None
+                return True
+            except FileNotFoundError:
+                self.path = None
+                return True
+            except OSError:
+                # Busy while populated
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.05)
+
+
+LIMIT_ARGUMENTS = ("cpu_weight", "cpu_quota", "memory_high", "memory_max", "io_weight",
+                   "io_read_bps", "io_write_bps")
+
+
+def add_limit_arguments(parser):
+    """The --cgroup and limit flags shared by the launchers"""
+    parser.add_argument("--cgroup", action="store_true", default=bool(os.environ.get("VNC_CGROUP")),
+                        help="Run each session in a cgroup v2 of its own (implied by any limit)")
+    parser.add_argument("--cpu-weight", type=int, default=None, help="cpu.weight, 1-10000 (default 100)")
+    parser.add_argument("--cpu-quota", type=float, default=None, metavar="CORES",
+                        help="cpu.max as a number of cores")
+    parser.add_argument("--memory-high", default=None, metavar="SIZE",
+                        help="memory.high: throttle and reclaim above this (e.g. 1536M)")
+    parser.add_argument("--memory-max", default=None, metavar="SIZE", help="memory.max: hard limit")
+    parser.add_argument("--io-weight", type=int, default=None, help="io.weight, 1-10000 (default 100)")
+    parser.add_argument("--io-read-bps", default=None, metavar="SIZE",
+                        help="io.max read bytes per second on the profile's disk")
+    parser.add_argument("--io-write-bps", default=None, metavar="SIZE",
+                        help="io.max write bytes per second on the profile's disk")
+
+
+def limits_from_args(args):
+    """SessionCgroup keyword arguments, or None when no cgroup was asked for"""
+    limits = {key: getattr(args, key) for key in LIMIT_ARGUMENTS if getattr(args, key) is not None}
+    return limits if args.cgroup or limits else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the resource usage of desktop session cgroups")
+    parser.add_argument("names", nargs="*", help="Session cgroups (default: every vnc-session-*)")
+    parser.add_argument("--parent", default=None, help="cgroup v2 directory holding the sessions")
+    args = parser.parse_args()
+
+    parent = Path(args.parent) if args.parent else own_cgroup()
+    if parent is None:
+        print("✗ cgroup v2 is not mounted")
+        sys.exit(1)
+    if parent.name == LAUNCHER_LEAF:
+        parent = parent.parent
+    names = args.names or sorted(p.name for p in parent.glob("vnc-session-*"))
+    for name in names:
+        session = SessionCgroup(name, parent=parent)
+        session.path = parent / name
+        usage = session.usage()
+        line = f"{name}: cpu {usage['cpu_seconds']:.1f}s, {len(session.pids())} processes"
+        if "memory_bytes" in usage:
+            line += f", memory {usage['memory_bytes'] / (1 << 20):.0f} MiB"
+        if "io_read_bytes" in usage:
+            line += (f", io {usage['io_read_bytes'] / (1 << 20):.0f}/"
+                     f"{usage['io_write_bytes'] / (1 << 20):.0f} MiB read/written")
+        print(line)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Idle-session hibernation
+Freezes the desktop (Firefox, fluxbox, Xvnc) once no viewer has been connected
+for a while and thaws it as soon as a WebSocket connection arrives
+"""
+
+import os
+import sys
+import time
+import ctypes
+import signal
+import argparse
+import threading
+from pathlib import Path
+
+from metrics import SESSION_FROZEN, SESSION_HIBERNATIONS
+
+IDLE_TIMEOUT = 300.0      # seconds without viewers before the session is frozen
+# Clients before the X server, so none of them blocks on a stopped Xvnc
+FREEZE_ORDER = ("firefox", "fluxbox", "xvnc")
+MINIMIZE = ("firefox",)
+
+MADV_PAGEOUT = 21
+PROCESS_MADVISE = 440     # the same syscall number on every architecture
+IOV_MAX = 1024
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("base", ctypes.c_void_p), ("len", ctypes.c_size_t)]
+
+
+def group_pids(pgid):
+    """Every process in a process group (Firefox forks helpers into its own)"""
+    pids = []
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        # fields[2] is the process group (field 5)
+        if int(fields[2]) == pgid:
+            pids.append(int(pid))
+    return pids
+
+
+def page_out(pid):
+    """Ask the kernel to reclaim a process's private memory (MADV_PAGEOUT)
+
+    Anonymous pages go to swap where there is some, clean file pages are
+    dropped; returns the number of bytes advised.
+    """
+    ranges = []
+    with open(f"/proc/{pid}/maps") as f:
+        for line in f:
+            fields = line.split()
+            # Private mappings only; [vvar] and friends cannot be paged
+            if fields[1][3] != "p" or (len(fields) > 5 and fields[5].startswith("[v")):
+                continue
+            start, end = (int(x, 16) for x in fields[0].split("-"))
+            ranges.append((start, end - start))
+    fd = os.pidfd_open(pid)
+    advised = 0
+    try:
+        for i in range(0, len(ranges), IOV_MAX):
+            batch = ranges[i:i + IOV_MAX]
+            iov = (_IOVec * len(batch))(*batch)
+            result = _libc.syscall(PROCESS_MADVISE, fd, iov, len(batch), MADV_PAGEOUT, 0)
+            if result < 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+            advised += result
+    finally:
+        os.close(fd)
+    return advised
+
+
+class SessionHibernator:
+    def __init__(self, services, idle_timeout=IDLE_TIMEOUT, minimize_memory=False, cgroup=None):
+        """Freeze the handles in ``services`` (name -> Popen) while no viewer is connected
+
+        With ``cgroup`` the cgroup v2 freezer of that directory is used instead
+        of SIGSTOP to each service's process group.
+        """
+        self.services = services
+        self.idle_timeout = idle_timeout
+        self.minimize_memory = minimize_memory
+        self.cgroup = Path(cgroup) if cgroup else None
+        self.viewers = 0
+        self.idle_since = time.monotonic()
+        self.frozen = False
+        self.frozen_groups = []
+        self.cond = threading.Condition()
+        self.stopping = False
+        self.thread = None
+
+    def _groups(self):
+        groups = []
+        for name in FREEZE_ORDER:
+            handle = self.services.get(name)
+            if hasattr(handle, "pid") and handle.poll() is None:
+                try:
+                    groups.append((name, os.getpgid(handle.pid)))
+                except ProcessLookupError:
+                    pass
+        return groups
+
+    def _minimize(self):
+        """Page out the memory of the large clients before they are stopped"""
+        for name, pgid in self._groups():
+            if name not in MINIMIZE:
+                continue
+            for pid in group_pids(pgid):
+                try:
+                    page_out(pid)
+                except OSError as e:
+                    print(f"⚠ Could not page out {name} ({pid}): {e}")
+                    return
+
+    def _freeze(self):
+        if self.cgroup:
+            (self.cgroup / "cgroup.freeze").write_text("1")
+        else:
+            self.frozen_groups = self._groups()
+            for _, pgid in self.frozen_groups:
+                try:
+                    os.killpg(pgid, signal.SIGSTOP)
+                except ProcessLookupError:
+                    pass
+        self.frozen = True
+        SESSION_FROZEN.set(1)
+        SESSION_HIBERNATIONS.inc()
+
+    def _thaw(self):
+        if self.cgroup:
+            (self.cgroup / "cgroup.freeze").write_text("0")
+        else:
+            for _, pgid in reversed(self.frozen_groups):
+                try:
+                    os.killpg(pgid, signal.SIGCONT)
+                except ProcessLookupError:
+                    pass
+            self.frozen_groups = []
+        self.frozen = False
+        SESSION_FROZEN.set(0)
+
+    def viewers_changed(self, count):
+        """Proxy hook, called with the open WebSocket count before the backend is dialled"""
+        with self.cond:
+            self.viewers = count
+            if count:
+                self.idle_since = None
+                if self.frozen:
+                    self._thaw()
+                    print("▶ Viewer connected, session resumed")
+            elif self.idle_since is None:
+                self.idle_since = time.monotonic()
+            self.cond.notify()
+
+    def thaw(self):
+        """Resume the session without a viewer (shutdown, profile moves); idling starts over"""
+        with self.cond:
+            if self.frozen:
+                self._thaw()
+            if not self.viewers:
+                self.idle_since = time.monotonic()
+            self.cond.notify()
+
+    def _idle(self):
+        """Wait until the session has been idle long enough; False once stopping"""
+        with self.cond:
+            while not self.stopping:
+                if not self.frozen and not self.viewers and self.idle_since is not None:
+                    remaining = self.idle_since + self.idle_timeout - time.monotonic()
+                    if remaining <= 0:
+                        return True
+                    self.cond.wait(remaining)
+                else:
+                    self.cond.wait()
+            return False
+
+    def _run(self):
+        while self._idle():
+            # Paging out can take a while: do it without blocking a viewer's thaw
+            if self.minimize_memory:
+                self._minimize()
+            with self.cond:
+                if self.stopping or self.viewers or self.frozen:
+                    continue
+                try:
+                    self._freeze()
+                except OSError as e:
+                    print(f"⚠ Could not freeze the idle session: {e}")
+                    self.idle_since = time.monotonic()
+                    continue
+            print(f"⏸ No viewers for {self.idle_timeout:g}s, session frozen")
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="hibernation", daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        """Stop watching and leave the session running"""
+        with self.cond:
+            self.stopping = True
+            if self.frozen:
+                self._thaw()
+            self.cond.notify()
+        if self.thread:
+            self.thread.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Freeze or resume a desktop session by hand")
+    parser.add_argument("action", choices=["freeze", "thaw", "page-out"])
+    parser.add_argument("pids", type=int, nargs="*", help="Process group leaders (SIGSTOP/SIGCONT)")
+    parser.add_argument("--cgroup", default=None, help="cgroup v2 directory to freeze instead")
+    args = parser.parse_args()
+
+    if args.cgroup:
+        if args.action == "page-out":
+            parser.error("page-out takes pids")
+        (Path(args.cgroup) / "cgroup.freeze").write_text("1" if args.action == "freeze" else "0")
+        sys.exit(0)
+    if not args.pids:
+        parser.error("give pids or --cgroup")
+    for pid in args.pids:
+        try:
+            if args.action == "page-out":
+                advised = sum(page_out(p) for p in group_pids(os.getpgid(pid)))
+                print(f"✓ {pid}: {advised / (1024 * 1024):.0f} MiB advised")
+            else:
+                os.killpg(os.getpgid(pid), signal.SIGSTOP if args.action == "freeze" else signal.SIGCONT)
+        except OSError as e:
+            print(f"✗ {pid}: {e}")
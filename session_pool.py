@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Session pool of pre-warmed VNC desktops
+Keeps idle desktops fully started so a new user is attached immediately
+"""
+
+import sys
+import time
+import errno
+import secrets
+import shutil
+import socket
+import argparse
+import threading
+from pathlib import Path
+from urllib.parse import quote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from start_vnc import VNCManager
+from vnc_proxy import VNCProxy
+from readiness import x_socket_path
+from token_routes import TokenRouter, write_routes
+from session_cgroup import add_limit_arguments, limits_from_args
+
+FIRST_DISPLAY = 10
+MAX_DISPLAY = 99
+FIRST_WEBSOCK_PORT = 6100
+
+
+def port_free(port, host=""):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        try:
+            sock.bind((host, port))
+        except OSError as e:
+            if e.errno in (errno.EADDRINUSE, errno.EACCES):
+                return False
+            raise
+    return True
+
+
+def display_free(number):
+    return (not x_socket_path(f":{number}").exists()
+            and not Path(f"/tmp/.X{number}-lock").exists()
+            and port_free(5900 + number))
+
+
+class PooledDesktop:
+    def __init__(self, number, websock_port, profile_root, shared_proxy=None, cgroup_limits=None):
+        self.number = number
+        self.display = f":{number}"
+        self.websock_port = websock_port
+        self.profile_dir = profile_root / f"desktop{number}" / "firefox_profile"
+        self.manager = VNCManager(self.display, websock_port=websock_port,
+                                  profile_dir=self.profile_dir, cgroup_limits=cgroup_limits)
+        self.shared_proxy = shared_proxy
+        self.token = None
+        self.user = None
+        self.attached_at = None
+        self.last_seen = None
+
+    def start(self):
+        if not self.manager.start_desktop():
+            return False
+        if self.shared_proxy is None:
+            self.manager.proxy = VNCProxy(port=self.websock_port, target_port=self.manager.vnc_port,
+                                          web_dir=Path(__file__).resolve().parent)
+            self.manager.proxy.start_in_thread()
+        return True
+
+    def viewers(self):
+        if self.shared_proxy is not None:
+            return self.shared_proxy.viewers(self.token)
+        proxy = self.manager.proxy
+        return proxy.viewers() if proxy else 0
+
+    def usage(self):
+        """The desktop's cgroup usage, None when it runs without one"""
+        cgroup = self.manager.cgroup
+        return cgroup.usage() if cgroup and cgroup.path else None
+
+    def url(self, host="localhost"):
+        if self.shared_proxy is not None:
+            port = self.shared_proxy.port
+            path = quote(f"websockify?token={self.token}", safe="")
+            return f"http://{host}:{port}/vnc.html?autoconnect=1&port={port}&path={path}"
+        return f"http://{host}:{self.websock_port}/vnc.html?autoconnect=1&port={self.websock_port}"
+
+    def stop(self):
+        self.manager.stop_desktop()
+        shutil.rmtree(self.profile_dir.parent, ignore_errors=True)
+
+
+class SessionPool:
+    def __init__(self, idle_target=2, max_desktops=8, reclaim_after=60,
+                 profile_root=None, routes_file=None, proxy_port=6080, cgroup_limits=None):
+        self.idle_target = idle_target
+        self.max_desktops = max_desktops
+        self.reclaim_after = reclaim_after
+        self.profile_root = Path(profile_root or Path.home() / ".vnc_pool")
+        # Per-desktop cgroup v2 limits (see session_cgroup.py)
+        self.cgroup_limits = cgroup_limits
+        self.idle = []
+        self.active = {}
+        self.reserved = set()
+        self.starting = 0
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.running = False
+        # With a routes file every desktop is reached through one public
+        # proxy port and the token in the URL picks the backend
+        self.routes_file = Path(routes_file) if routes_file else None
+        self.routes = {}
+        self.proxy = None
+        if self.routes_file:
+            self.proxy = VNCProxy(port=proxy_port, web_dir=Path(__file__).resolve().parent,
+                                  router=TokenRouter(self.routes_file))
+
+    def _allocate(self):
+        """Reserve a free display number and websocket port (caller holds the lock)"""
+        used_ports = {d.websock_port for d in self.idle} | {d.websock_port for d in self.active.values()}
+        for number in range(FIRST_DISPLAY, MAX_DISPLAY + 1):
+            if number in self.reserved or not display_free(number):
+                continue
+            port = FIRST_WEBSOCK_PORT + number
+            if port in used_ports or not port_free(port):
+                continue
+            self.reserved.add(number)
+            return number, port
+        raise RuntimeError("No free display/port available for a new desktop")
+
+    def _total(self):
+        return len(self.idle) + len(self.active) + self.starting
+
+    def _start_one(self):
+        with self.lock:
+            try:
+                number, port = self._allocate()
+            except RuntimeError as e:
+                print(f"⚠ {e}")
+                self.starting -= 1
+                self.changed.notify_all()
+                return False
+        desktop = PooledDesktop(number, port, self.profile_root, self.proxy, self.cgroup_limits)
+        started = time.perf_counter()
+        try:
+            ok = desktop.start()
+        except Exception as e:
+            print(f"⚠ Desktop {desktop.display} failed to start: {e}")
+            ok = False
+        with self.lock:
+            self.starting -= 1
+            self.reserved.discard(number)
+            if ok:
+                self.idle.append(desktop)
+                print(f"✓ Desktop {desktop.display} ready in {time.perf_counter() - started:.2f}s "
+                      f"({len(self.idle)} idle)")
+            self.changed.notify_all()
+        if not ok:
+            desktop.stop()
+        return ok
+
+    def refill(self):
+        """Start desktops in the background until the idle target is met"""
+        with self.lock:
+            missing = min(self.idle_target - len(self.idle) - self.starting,
+                          self.max_desktops - self._total())
+            self.starting += max(missing, 0)
+        for _ in range(max(missing, 0)):
+            threading.Thread(target=self._start_one, name="pool-refill", daemon=True).start()
+
+    def acquire(self, user=None, timeout=60):
+        """Attach a user to a ready desktop, waiting for a cold start only if none is idle"""
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while not self.idle:
+                if self._total() < self.max_desktops and self.starting == 0:
+                    self.starting += 1
+                    threading.Thread(target=self._start_one, name="pool-cold", daemon=True).start()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (self.starting == 0 and self._total() >= self.max_desktops):
+                    return None
+                self.changed.wait(remaining)
+            desktop = self.idle.pop(0)
+            desktop.user = user
+            desktop.attached_at = desktop.last_seen = time.monotonic()
+            self.active[desktop.number] = desktop
+            if self.proxy is not None:
+                desktop.token = secrets.token_urlsafe(16)
+                self.routes[desktop.token] = ("localhost", desktop.manager.vnc_port)
+                write_routes(self.routes_file, self.routes)
+                # Routable at once, not after the router's next periodic check
+                self.proxy.router.reload()
+        self.refill()
+        return desktop
+
+    def release(self, desktop):
+        """Tear down a used desktop; it is never handed to another user"""
+        with self.lock:
+            self.active.pop(desktop.number, None)
+            if desktop.token in self.routes:
+                del self.routes[desktop.token]
+                write_routes(self.routes_file, self.routes)
+                self.proxy.router.reload()
+        desktop.stop()
+        self.refill()
+
+    def _reaper(self):
+        while self.running:
+            time.sleep(1)
+            now = time.monotonic()
+            expired = []
+            with self.lock:
+                for desktop in self.active.values():
+                    if desktop.viewers():
+                        desktop.last_seen = now
+                    elif now - desktop.last_seen > self.reclaim_after:
+                        expired.append(desktop)
+            for desktop in expired:
+                print(f"♻ Reclaiming {desktop.display} (no viewer for {self.reclaim_after}s)")
+                self.release(desktop)
+
+    def start(self):
+        self.running = True
+        self.profile_root.mkdir(parents=True, exist_ok=True)
+        # Every pooled Xvnc reads ~/.vnc/passwd and xstartup: write them once, up front
+        setup = VNCManager(f":{FIRST_DISPLAY}")
+        setup.setup_vnc_dir()
+        setup.set_vnc_password()
+        if self.proxy is not None:
+            write_routes(self.routes_file, {})
+            self.proxy.start_in_thread()
+        self.refill()
+        threading.Thread(target=self._reaper, name="pool-reaper", daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        with self.lock:
+            desktops = self.idle + list(self.active.values())
+            self.idle, self.active = [], {}
+        for desktop in desktops:
+            desktop.stop()
+        if self.proxy is not None:
+            self.proxy.stop()
+
+    def status(self):
+        with self.lock:
+            desktops = self.idle + list(self.active.values())
+            status = {"idle": len(self.idle), "active": len(self.active), "starting": self.starting}
+        usage = {d.display: d.usage() for d in desktops}
+        usage = {display: value for display, value in usage.items() if value is not None}
+        if usage:
+            status["usage"] = usage
+        return status
+
+
+class PoolHandler(BaseHTTPRequestHandler):
+    pool = None
+
+    def do_GET(self):
+        if self.path.startswith("/new"):
+            desktop = self.pool.acquire(self.client_address[0])
+            if desktop is None:
+                self.send_error(503, "No desktop available")
+                return
+            host = self.headers.get("Host", "localhost").split(":")[0]
+            self.send_response(302)
+            self.send_header("Location", desktop.url(host))
+            self.end_headers()
+        elif self.path.startswith("/status"):
+            body = repr(self.pool.status()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pool of pre-warmed VNC desktops")
+    parser.add_argument("--port", type=int, default=5000, help="Port for /new and /status")
+    parser.add_argument("--idle", type=int, default=2, help="Idle desktops kept ready")
+    parser.add_argument("--max", type=int, default=8, help="Maximum desktops on this host")
+    parser.add_argument("--reclaim-after", type=int, default=60,
+                        help="Seconds without a viewer before a desktop is reclaimed")
+    parser.add_argument("--routes", default=None,
+                        help="Route every desktop through one proxy port using this token file")
+    parser.add_argument("--proxy-port", type=int, default=6080,
+                        help="Public proxy port when --routes is used")
+    add_limit_arguments(parser)
+
+    args = parser.parse_args()
+
+    pool = SessionPool(args.idle, args.max, args.reclaim_after,
+                       routes_file=args.routes, proxy_port=args.proxy_port,
+                       cgroup_limits=limits_from_args(args))
+    pool.start()
+    PoolHandler.pool = pool
+    server = ThreadingHTTPServer(("", args.port), PoolHandler)
+    print(f"✓ Session pool listening on http://localhost:{args.port}/new")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down pool...")
+    finally:
+        pool.stop()
+    sys.exit(0)
@@ -0,0 +1,96 @@
+"""
+Proxy-side RFB session recorder
+Writes relayed frames in the websockify playback format read by
+tests/playback-ui.js; the relay path only queues a copy of each frame,
+base64 encoding and file writes happen on a background thread
+"""
+
+import time
+import base64
+import queue
+import threading
+from pathlib import Path
+
+RECORDINGS_DIR = Path(__file__).resolve().parent / "recordings"
+MAX_PENDING = 64 * 1024 * 1024   # queued bytes before frames are dropped
+BATCH = 256                       # frames encoded per write() call
+
+
+class SessionRecorder:
+    """Record one WebSocket session to ``<path>``
+
+    Server frames are written as ``'{<ms>{<base64>',`` and client frames as
+    ``'}<ms>{<base64>',``; the playback harness skips the latter.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.started = time.monotonic()
+        self.frames = queue.SimpleQueue()
+        # Queued bytes: added on the event loop, subtracted by the writer thread
+        self.pending = 0
+        self.pending_lock = threading.Lock()
+        self.dropped = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._writer, name="rfb-recorder", daemon=True)
+        self.thread.start()
+
+    def _put(self, prefix, data):
+        if self.closed:
+            return
+        with self.pending_lock:
+            if self.pending > MAX_PENDING:
+                # The disk is not keeping up; never let recording slow the session
+                self.dropped += 1
+                return
+            self.pending += len(data)
+        ms = int((time.monotonic() - self.started) * 1000)
+        self.frames.put((prefix, ms, bytes(data)))
+
+    def server(self, data):
+        """Queue data relayed from the VNC server to the browser"""
+        self._put("{", data)
+
+    def client(self, data):
+        """Queue data relayed from the browser to the VNC server"""
+        self._put("}", data)
+
+    def close(self):
+        """Finish the file once every queued frame is written"""
+        if not self.closed:
+            self.closed = True
+            self.frames.put(None)
+
+    def _writer(self):
+        with open(self.path, "w") as f:
+            f.write("var VNC_frame_data = [\n")
+            done = False
+            while not done:
+                batch = [self.frames.get()]
+                while len(batch) < BATCH:
+                    try:
+                        batch.append(self.frames.get_nowait())
+                    except queue.Empty:
+                        break
+                lines = []
+                written = 0
+                for item in batch:
+                    if item is None:
+                        done = True
+                        break
+                    prefix, ms, data = item
+                    written += len(data)
+                    lines.append(f"'{prefix}{ms}{{{base64.b64encode(data).decode('ascii')}',\n")
+                f.write("".join(lines))
+                with self.pending_lock:
+                    self.pending -= written
+            f.write("'EOF'];\n")
+        if self.dropped:
+            print(f"⚠ Recording {self.path.name} dropped {self.dropped} frames")
+
+
+def recording_path(directory, label):
+    """Unique recording file name for a new session"""
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return Path(directory) / f"{label}-{stamp}-{time.monotonic_ns() % 1000000:06d}.js"
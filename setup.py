@@ -6,22 +6,60 @@ Setup script for VNC Desktop Remote Access
 
 import os
 import sys
+import argparse
 import subprocess
 import shutil
+import importlib.util
 from pathlib import Path
 
+from setup_state import SetupState
+
+ROOT = Path(__file__).resolve().parent
+DESKTOP_SCRIPT = ROOT / "desktop_setup.sh"
+# Files desktop_setup.sh generates; the step reruns if one goes missing
+DESKTOP_OUTPUTS = [
+    Path.home() / "Desktop" / "Firefox.desktop",
+    Path.home() / "Desktop" / "Terminal.desktop",
+    Path.home() / ".fluxbox" / "startup",
+    Path.home() / ".fluxbox" / "menu",
+]
+EXECUTABLE_FILES = [
+    "start_vnc.py",
+    "setup.py",
+    "firefox_backup.sh",
+    "firefox_restore.sh",
+    "desktop_setup.sh"
+]
+
 def check_command(cmd):
     """Check if command is available"""
     return shutil.which(cmd) is not None
 
-def install_dependencies():
-    """Install required system dependencies"""
+def websockify_module():
+    """Where websockify is installed for this interpreter, or None"""
+    spec = importlib.util.find_spec("websockify")
+    return Path(spec.origin) if spec and spec.origin else None
+
+def install_websockify():
+    """pip install websockify, needed only for the external proxy mode"""
+    if websockify_module() is not None:
+        return True
     print("🔧 تثبيت المتطلبات...")
-    
-    # Check if dependencies are already installed
+    try:
+        subprocess.run([sys.executable, "-m", "pip", "install", "websockify"],
+                      check=True, capture_output=True)
+        print("✅ تم تثبيت websockify")
+    except subprocess.CalledProcessError:
+        # Not fatal: the built-in proxy does not need it. Recorded, so pip is
+        # only retried when the interpreter or the installed module changes
+        print("⚠️  فشل في تثبيت websockify")
+    return True
+
+def check_commands():
+    """Check that the desktop's programs are on PATH"""
     required_commands = ['firefox-esr', 'Xvnc', 'python3']
     missing_commands = [cmd for cmd in required_commands if not check_command(cmd)]
-    
+
     if missing_commands:
         print(f"⚠️  المتطلبات المفقودة: {', '.join(missing_commands)}")
         print("📋 يرجى تثبيت المتطلبات التالية:")
@@ -30,70 +68,80 @@ def install_dependencies():
         print("- Fluxbox Window Manager")
         print("- Python 3 + websockify")
         return False
-    
-    # Install Python dependencies
-    try:
-        subprocess.run([sys.executable, "-m", "pip", "install", "websockify"], 
-                      check=True, capture_output=True)
-        print("✅ تم تثبيت websockify")
-    except subprocess.CalledProcessError:
-        print("⚠️  فشل في تثبيت websockify")
+    return True
+
+def install_dependencies(state):
+    """Install required system dependencies"""
+    # Checked again only when PATH changes
+    if state.run("commands", check_commands, [os.environ.get("PATH", "")]) is False:
         return False
-    
+
+    state.run("websockify", install_websockify, [sys.executable, websockify_module])
     return True
 
 def setup_directories():
     """Create necessary directories"""
-    print("📁 إنشاء المجلدات...")
-    
     directories = [
         Path.home() / ".vnc",
-        Path.home() / "firefox_profile", 
+        Path.home() / "firefox_profile",
         Path.home() / "firefox_backups"
     ]
-    
+
     for directory in directories:
-        directory.mkdir(exist_ok=True)
-        print(f"✅ {directory}")
+        if not directory.is_dir():
+            directory.mkdir(parents=True, exist_ok=True)
+            print(f"✅ {directory}")
 
 def setup_permissions():
     """Set up file permissions"""
-    print("🔐 إعداد الصلاحيات...")
-    
-    executable_files = [
-        "start_vnc.py",
-        "setup.py",
-        "firefox_backup.sh",
-        "firefox_restore.sh",
-        "desktop_setup.sh"
-    ]
-    
-    for file in executable_files:
-        if Path(file).exists():
-            Path(file).chmod(0o755)
-            print(f"✅ {file}")
+    for file in EXECUTABLE_FILES:
+        path = ROOT / file
+        if path.exists() and (path.stat().st_mode & 0o777) != 0o755:
+            path.chmod(0o755)
+            print(f"🔐 {file}")
+
+def setup_desktop():
+    """Run desktop_setup.sh (fluxbox menu, desktop entries)"""
+    result = subprocess.run([str(DESKTOP_SCRIPT)], capture_output=True)
+    if result.returncode != 0:
+        print("⚠️  فشل في إعداد بيئة سطح المكتب")
+        return False
+    print("✅ تم إعداد بيئة سطح المكتب")
+    return True
+
+def ensure_setup(state=None):
+    """Bring the installation up to date, redoing only steps whose inputs changed
+
+    Runs in the caller's process; a warm launch costs a few stat() calls.
+    """
+    state = state or SetupState()
+    if not install_dependencies(state):
+        print("❌ فشل في تثبيت المتطلبات")
+        return False
+
+    setup_directories()
+    setup_permissions()
+
+    if DESKTOP_SCRIPT.exists():
+        state.run("desktop", setup_desktop, [DESKTOP_SCRIPT, *DESKTOP_OUTPUTS])
+    return True
 
 def main():
     """Main setup function"""
+    parser = argparse.ArgumentParser(description="Set up VNC Desktop Remote Access")
+    parser.add_argument("--force", action="store_true",
+                        help="Ignore the setup cache and redo every step")
+    args = parser.parse_args()
+
     print("🚀 بدء إعداد مشروع سطح المكتب البعيد...")
     print("=" * 50)
-    
-    # Install dependencies
-    if not install_dependencies():
-        print("❌ فشل في تثبيت المتطلبات")
+
+    state = SetupState()
+    if args.force:
+        state.forget()
+    if not ensure_setup(state):
         sys.exit(1)
-    
-    # Setup directories
-    setup_directories()
-    
-    # Setup permissions
-    setup_permissions()
-    
-    # Run desktop setup
-    if Path("desktop_setup.sh").exists():
-        subprocess.run(["./desktop_setup.sh"], capture_output=True)
-        print("✅ تم إعداد بيئة سطح المكتب")
-    
+
     print("\n" + "=" * 50)
     print("🎉 تم الإعداد بنجاح!")
     print("=" * 50)
@@ -103,4 +151,4 @@ def main():
     print("=" * 50)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
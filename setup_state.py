@@ -0,0 +1,103 @@
+"""
+Fingerprint cache for setup steps
+Remembers the inputs and outputs each setup step last ran with, so a warm
+launch skips the steps whose fingerprint has not changed
+"""
+
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+
+STATE_FILE = Path.home() / ".vnc" / "setup_state.json"
+
+
+def file_signature(path):
+    """Size, mtime and mode of a file: changes whenever it is rewritten or chmodded"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return "missing"
+    return f"{st.st_size}:{st.st_mtime_ns}:{st.st_mode:o}"
+
+
+def write_if_changed(path, content, mode=None):
+    """Write a generated file only when its content differs; True if it was written"""
+    path = Path(path)
+    data = content.encode() if isinstance(content, str) else content
+    try:
+        unchanged = path.read_bytes() == data
+    except OSError:
+        unchanged = False
+    if not unchanged:
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+    if mode is not None and (path.stat().st_mode & 0o7777) != mode:
+        path.chmod(mode)
+    return not unchanged
+
+
+class SetupState:
+    def __init__(self, path=STATE_FILE):
+        """Step fingerprints kept in ``path`` (JSON); a missing or broken file means a cold start"""
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        try:
+            self.steps = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            self.steps = {}
+
+    @staticmethod
+    def fingerprint(inputs):
+        """Hash of the inputs: paths by signature, callables by their result, others by value"""
+        digest = hashlib.sha256()
+        for item in inputs:
+            if callable(item):
+                item = item()
+            if isinstance(item, Path):
+                item = f"{item}={file_signature(item)}"
+            digest.update(repr(item).encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def current(self, step, inputs):
+        with self.lock:
+            recorded = self.steps.get(step)
+        return recorded is not None and recorded == self.fingerprint(inputs)
+
+    def record(self, step, inputs):
+        """Store the fingerprint as it is after the step ran (its outputs included)"""
+        fingerprint = self.fingerprint(inputs)
+        with self.lock:
+            self.steps[step] = fingerprint
+            self._save()
+
+    def forget(self, step=None):
+        """Make one step (or every step) run again on the next launch"""
+        with self.lock:
+            if step is None:
+                self.steps.clear()
+            else:
+                self.steps.pop(step, None)
+            self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self.steps, indent=2, sort_keys=True) + "\n")
+        os.replace(tmp, self.path)
+
+    def run(self, step, func, inputs):
+        """Run func unless the inputs match the last successful run
+
+        Returns None when skipped, True when func ran, False when it returned
+        False (a failure, not recorded, so the next launch tries again).
+        """
+        if self.current(step, inputs):
+            return None
+        if func() is False:
+            return False
+        self.record(step, inputs)
+        return True
@@ -0,0 +1,375 @@
+"""
+Content-addressed snapshot store for the Firefox profile
+Files are split into hashed chunks; each snapshot is a small JSON manifest
+"""
+
+import os
+import bz2
+import json
+import lzma
+import zlib
+import stat
+import fcntl
+import sqlite3
+import hashlib
+import tempfile
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager
+
+from sqlite_backup import (is_database_name, is_sidecar, database_of, wal_signature,
+                           copy_database, discard_sidecars)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 1024 * 1024
+KEEP_SNAPSHOTS = 5
+# Name suffix of the profile checkpointer's snapshots, which have their own retention
+CHECKPOINT_TAG = "checkpoint"
+
+# One tag byte in front of every stored chunk names its codec.  Chunks
+# written before tags existed are bare zlib streams, which start with 0x78.
+CODECS = {"none": 0, "zlib": 1, "lzma": 2, "bz2": 3, "zstd": 4}
+DEFAULT_LEVELS = {"none": 0, "zlib": 6, "lzma": 1, "bz2": 9, "zstd": 3}
+
+
+def available_codecs():
+    return [name for name in CODECS if name != "zstd" or zstandard is not None]
+
+
+def encode_chunk(data, codec="zlib", level=None):
+    """Compress a chunk and prefix its codec tag"""
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    if codec == "none":
+        payload = data
+    elif codec == "zlib":
+        payload = zlib.compress(data, level)
+    elif codec == "lzma":
+        payload = lzma.compress(data, preset=level)
+    elif codec == "bz2":
+        payload = bz2.compress(data, level)
+    elif codec == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd codec requires the zstandard package")
+        payload = zstandard.ZstdCompressor(level=level).compress(data)
+    else:
+        raise ValueError(f"Unknown codec: {codec}")
+    return bytes([CODECS[codec]]) + payload
+
+
+def decode_chunk(blob):
+    tag = blob[0]
+    if tag == 0x78:
+        return zlib.decompress(blob)
+    payload = memoryview(blob)[1:]
+    if tag == CODECS["none"]:
+        return bytes(payload)
+    if tag == CODECS["zlib"]:
+        return zlib.decompress(payload)
+    if tag == CODECS["lzma"]:
+        return lzma.decompress(payload)
+    if tag == CODECS["bz2"]:
+        return bz2.decompress(payload)
+    if tag == CODECS["zstd"] and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise ValueError(f"Unsupported chunk codec tag: {tag}")
+
+
+def snapshot_tag(name):
+    """Tag a snapshot was committed with, "" for a session snapshot"""
+    # firefox_session_<date>_<time>_<microseconds>[_<tag>]
+    parts = name.split("_", 5)
+    return parts[5] if len(parts) > 5 else ""
+
+
+def chunk_hash(data):
+    return hashlib.blake2b(data, digest_size=32).hexdigest()
+
+
+class SnapshotStore:
+    def __init__(self, store_dir=None, chunk_size=CHUNK_SIZE, codec="zlib", level=None):
+        self.store_dir = Path(store_dir or Path.home() / "firefox_backups" / "store")
+        self.chunk_dir = self.store_dir / "chunks"
+        self.snapshot_dir = self.store_dir / "snapshots"
+        self.chunk_size = chunk_size
+        self.codec = codec
+        self.level = level
+        # Called with the byte count of every chunk read (see IOThrottle)
+        self.throttle = None
+
+    @contextmanager
+    def lock(self, exclusive=False):
+        """flock on store_dir/lock: shared while snapshotting, exclusive while collecting
+
+        Keeps gc() from deleting chunks that a snapshot in another thread
+        or process has just written or decided to reuse.
+        """
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.store_dir / "lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _chunk_path(self, digest):
+        return self.chunk_dir / digest[:2] / digest
+
+    def _write_atomic(self, path, data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def put_chunk(self, data):
+        """Store one chunk if it is not already present, return its digest"""
+        digest = chunk_hash(data)
+        path = self._chunk_path(digest)
+        if not path.exists():
+            self._write_atomic(path, encode_chunk(data, self.codec, self.level))
+        return digest
+
+    def get_chunk(self, digest):
+        return decode_chunk(self._chunk_path(digest).read_bytes())
+
+    def list_snapshots(self, tag=None):
+        """Snapshot names, oldest first
+
+        With ``tag`` only snapshots committed with that tag; ``tag=""``
+        lists the untagged (session) snapshots.
+        """
+        if not self.snapshot_dir.exists():
+            return []
+        names = sorted(p.stem for p in self.snapshot_dir.glob("firefox_session_*.json"))
+        if tag is None:
+            return names
+        return [name for name in names if snapshot_tag(name) == tag]
+
+    def latest(self):
+        snapshots = self.list_snapshots()
+        return snapshots[-1] if snapshots else None
+
+    def load_manifest(self, name):
+        return json.loads((self.snapshot_dir / f"{name}.json").read_text())
+
+    def _chunk_file(self, path, throttle=True):
+        chunks = []
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(self.chunk_size)
+                if not data:
+                    break
+                chunks.append(self.put_chunk(data))
+                if throttle and self.throttle:
+                    self.throttle(len(data))
+        return chunks
+
+    def store_file(self, path):
+        """Chunk one file and return its digests
+
+        SQLite databases are chunked from a consistent copy taken through
+        SQLite (see sqlite_backup), never from the live file Firefox is
+        writing; their -wal/-journal contents end up inside that copy.
+        """
+        path = Path(path)
+        if is_database_name(path.name):
+            self.store_dir.mkdir(parents=True, exist_ok=True)
+            with tempfile.TemporaryDirectory(prefix=".sqlite-", dir=self.store_dir) as tmp:
+                copy = Path(tmp) / path.name
+                try:
+                    if copy_database(path, copy, self.throttle):
+                        # The copy was already paced as it was read from the profile
+                        return self._chunk_file(copy, throttle=False)
+                except sqlite3.DatabaseError as e:
+                    print(f"⚠ {path.name}: no consistent copy ({e}), storing the file as is")
+        return self._chunk_file(path)
+
+    def plan(self, source_dir):
+        """Walk source_dir and return (manifest, changed) against the last snapshot
+
+        Unchanged files (same size and mtime, chunks still present) already
+        carry their chunk list; files in ``changed`` still need chunking.
+        """
+        source_dir = Path(source_dir)
+        previous = {}
+        latest = self.latest()
+        if latest:
+            previous = self.load_manifest(latest).get("files", {})
+
+        files, links, dirs, changed = {}, {}, set(), []
+        self._walk(source_dir, Path("."), previous, files, links, dirs, changed)
+        return self._manifest(source_dir, files, links, dirs), changed
+
+    def plan_paths(self, source_dir, paths):
+        """Like plan(), but only re-examine ``paths`` (relative to source_dir)
+
+        Everything else is taken from the last snapshot as is; the
+        checkpointer learns the changed paths from inotify instead of
+        walking the whole profile.
+        """
+        latest = self.latest()
+        if latest is None:
+            return self.plan(source_dir)
+        source_dir = Path(source_dir)
+        # A change to places.sqlite-wal is a change to places.sqlite
+        paths = {database_of(rel) if is_sidecar(rel) else rel for rel in paths}
+        base = self.load_manifest(latest)
+        files, links, dirs = base["files"], base["links"], set(base["dirs"])
+        previous, changed = {}, []
+        for rel in sorted(paths):
+            # Forget what was recorded at or below rel, then look again
+            prefix = rel + "/"
+            for key in [k for k in files if k == rel or k.startswith(prefix)]:
+                previous[key] = files.pop(key)
+            for key in [k for k in links if k == rel or k.startswith(prefix)]:
+                del links[key]
+            dirs -= {k for k in dirs if k == rel or k.startswith(prefix)}
+        for rel in sorted(paths):
+            full = source_dir / rel
+            if full.is_dir() and not full.is_symlink():
+                dirs.add(rel)
+                self._walk(source_dir, Path(rel), previous, files, links, dirs, changed)
+            elif rel not in files:
+                self._plan_file(full, rel, previous, files, links, changed)
+        return self._manifest(source_dir, files, links, dirs), changed
+
+    def _walk(self, source_dir, start, previous, files, links, dirs, changed):
+        for root, dirnames, filenames in os.walk(source_dir / start):
+            rel_root = Path(root).relative_to(source_dir)
+            for name in dirnames:
+                full = Path(root) / name
+                if full.is_symlink():
+                    links[str(rel_root / name)] = os.readlink(full)
+                else:
+                    dirs.add(str(rel_root / name))
+            for name in filenames:
+                self._plan_file(Path(root) / name, str(rel_root / name),
+                                previous, files, links, changed)
+
+    def _plan_file(self, full, rel, previous, files, links, changed):
+        try:
+            st = full.lstat()
+            if stat.S_ISLNK(st.st_mode):
+                links[rel] = os.readlink(full)
+                return
+        except FileNotFoundError:
+            # Firefox removed the file while we were walking
+            return
+        if not stat.S_ISREG(st.st_mode) or is_sidecar(rel):
+            return
+        entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                 "mode": stat.S_IMODE(st.st_mode)}
+        if is_database_name(rel):
+            # Commits in WAL mode change only the -wal file
+            entry["wal"] = wal_signature(full)
+        old = previous.get(rel)
+        if (old and old["size"] == entry["size"]
+                and old["mtime_ns"] == entry["mtime_ns"]
+                and old.get("wal", False) == entry.get("wal", False)
+                and all(self._chunk_path(d).exists() for d in old["chunks"])):
+            entry["chunks"] = old["chunks"]
+        else:
+            changed.append(rel)
+        files[rel] = entry
+
+    def _manifest(self, source_dir, files, links, dirs):
+        return {
+            "created": datetime.now().isoformat(),
+            "source": Path(source_dir).name,
+            "chunk_size": self.chunk_size,
+            "dirs": sorted(dirs),
+            "links": links,
+            "files": files,
+        }
+
+    def commit(self, manifest, tag=""):
+        """Write a completed manifest; chunks must already be stored
+
+        Callers hold lock() from planning on, or the chunks may be gone.
+        """
+        name = f"firefox_session_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+        if tag:
+            name += f"_{tag}"
+        with self.lock():
+            self._write_atomic(self.snapshot_dir / f"{name}.json",
+                               json.dumps(manifest, separators=(",", ":")).encode())
+        return name
+
+    def snapshot(self, source_dir, paths=None, tag=""):
+        """Record source_dir, storing only chunks that changed since the last snapshot
+
+        With ``paths`` only those entries are re-examined (see plan_paths);
+        ``tag`` is passed to commit().
+        """
+        source_dir = Path(source_dir)
+        with self.lock():
+            if paths is None:
+                manifest, changed = self.plan(source_dir)
+            else:
+                manifest, changed = self.plan_paths(source_dir, paths)
+            stats = self.store_changed(source_dir, manifest, changed)
+            return self.commit(manifest, tag), stats
+
+    def store_changed(self, source_dir, manifest, changed):
+        """Chunk the changed entries of a planned manifest in place; returns the stats"""
+        changed_bytes = sum(manifest["files"][rel]["size"] for rel in changed)
+        for rel in changed:
+            try:
+                manifest["files"][rel]["chunks"] = self.store_file(Path(source_dir) / rel)
+            except FileNotFoundError:
+                del manifest["files"][rel]
+        return {"files": len(manifest["files"]), "chunked": len(changed),
+                "reused": len(manifest["files"]) - len(changed), "bytes": changed_bytes}
+
+    def restore(self, name, target_dir):
+        """Rebuild a snapshot into target_dir"""
+        manifest = self.load_manifest(name)
+        target_dir = Path(target_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        for rel in manifest["dirs"]:
+            (target_dir / rel).mkdir(parents=True, exist_ok=True)
+        for rel, entry in manifest["files"].items():
+            path = target_dir / rel
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "wb") as f:
+                for digest in entry["chunks"]:
+                    f.write(self.get_chunk(digest))
+            os.chmod(path, entry["mode"])
+            os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+            if is_database_name(rel):
+                discard_sidecars(path)
+        for rel, link in manifest["links"].items():
+            path = target_dir / rel
+            if path.is_symlink() or path.exists():
+                path.unlink()
+            os.symlink(link, path)
+        return manifest
+
+    def prune(self, keep=KEEP_SNAPSHOTS, tag=""):
+        """Drop all but the newest ``keep`` snapshots with ``tag`` and collect unreferenced chunks
+
+        Snapshots with other tags are left alone: checkpoints do not push
+        session snapshots out, nor the other way round.
+        """
+        names = self.list_snapshots(tag)
+        for name in names[:-keep] if keep else names:
+            (self.snapshot_dir / f"{name}.json").unlink()
+        return self.gc()
+
+    def gc(self):
+        """Delete chunks that no remaining manifest references"""
+        with self.lock(exclusive=True):
+            live = set()
+            for name in self.list_snapshots():
+                for entry in self.load_manifest(name)["files"].values():
+                    live.update(entry["chunks"])
+            removed = 0
+            if self.chunk_dir.exists():
+                for path in self.chunk_dir.glob("*/*"):
+                    # .<digest>.<pid>.tmp: another writer's chunk in progress
+                    if path.name not in live and not path.name.startswith("."):
+                        path.unlink()
+                        removed += 1
+            return removed
+
@@ -0,0 +1,185 @@
+"""
+Consistent copies of live SQLite databases
+Firefox keeps writing places.sqlite, cookies.sqlite and friends while it runs;
+these helpers copy them through SQLite itself instead of as plain files
+"""
+
+import os
+import sqlite3
+from pathlib import Path
+
+from metrics import BACKUP_SQLITE_COPIES
+
+SQLITE_SUFFIXES = (".sqlite", ".db")
+# Written next to a database by SQLite; folded into the database's own copy
+SIDECAR_SUFFIXES = ("-wal", "-shm", "-journal")
+HEADER = b"SQLite format 3\0"
+WAL_VERSION_OFFSET = 18     # file format write version: 2 in WAL mode
+
+BATCH_BYTES = 1024 * 1024   # pages copied per backup step
+BUSY_TIMEOUT = 1.0          # seconds to wait for a lock before copying the files instead
+COPY_ATTEMPTS = 5           # file copies tried before the database is considered busy
+
+ONLINE_COPIES = BACKUP_SQLITE_COPIES.labels("online")
+FILE_COPIES = BACKUP_SQLITE_COPIES.labels("file")
+
+
+def is_database_name(rel):
+    return str(rel).endswith(SQLITE_SUFFIXES)
+
+
+def is_sidecar(rel):
+    rel = str(rel)
+    return any(rel.endswith(suffix + sidecar)
+               for suffix in SQLITE_SUFFIXES for sidecar in SIDECAR_SUFFIXES)
+
+
+def database_of(sidecar):
+    """places.sqlite for places.sqlite-wal"""
+    return sidecar.rsplit("-", 1)[0]
+
+
+def is_database(path):
+    """True if path starts with the SQLite header"""
+    with open(path, "rb") as f:
+        return f.read(len(HEADER)) == HEADER
+
+
+def wal_signature(path):
+    """[size, mtime_ns] of the database's -wal file, or None without one
+
+    In WAL mode commits only touch the -wal file, so the database's own
+    size and mtime stay put until the next checkpoint.
+    """
+    try:
+        st = os.stat(f"{path}-wal")
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def discard_sidecars(path):
+    """Remove a stale -wal/-shm/-journal left next to a restored database"""
+    for sidecar in SIDECAR_SUFFIXES:
+        try:
+            os.unlink(f"{path}{sidecar}")
+        except FileNotFoundError:
+            pass
+
+
+def online_copy(path, dest, throttle=None, batch=BATCH_BYTES):
+    """Copy a live database with the backup API, batch bytes of pages per step
+
+    A read transaction is held for the whole copy so every step reads the
+    same snapshot; Firefox's commits neither tear the copy nor restart it.
+    In WAL mode that transaction does not block the writer, so steps are
+    paced with throttle; a rollback-journal database is copied without
+    pauses, since the shared lock holds Firefox's commits back meanwhile.
+    """
+    source = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True,
+                             timeout=BUSY_TIMEOUT, isolation_level=None)
+    try:
+        source.execute("BEGIN")
+        wal = source.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        page_size = source.execute("PRAGMA page_size").fetchone()[0]
+        pages = max(1, batch // page_size)
+
+        def progress(status, remaining, total):
+            if throttle and wal:
+                throttle(pages * page_size)
+
+        target = sqlite3.connect(dest)
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        finally:
+            target.close()
+    finally:
+        source.close()
+    ONLINE_COPIES.inc()
+
+
+def _signature(names):
+    signature = []
+    for name in names:
+        try:
+            st = os.stat(name)
+            signature.append((st.st_size, st.st_mtime_ns))
+        except FileNotFoundError:
+            signature.append(None)
+    return signature
+
+
+def _copy_file(source, dest, throttle):
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        while True:
+            data = src.read(BATCH_BYTES)
+            if not data:
+                break
+            dst.write(data)
+            if throttle:
+                throttle(len(data))
+
+
+def file_copy(path, dest, throttle=None):
+    """Copy the database with its -wal/-journal as files, then let SQLite recover the copy
+
+    For a database the backup API cannot read, e.g. one Firefox opened with
+    locking_mode=EXCLUSIVE.  Opening the copy replays the WAL or rolls back a
+    hot journal, which leaves a consistent single file at dest.
+
+    In WAL mode the database is copied before its WAL: commits appended to
+    the WAL meanwhile are harmless (recovery drops a torn last frame), only
+    a checkpoint into the database file during its copy forces a retry.  A
+    rollback-journal database is retried if it or its journal changed.
+    """
+    path, dest = Path(path), Path(dest)
+    with open(path, "rb") as f:
+        wal = f.read(WAL_VERSION_OFFSET + 1)[WAL_VERSION_OFFSET:] == b"\2"
+    sidecar = "-wal" if wal else "-journal"
+    watched = [path] if wal else [path, f"{path}{sidecar}"]
+    for attempt in range(COPY_ATTEMPTS):
+        # Retries run unpaced: a shorter copy is less likely to overlap a checkpoint
+        pace = throttle if attempt == 0 else None
+        discard_sidecars(dest)
+        before = _signature(watched)
+        _copy_file(path, dest, pace)
+        try:
+            _copy_file(f"{path}{sidecar}", f"{dest}{sidecar}", pace)
+        except FileNotFoundError:
+            # No WAL or hot journal right now
+            pass
+        if _signature(watched) == before:
+            break
+    else:
+        raise sqlite3.OperationalError(f"{path.name} kept changing while it was copied")
+
+    copy = sqlite3.connect(dest, isolation_level=None)
+    try:
+        copy.execute("PRAGMA journal_mode=DELETE").fetchone()
+        result = copy.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        copy.close()
+    if result != "ok":
+        raise sqlite3.DatabaseError(f"{path.name}: copy failed quick_check: {result}")
+    FILE_COPIES.inc()
+
+
+def copy_database(path, dest, throttle=None):
+    """Write a consistent single-file copy of the database at path to dest
+
+    Returns False when path is not an SQLite database at all, so the
+    caller copies it as a plain file.  Raises sqlite3.DatabaseError when
+    no consistent copy could be made.
+    """
+    if not is_database(path):
+        return False
+    try:
+        online_copy(path, dest, throttle)
+    except sqlite3.OperationalError:
+        # Locked against other connections, or busy past the timeout
+        if os.path.exists(dest):
+            os.unlink(dest)
+        file_copy(path, dest, throttle)
+    return True
+
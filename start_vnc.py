@@ -8,18 +8,80 @@ import os
 import sys
 import subprocess
 import signal
-import time
 import atexit
+import asyncio
+import argparse
 from pathlib import Path
 
+from vnc_proxy import VNCProxy
+from ws_deflate import DeflateSettings
+from proxy_workers import ProxyWorkers
+from rfb_broadcast import BroadcastHub
+from backup_engine import backup_profile
+from profile_restore import LazyProfileRestore
+from profile_checkpoint import ProfileCheckpointer
+from tmpfs_profile import TmpfsProfile
+from session_hibernation import SessionHibernator
+from service_logs import LogPipeline
+from session_cgroup import SessionCgroup, add_limit_arguments, limits_from_args
+from perf_profiles import load_profile
+from setup_state import SetupState, write_if_changed
+from startup_graph import StartupGraph
+from supervisor import Supervisor
+from session_recorder import RECORDINGS_DIR
+from metrics import (MetricsServer, METRICS_PORT, STARTUP_PHASE_SECONDS,
+                     STARTUP_TOTAL_SECONDS, watch_services)
+from readiness import (wait_for_x_socket, wait_for_rfb, wait_for_frames,
+                       wait_for_window_manager, display_number)
+from rfb_client import AuthenticationError
+
 class VNCManager:
-    def __init__(self):
-        self.vnc_display = ":1"
-        self.vnc_port = 5901
-        self.websock_port = 5000
-        self.geometry = "1024x768"
+    def __init__(self, display=":1", vnc_port=None, websock_port=5000, profile_dir=None,
+                 record_dir=None, transcode=False, tmpfs_profile=False, perf_profile=None,
+                 proxy_workers=1, hibernate_after=None, minimize_idle_memory=False,
+                 cgroup_limits=None, log_dir=None, deflate=False, broadcast=False):
+        self.vnc_display = display
+        self.vnc_port = vnc_port or 5900 + display_number(display)
+        self.websock_port = websock_port
+        # Xvnc tuning and the matching noVNC defaults (perf_profiles.json)
+        self.perf = load_profile(perf_profile)
+        self.geometry = self.perf.geometry
         self.vnc_dir = Path.home() / ".vnc"
+        self.vnc_password = "vnc123"
+        # Fingerprints of generated files, so warm starts skip unchanged setup
+        self.setup_state = SetupState(self.vnc_dir / "setup_state.json")
+        self.profile_dir = Path(profile_dir or Path.home() / "firefox_profile")
         self.processes = []
+        self.proxy = None
+        self.profile_restore = None
+        self.phase_times = {}
+        self.services = {}
+        self.supervisor = None
+        self.checkpointer = None
+        self.metrics_port = METRICS_PORT
+        self.metrics_server = None
+        # Record sessions for tests/vnc_playback.html (see playback_benchmark.py)
+        self.record_dir = record_dir
+        # Re-encode Raw updates as Tight in the proxy for thin links
+        self.transcode = transcode or self.perf.transcode
+        # permessage-deflate to the browser (Raw, Hextile, clipboard shrink a lot)
+        self.deflate = DeflateSettings() if deflate or self.perf.deflate else None
+        # More than one: proxy processes sharing the port with SO_REUSEPORT
+        self.proxy_workers = proxy_workers
+        # View-only viewers share one Xvnc connection (one per proxy worker)
+        self.broadcast = broadcast
+        # Run Firefox from a RAM copy of the profile, written back periodically
+        self.tmpfs = TmpfsProfile(self.profile_dir, on_fallback=self.leave_tmpfs) if tmpfs_profile else None
+        # Freeze the desktop after this many seconds without a viewer
+        self.hibernate_after = hibernate_after
+        self.minimize_idle_memory = minimize_idle_memory
+        self.hibernator = None
+        # Drains every child's stdout/stderr into ring buffers (and log files in log_dir)
+        self.logs = LogPipeline(log_dir)
+        # Xvnc, fluxbox and Firefox in a cgroup v2 of their own (SessionCgroup limits)
+        self.cgroup = (SessionCgroup(f"vnc-session-{display_number(display)}",
+                                     io_path=self.profile_dir, **cgroup_limits)
+                       if cgroup_limits is not None else None)
         
     def setup_vnc_dir(self):
         """Create and configure VNC directory"""
@@ -33,19 +95,22 @@ unset DBUS_SESSION_BUS_ADDRESS
 exec fluxbox &
 wait
 """
-        xstartup_path.write_text(xstartup_content)
-        xstartup_path.chmod(0o755)
-        
-        print(f"✓ VNC directory configured: {self.vnc_dir}")
+        if write_if_changed(xstartup_path, xstartup_content, 0o755):
+            print(f"✓ VNC directory configured: {self.vnc_dir}")
         
     def set_vnc_password(self):
-        """Set VNC password"""
+        """Set VNC password; vncpasswd only runs when the password, the tool or the file changed"""
+        passwd_file = self.vnc_dir / "passwd"
+        inputs = [self.vnc_password, Path(self.perf.vncpasswd), passwd_file]
+        return self.setup_state.run("vncpasswd", lambda: self.write_vnc_password(passwd_file),
+                                    inputs) is not False
+
+    def write_vnc_password(self, passwd_file):
         try:
             # Create password file using vncpasswd
-            passwd_file = self.vnc_dir / "passwd"
             process = subprocess.run(
-                ["/nix/store/nnkd8d66viqr8xg9vbiyhpjjgk2gzpf3-tigervnc-1.14.0/bin/vncpasswd", str(passwd_file)],
-                input="vnc123\nvnc123\n",
+                [self.perf.vncpasswd, str(passwd_file)],
+                input=f"{self.vnc_password}\n{self.vnc_password}\n",
                 text=True,
                 capture_output=True
             )
@@ -58,6 +123,39 @@ wait
         except Exception as e:
             print(f"⚠ VNC password setup failed: {e}")
             return False
+
+    def create_cgroup(self):
+        """Create the session cgroup before the first service starts"""
+        if not self.cgroup or self.cgroup.path:
+            return True
+        try:
+            self.cgroup.create()
+        except OSError as e:
+            print(f"⚠ Session cgroup unavailable, running without limits: {e}")
+            self.cgroup = None
+            return False
+        print(f"✓ Session cgroup: {self.cgroup.path}")
+        for warning in self.cgroup.warnings:
+            print(f"  ⚠ {warning}")
+        return True
+
+    def capture_output(self, name, process):
+        """Drain a child started with stdout/stderr=PIPE so it never blocks on a full pipe"""
+        if self.logs.thread is None:
+            self.logs.start()
+        return self.logs.attach(name, process)
+
+    def join_session(self, process):
+        """Move a service started with start_new_session=True into the session cgroup
+
+        Done from here right after Popen, not in a preexec_fn: file I/O between
+        fork and exec can deadlock while the startup threads are running.
+        """
+        if self.cgroup and self.cgroup.path:
+            try:
+                self.cgroup.add(process.pid)
+            except OSError as e:
+                print(f"⚠ Could not move pid {process.pid} into the session cgroup: {e}")
             
     def kill_existing_sessions(self):
         """Kill any existing VNC sessions"""
@@ -72,13 +170,12 @@ wait
         """Start VNC server using direct Xvnc"""
         try:
             # Use Xvnc directly to avoid xinit dependency
-            xvnc_path = "/nix/store/nnkd8d66viqr8xg9vbiyhpjjgk2gzpf3-tigervnc-1.14.0/bin/Xvnc"
-            
             cmd = [
-                xvnc_path,
+                self.perf.xvnc,
                 self.vnc_display,
+                "-rfbport", str(self.vnc_port),
                 "-geometry", self.geometry,
-                "-depth", "24",
+                *self.perf.xvnc_args(),
                 "-desktop", "Remote Desktop",
                 "-rfbauth", str(self.vnc_dir / "passwd"),
                 "-SecurityTypes", "VncAuth"
@@ -87,64 +184,89 @@ wait
             # Start Xvnc in background  
             process = subprocess.Popen(
                 cmd,
-                stdout=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                preexec_fn=os.setsid
+                start_new_session=True
             )
+            self.join_session(process)
+            self.capture_output("xvnc", process)
             
             self.processes.append(process)
+            self.services["xvnc"] = process
             
-            # Wait a bit for server to start
-            time.sleep(2)
+            # Ready once the X socket exists and the RFB port sends its banner
+            ready = (wait_for_x_socket(self.vnc_display, 15, process)
+                     and wait_for_rfb("localhost", self.vnc_port, 15, process))
+            if ready:
+                # The banner alone does not prove updates flow: fetch a frame
+                try:
+                    ready = wait_for_frames("localhost", self.vnc_port, self.vnc_password, 15, process)
+                except AuthenticationError as e:
+                    print(f"⚠ Frame probe could not authenticate: {e}")
             
-            if process.poll() is None:
+            if ready:
                 print(f"✓ VNC server started on display {self.vnc_display}")
                 print(f"  Port: {self.vnc_port}")
                 print(f"  Geometry: {self.geometry}")
-                
-                # Start a simple window manager
-                self.start_window_manager()
+                print(f"  Performance profile: {self.perf.name}")
                 return True
             else:
-                stdout, stderr = process.communicate()
-                print(f"✗ VNC server failed to start: {stderr.decode()}")
+                if process.poll() is None:
+                    process.terminate()
+                process.wait()
+                self.logs.wait_closed("xvnc")
+                print("✗ VNC server failed to start:")
+                for line in self.logs.tail("xvnc"):
+                    print(f"  {line}")
                 return False
         except Exception as e:
             print(f"✗ VNC server startup error: {e}")
             return False
             
+    def display_env(self):
+        """Environment for clients of the VNC display"""
+        env = os.environ.copy()
+        env["DISPLAY"] = self.vnc_display
+        return env
+        
     def start_window_manager(self):
-        """Start window manager and Firefox with persistent profile"""
+        """Start window manager and wait until it manages the root window"""
         try:
-            env = os.environ.copy()
-            env["DISPLAY"] = self.vnc_display
-            
             # Start fluxbox window manager
             wm_process = subprocess.Popen(
                 ["fluxbox"],
-                env=env,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                preexec_fn=os.setsid
+                env=self.display_env(),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=True
             )
+            self.join_session(wm_process)
+            self.capture_output("fluxbox", wm_process)
             
             self.processes.append(wm_process)
-            print(f"✓ Window manager started")
-            
-            # Wait for window manager to initialize
-            time.sleep(3)
+            self.services["fluxbox"] = wm_process
             
-            # Start Firefox with persistent profile
-            self.start_firefox_with_profile(env)
+            # Wait for window manager to claim the root window
+            if wait_for_window_manager(self.vnc_display, 10, wm_process):
+                print(f"✓ Window manager started")
+                return True
+            print(f"⚠ Window manager did not become ready")
+            return False
             
         except Exception as e:
             print(f"⚠ Window manager failed to start: {e}")
+            return False
             
-    def start_firefox_with_profile(self, env):
+    def start_firefox_with_profile(self, env=None):
         """Start Firefox with persistent profile for session saving"""
+        env = env or self.display_env()
         try:
-            firefox_profile_dir = Path.home() / "firefox_profile"
-            firefox_profile_dir.mkdir(exist_ok=True)
+            # Swap in the profile staged by restore_firefox_data
+            self.finish_firefox_restore()
+            self.load_tmpfs_profile()
+            
+            firefox_profile_dir = self.firefox_profile_dir()
+            firefox_profile_dir.mkdir(parents=True, exist_ok=True)
             
             # Create Firefox prefs for session saving and stability
             prefs_file = firefox_profile_dir / "user.js"
@@ -216,7 +338,7 @@ user_pref("browser.safebrowsing.enabled", false);
 user_pref("browser.safebrowsing.malware.enabled", false);
 user_pref("network.prefetch-next", false);
 '''
-            prefs_file.write_text(prefs_content)
+            write_if_changed(prefs_file, prefs_content)
             
             # Start Firefox with the persistent profile and stability options
             firefox_process = subprocess.Popen([
@@ -230,10 +352,15 @@ user_pref("network.prefetch-next", false);
                 "--disable-dev-shm-usage",  # Prevent crashes in limited environments
                 "--disable-gpu",  # Disable GPU for VNC stability
                 "--single-process"  # Force single process mode
-            ], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, preexec_fn=os.setsid)
+            ], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+            self.join_session(firefox_process)
+            self.capture_output("firefox", firefox_process)
             
             self.processes.append(firefox_process)
+            self.services["firefox"] = firefox_process
             print(f"✓ Firefox started with persistent profile (stable mode)")
+            if self.tmpfs and self.tmpfs.active:
+                print(f"  Profile held in tmpfs, synced to {self.profile_dir}")
             print(f"  Profile location: {firefox_profile_dir}")
             
             # Remove Firefox monitoring - let it run independently
@@ -241,105 +368,268 @@ user_pref("network.prefetch-next", false);
         except Exception as e:
             print(f"⚠ Firefox startup failed: {e}")
 
-    def start_firefox_monitor(self, env):
-        """Monitor Firefox and restart it if it crashes"""
-        def monitor_firefox():
-            time.sleep(5)  # Initial wait
-            while True:
+    def firefox_profile_dir(self):
+        """The profile Firefox runs from: the tmpfs copy when enabled, else the disk profile"""
+        return self.tmpfs.path if self.tmpfs else self.profile_dir
+
+    def load_tmpfs_profile(self):
+        """Copy the profile into tmpfs before the first Firefox start"""
+        if not self.tmpfs or self.tmpfs.active or self.tmpfs.reason is not None:
+            # After a fallback Firefox stays on disk
+            return
+        try:
+            self.tmpfs.load()
+        except Exception as e:
+            self.tmpfs.reason = str(e)
+        if self.tmpfs.reason:
+            print(f"⚠ tmpfs profile disabled: {self.tmpfs.reason}")
+
+    def leave_tmpfs(self):
+        """Move Firefox back to the disk profile once the tmpfs copy outgrew its cap"""
+        # Held throughout so a supervisor restart waits for the disk profile
+        with self.tmpfs.lock:
+            if self.checkpointer:
+                self.checkpointer.stop()
+                self.checkpointer = None
+            if self.hibernator:
+                self.hibernator.thaw()
+            firefox = self.services.get("firefox")
+            if firefox and firefox.poll() is None:
                 try:
-                    # Check if Firefox is running
-                    result = subprocess.run(
-                        ["pgrep", "-f", "firefox-esr"],
-                        capture_output=True,
-                        text=True
-                    )
-                    
-                    if result.returncode != 0:  # Firefox not running
-                        print("🔄 Firefox crashed, restarting...")
-                        
-                        # Restart Firefox
-                        firefox_profile_dir = Path.home() / "firefox_profile"
-                        firefox_process = subprocess.Popen([
-                            "firefox-esr",
-                            "--profile", str(firefox_profile_dir),
-                            "--new-instance",
-                            "--no-remote",
-                            "--disable-extensions",
-                            "--disable-plugins",
-                            "--no-sandbox",
-                            "--disable-dev-shm-usage",
-                            "--disable-gpu",
-                            "--single-process"
-                        ], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, preexec_fn=os.setsid)
-                        
-                        self.processes.append(firefox_process)
-                        print("✓ Firefox restarted successfully")
-                    
-                    time.sleep(30)  # Check every 30 seconds
-                    
-                except Exception as e:
-                    print(f"⚠ Firefox monitor error: {e}")
-                    time.sleep(10)
-        
-        # Start monitor in background thread
-        import threading
-        monitor_thread = threading.Thread(target=monitor_firefox, daemon=True)
-        monitor_thread.start()
-            
+                    os.killpg(os.getpgid(firefox.pid), signal.SIGTERM)
+                    firefox.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    os.killpg(os.getpgid(firefox.pid), signal.SIGKILL)
+                    firefox.wait()
+                except ProcessLookupError:
+                    pass
+            self.tmpfs.unload()
+            self.start_checkpointer()
+        # The supervisor restarts Firefox, now on the disk profile
+
+    def release_tmpfs_profile(self):
+        """Write the tmpfs profile back to disk once Firefox has exited"""
+        if not self.tmpfs or not self.tmpfs.active:
+            return
+        firefox = self.services.get("firefox")
+        try:
+            if firefox:
+                firefox.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            print("⚠ Firefox is still running, writing back the tmpfs profile anyway")
+        try:
+            self.tmpfs.unload()
+            print(f"✓ tmpfs profile written back to {self.profile_dir}")
+        except Exception as e:
+            print(f"⚠ tmpfs write-back failed, last synced copy kept: {e}")
+
+    def write_client_defaults(self):
+        """Give noVNC the quality and compression levels of the performance profile"""
+        try:
+            if self.perf.write_client_defaults():
+                print(f"✓ noVNC defaults set for the {self.perf.name} profile")
+            return True
+        except (OSError, ValueError) as e:
+            print(f"⚠ Could not write noVNC defaults: {e}")
+            return False
+
     def start_websockify(self):
-        """Start websockify for noVNC"""
+        """Start the in-process WebSocket proxy for noVNC"""
+        if self.proxy_workers > 1:
+            return self.start_proxy_workers()
         try:
-            cmd = [
-                "python3", "-m", "websockify",
-                "--web", ".",
-                str(self.websock_port),
-                f"localhost:{self.vnc_port}"
-            ]
-            
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                preexec_fn=os.setsid
+            self.proxy = VNCProxy(
+                port=self.websock_port,
+                target_port=self.vnc_port,
+                web_dir=Path(__file__).resolve().parent,
+                record_dir=self.record_dir,
+                transcode=self.transcode,
+                deflate=self.deflate,
+                broadcast=self.broadcast_hub()
             )
-            
-            self.processes.append(process)
-            print(f"✓ Websockify started on port {self.websock_port}")
+            self.attach_hibernation()
+            self.proxy.start_in_thread()
+            self.services["proxy"] = self.proxy
+            print(f"✓ WebSocket proxy started on port {self.websock_port}")
             print(f"  Web interface: http://localhost:{self.websock_port}")
-            return process
+            if self.record_dir:
+                print(f"  Recording sessions to {self.record_dir}")
+            if self.transcode:
+                print("  Transcoding Raw updates to Tight")
+            if self.deflate:
+                print("  permessage-deflate offered to browsers")
+            if self.broadcast:
+                print("  Shared view-only session: one Xvnc connection for every viewer")
+            return self.proxy
         except Exception as e:
-            print(f"✗ Websockify startup error: {e}")
+            print(f"✗ WebSocket proxy startup error: {e}")
+            return None
+            
+    def start_proxy_workers(self):
+        """Start the proxy as worker processes; each is supervised on its own"""
+        self.proxy = ProxyWorkers(
+            self.proxy_workers,
+            port=self.websock_port,
+            target_port=self.vnc_port,
+            web_dir=Path(__file__).resolve().parent,
+            record_dir=self.record_dir,
+            transcode=self.transcode,
+            deflate=self.deflate,
+            broadcast=self.broadcast_hub()
+        )
+        self.attach_hibernation()
+        try:
+            self.proxy.start()
+        except OSError as e:
+            print(f"✗ WebSocket proxy startup error: {e}")
+            self.proxy.stop()
+            self.proxy = None
             return None
+        for worker in self.proxy.workers:
+            self.services[f"proxy-{worker.index}"] = worker
+        print(f"✓ WebSocket proxy started on port {self.websock_port} "
+              f"({self.proxy_workers} worker processes)")
+        print(f"  Web interface: http://localhost:{self.websock_port}")
+        return self.proxy
+
+    def broadcast_hub(self):
+        """Shared-session fan-out for the proxy, logging in with the VNC password"""
+        return BroadcastHub(self.vnc_password) if self.broadcast else None
+
+    def restart_proxy_worker(self, index):
+        worker = self.proxy.restart_worker(index)
+        if worker:
+            self.services[f"proxy-{index}"] = worker
+        return worker
+
+    def start_hibernation(self):
+        """Freeze the desktop while nobody is watching it"""
+        if not self.hibernate_after:
+            return True
+        self.hibernator = SessionHibernator(self.services, self.hibernate_after,
+                                            self.minimize_idle_memory,
+                                            self.cgroup.path if self.cgroup else None)
+        self.attach_hibernation()
+        self.hibernator.start()
+        print(f"✓ Session hibernates after {self.hibernate_after:g}s without viewers")
+        return True
+
+    def attach_hibernation(self):
+        """Let the (new) proxy thaw the session when a viewer connects"""
+        if self.hibernator and self.proxy:
+            self.proxy.on_viewers = self.hibernator.viewers_changed
+            self.hibernator.viewers_changed(self.proxy.viewers())
+
+    def start_checkpointer(self):
+        """Checkpoint the profile in the background as Firefox writes it"""
+        try:
+            self.checkpointer = ProfileCheckpointer(self.firefox_profile_dir())
+            self.checkpointer.start()
+            print("✓ Profile checkpointing enabled (inotify)")
+            return True
+        except OSError as e:
+            self.checkpointer = None
+            print(f"⚠ Profile checkpointing unavailable, backing up at shutdown only: {e}")
+            return False
+
+    def start_metrics(self):
+        """Serve Prometheus metrics on localhost"""
+        try:
+            self.metrics_server = MetricsServer(self.metrics_port)
+            self.metrics_server.start_in_thread()
+            watch_services(self.services)
+            print(f"✓ Metrics: http://127.0.0.1:{self.metrics_port}/metrics")
+            return True
+        except OSError as e:
+            print(f"⚠ Metrics endpoint unavailable: {e}")
+            return False
             
     def backup_before_shutdown(self):
         """نسخ احتياطي ذكي قبل الإغلاق"""
+        if self.profile_restore and self.profile_restore.pending():
+            # الاستعادة لم تكتمل بعد، النسخ الآن سيحفظ ملفاً شخصياً فارغاً
+            print("⚠ تم تخطي النسخ الاحتياطي: استعادة الجلسة لم تكتمل")
+            return
+        if self.checkpointer:
+            # Only the changes since the last checkpoint are left to write
+            try:
+                name = self.checkpointer.stop()
+                self.checkpointer = None
+                print(f"✓ تم حفظ آخر التغييرات: {name or 'لا تغييرات'}")
+                return
+            except Exception as e:
+                print(f"⚠ فشل الحفظ التزايدي، نسخ كامل: {e}")
         try:
-            backup_script = Path.home() / "smart_backup.py"
-            if backup_script.exists():
-                result = subprocess.run([
-                    "python3", str(backup_script)
-                ], capture_output=True, text=True)
-                
-                if result.returncode == 0:
-                    print("✓ تم حفظ جلسة Firefox والحسابات بنجاح")
-                else:
-                    print("⚠ فشل في حفظ الجلسة")
+            # Sequential: this runs from atexit, where no new process pool can be started
+            if backup_profile(self.firefox_profile_dir(), workers=1):
+                print("✓ تم حفظ جلسة Firefox والحسابات بنجاح")
+            else:
+                print("⚠ فشل في حفظ الجلسة")
         except Exception as e:
             print(f"⚠ خطأ في حفظ الجلسة: {e}")
 
-    def cleanup_with_backup(self):
-        """تنظيف مع نسخ احتياطي تلقائي"""
-        print("\nبدء الإغلاق الآمن...")
+    def start_desktop(self):
+        """Start Xvnc, fluxbox and Firefox without the proxy or backups"""
+        self.create_cgroup()
+        if not self.start_vnc_server():
+            return False
+        self.start_window_manager()
+        self.start_firefox_with_profile()
+        return True
         
-        # نسخ احتياطي قبل الإغلاق
-        self.backup_before_shutdown()
+    def restart_service(self, name):
+        """Start one supervised service again; returns its handle when it is running"""
+        starters = {
+            "xvnc": self.start_vnc_server,
+            "fluxbox": self.start_window_manager,
+            "firefox": self.start_firefox_with_profile,
+            "proxy": self.start_websockify,
+        }
+        if name.startswith("proxy-"):
+            return self.restart_proxy_worker(int(name.split("-", 1)[1]))
+        starters[name]()
+        handle = self.services.get(name)
+        if hasattr(handle, "poll"):
+            return handle if handle.poll() is None else None
+        return handle if handle and handle.is_running() else None
+        
+    def supervise(self):
+        """Watch Xvnc, fluxbox, Firefox and the proxy until shutdown"""
+        self.supervisor = Supervisor(tail=lambda name: self.logs.tail(name, 5))
+        requires = {"fluxbox": ["xvnc"], "firefox": ["xvnc"]}
+        proxies = [name for name in self.services if name.startswith("proxy-")] or ["proxy"]
+        for name in ("xvnc", "fluxbox", "firefox", *proxies):
+            self.supervisor.add(name, lambda name=name: self.restart_service(name),
+                                self.services.get(name), requires.get(name, ()))
+        asyncio.run(self.supervisor.run())
+        
+    def stop_desktop(self):
+        """Stop the proxy and every process this manager started"""
+        if self.supervisor:
+            self.supervisor.stop()
+        # Stopped processes would not act on SIGTERM
+        if self.hibernator:
+            self.hibernator.stop()
+            self.hibernator = None
+        # إيقاف الوكيل
+        if self.proxy:
+            self.proxy.stop()
+            self.proxy = None
+        if self.metrics_server:
+            self.metrics_server.stop()
+            self.metrics_server = None
         
         # تنظيف العمليات
         for process in self.processes:
+            if process.poll() is not None:
+                continue
             try:
                 os.killpg(os.getpgid(process.pid), signal.SIGTERM)
             except:
                 pass
+        self.processes = []
+        if self.cgroup and not self.cgroup.remove():
+            print(f"⚠ Session processes still running in {self.cgroup.path}")
                 
         # إيقاف خادم VNC
         try:
@@ -347,6 +637,17 @@ user_pref("network.prefetch-next", false);
                          capture_output=True)
         except:
             pass
+        self.logs.stop()
+
+    def cleanup_with_backup(self):
+        """تنظيف مع نسخ احتياطي تلقائي"""
+        print("\nبدء الإغلاق الآمن...")
+        
+        # نسخ احتياطي قبل الإغلاق
+        self.backup_before_shutdown()
+        
+        self.stop_desktop()
+        self.release_tmpfs_profile()
             
         print("✓ تم الإغلاق الآمن مع حفظ البيانات")
 
@@ -355,94 +656,51 @@ user_pref("network.prefetch-next", false);
         self.cleanup_with_backup()
         
     def restore_firefox_data(self):
-        """استعادة جلسة Firefox والحسابات المحفوظة"""
+        """بدء استعادة جلسة Firefox في الخلفية دون تأخير بدء الخدمات"""
         try:
-            backup_dir = Path.home() / "firefox_backups"
-            profile_dir = Path.home() / "firefox_profile"
-            
-            if backup_dir.exists():
-                # البحث عن جلسات Firefox المحفوظة
-                session_backups = list(backup_dir.glob("firefox_session_*.tar.gz"))
-                if session_backups:
-                    latest_session = max(session_backups, key=lambda x: x.stat().st_mtime)
-                    print(f"🔄 استعادة جلسة Firefox المحفوظة: {latest_session.name}")
-                    
-                    # حذف الملف الشخصي القديم إذا كان موجوداً
-                    if profile_dir.exists():
-                        subprocess.run(["rm", "-rf", str(profile_dir)], capture_output=True)
-                    
-                    # استعادة الجلسة المحفوظة
-                    result = subprocess.run(
-                        ["tar", "-xzf", str(latest_session), "-C", str(Path.home())],
-                        capture_output=True
-                    )
-                    
-                    if result.returncode == 0:
-                        print("✓ تم استعادة جلسة Firefox والحسابات المحفوظة بنجاح")
-                        return True
-                    else:
-                        print("⚠ فشل في استعادة الجلسة، سيتم إنشاء ملف تعريف جديد")
-                else:
-                    print("📁 لا توجد جلسات محفوظة، سيتم إنشاء ملف تعريف جديد")
-            else:
-                print("📁 مجلد الجلسات غير موجود، سيتم إنشاء ملف تعريف جديد")
-                
+            self.profile_restore = LazyProfileRestore(self.profile_dir)
+            if self.profile_restore.start():
+                source = self.profile_restore.source
+                print(f"🔄 تجهيز جلسة Firefox المحفوظة في الخلفية: {getattr(source, 'name', source)}")
+                return True
+            print("📁 لا توجد جلسات محفوظة، سيتم إنشاء ملف تعريف جديد")
             return False
                 
         except Exception as e:
             print(f"⚠ خطأ في استعادة الجلسة: {e}")
             return False
 
+    def finish_firefox_restore(self):
+        """تبديل الملف الشخصي المستعاد في مكانه قبل تشغيل Firefox مباشرة"""
+        if not self.profile_restore or self.profile_restore.thread is None:
+            return False
+        try:
+            if self.profile_restore.finish():
+                print("✓ تم استعادة جلسة Firefox والحسابات المحفوظة بنجاح")
+                return True
+            print(f"⚠ فشل في استعادة الجلسة، سيتم إنشاء ملف تعريف جديد: {self.profile_restore.error}")
+        except Exception as e:
+            print(f"⚠ خطأ في استعادة الجلسة: {e}")
+        return False
+
     def setup_smart_backup(self):
         """إعداد نظام نسخ احتياطي ذكي - حفظ فقط عند الإغلاق"""
         try:
             # إنشاء script للنسخ الاحتياطي عند الحاجة فقط
             backup_script = Path.home() / "smart_backup.py"
-            backup_content = '''#!/usr/bin/env python3
-import subprocess
-import os
-from pathlib import Path
-from datetime import datetime
-
-def backup_firefox_on_shutdown():
-    """نسخ احتياطي ذكي عند الإغلاق فقط"""
-    profile_dir = Path.home() / "firefox_profile"
-    backup_dir = Path.home() / "firefox_backups"
-    
-    if not profile_dir.exists():
-        return False
-        
-    backup_dir.mkdir(exist_ok=True)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_file = backup_dir / f"firefox_session_{timestamp}.tar.gz"
-    
-    try:
-        # نسخ احتياطي للملف الشخصي بالكامل
-        subprocess.run([
-            "tar", "-czf", str(backup_file),
-            "-C", str(Path.home()),
-            "firefox_profile"
-        ], capture_output=True, check=True)
-        
-        # الاحتفاظ بآخر 5 نسخ احتياطية فقط
-        backups = sorted(backup_dir.glob("firefox_session_*.tar.gz"), 
-                        key=lambda x: x.stat().st_mtime, reverse=True)
-        for old_backup in backups[5:]:
-            old_backup.unlink()
-            
-        print(f"✓ تم حفظ جلسة Firefox: {backup_file.name}")
-        return True
-            
-    except Exception as e:
-        print(f"⚠ خطأ في النسخ الاحتياطي: {e}")
-        return False
+            backup_content = f'''#!/usr/bin/env python3
+import sys
+
+sys.path.insert(0, {str(Path(__file__).resolve().parent)!r})
+
+from backup_engine import backup_profile
 
 if __name__ == "__main__":
-    backup_firefox_on_shutdown()
+    # نسخ احتياطي تزايدي: تُحفظ الأجزاء المتغيرة فقط
+    sys.exit(0 if backup_profile() else 1)
 '''
-            backup_script.write_text(backup_content)
-            backup_script.chmod(0o755)
-            print("✓ تم إعداد نظام النسخ الاحتياطي الذكي")
+            if write_if_changed(backup_script, backup_content, 0o755):
+                print("✓ تم إعداد نظام النسخ الاحتياطي الذكي")
             
         except Exception as e:
             print(f"⚠ فشل في إعداد النسخ الاحتياطي الذكي: {e}")
@@ -457,25 +715,36 @@ if __name__ == "__main__":
         signal.signal(signal.SIGINT, lambda s, f: sys.exit(0))
         signal.signal(signal.SIGTERM, lambda s, f: sys.exit(0))
         
+        # Startup runs as a dependency graph: independent steps in parallel,
+        # each service gated on a real readiness probe
+        graph = StartupGraph()
         # استعادة بيانات فايرفوكس تلقائياً
-        self.restore_firefox_data()
-        
-        # Setup steps
-        self.setup_vnc_dir()
-        self.set_vnc_password()
-        self.kill_existing_sessions()
+        graph.add("restore", lambda: self.restore_firefox_data() or None, critical=False)
+        graph.add("vnc_dir", self.setup_vnc_dir)
+        graph.add("password", self.set_vnc_password, ["vnc_dir"], critical=False)
+        graph.add("kill", self.kill_existing_sessions, critical=False)
+        graph.add("cgroup", self.create_cgroup, critical=False)
+        graph.add("xvnc", self.start_vnc_server, ["password", "kill", "cgroup"])
+        graph.add("client_defaults", self.write_client_defaults, critical=False)
+        graph.add("proxy", self.start_websockify, ["client_defaults"])
+        graph.add("fluxbox", self.start_window_manager, ["xvnc"], critical=False)
+        graph.add("firefox", self.start_firefox_with_profile, ["fluxbox", "restore"], critical=False)
+        # Add smart backup on shutdown only
+        graph.add("smart_backup", self.setup_smart_backup, critical=False)
+        # After Firefox: the restored profile has been swapped in by then
+        graph.add("checkpoint", self.start_checkpointer, ["firefox"], critical=False)
+        graph.add("metrics", self.start_metrics, critical=False)
+        graph.add("hibernate", self.start_hibernation, ["proxy", "firefox"], critical=False)
         
-        # Start services
-        if not self.start_vnc_server():
-            return False
-            
-        websockify_process = self.start_websockify()
-        if not websockify_process:
+        ok = graph.run()
+        self.phase_times = graph.timings()
+        for phase, (_, duration) in self.phase_times.items():
+            STARTUP_PHASE_SECONDS.labels(phase).set(duration)
+        STARTUP_TOTAL_SECONDS.set(graph.total)
+        graph.report()
+        if not ok:
             return False
             
-        # Add smart backup on shutdown only
-        self.setup_smart_backup()
-            
         print("\n" + "=" * 50)
         print("🎉 VNC Setup Complete!")
         print("=" * 50)
@@ -483,25 +752,59 @@ if __name__ == "__main__":
         print(f"VNC Port: {self.vnc_port}")
         print(f"Web Interface: http://localhost:{self.websock_port}")
         print(f"noVNC URL: http://localhost:{self.websock_port}/vnc.html")
-        print("Password: vnc123")
+        print(f"Password: {self.vnc_password}")
         print("=" * 50)
         
-        # Keep running
+        # Keep running: restart services as soon as they exit
         try:
-            while True:
-                time.sleep(1)
-                # Check if websockify is still running
-                if websockify_process.poll() is not None:
-                    print("Websockify process died, restarting...")
-                    websockify_process = self.start_websockify()
-                    if not websockify_process:
-                        break
+            self.supervise()
         except KeyboardInterrupt:
             print("\nShutting down...")
             
         return True
 
-if __name__ == "__main__":
-    manager = VNCManager()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Start the VNC desktop")
+    parser.add_argument("--record", nargs="?", const=str(RECORDINGS_DIR),
+                        default=os.environ.get("VNC_RECORD_DIR"), metavar="DIR",
+                        help=f"Record sessions as playback files (default dir: {RECORDINGS_DIR})")
+    parser.add_argument("--transcode", action="store_true",
+                        help="Re-encode Raw updates as Tight in the proxy (for slow links)")
+    parser.add_argument("--deflate", action="store_true",
+                        help="Negotiate permessage-deflate with browsers (on in the wan/mobile profiles)")
+    parser.add_argument("--tmpfs-profile", action="store_true",
+                        default=bool(os.environ.get("VNC_TMPFS_PROFILE")),
+                        help="Run the Firefox profile from tmpfs and write it back to disk periodically")
+    parser.add_argument("--perf-profile", default=None, metavar="NAME",
+                        help="Performance profile from perf_profiles.json (default: its \"profile\" "
+                             "setting, or VNC_PERF_PROFILE)")
+    parser.add_argument("--proxy-workers", type=int,
+                        default=int(os.environ.get("VNC_PROXY_WORKERS", "1")), metavar="N",
+                        help="Run the WebSocket proxy as N processes sharing the port (SO_REUSEPORT)")
+    parser.add_argument("--hibernate-after", type=float,
+                        default=float(os.environ.get("VNC_HIBERNATE_AFTER", "0")) or None,
+                        metavar="SECONDS",
+                        help="Freeze Xvnc, fluxbox and Firefox after this long without a viewer")
+    parser.add_argument("--minimize-idle-memory", action="store_true",
+                        help="Page Firefox's memory out before freezing the idle session")
+    parser.add_argument("--broadcast", action="store_true",
+                        default=bool(os.environ.get("VNC_BROADCAST")),
+                        help="Share one Xvnc connection among view-only viewers (presentations)")
+    add_limit_arguments(parser)
+    parser.add_argument("--log-dir", default=os.environ.get("VNC_LOG_DIR"), metavar="DIR",
+                        help="Also write each service's output to rotated DIR/<service>.log files")
+    args = parser.parse_args(argv)
+
+    manager = VNCManager(record_dir=args.record, transcode=args.transcode,
+                         tmpfs_profile=args.tmpfs_profile, perf_profile=args.perf_profile,
+                         proxy_workers=args.proxy_workers, hibernate_after=args.hibernate_after,
+                         minimize_idle_memory=args.minimize_idle_memory,
+                         cgroup_limits=limits_from_args(args), log_dir=args.log_dir,
+                         deflate=args.deflate, broadcast=args.broadcast)
     success = manager.run()
-    sys.exit(0 if success else 1)
\ No newline at end of file
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
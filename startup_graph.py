@@ -0,0 +1,100 @@
+"""
+Dependency-ordered parallel startup
+Steps run on a thread pool as soon as their dependencies succeed;
+every step's wall time is recorded for the startup report
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class StartupStep:
+    def __init__(self, name, func, deps=(), critical=True):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.critical = critical
+        self.status = "pending"
+        self.started = None
+        self.duration = None
+        self.result = None
+        self.error = None
+
+
+class StartupGraph:
+    def __init__(self, max_workers=8):
+        self.steps = {}
+        self.max_workers = max_workers
+        self.started = None
+        self.total = None
+
+    def add(self, name, func, deps=(), critical=True):
+        """Register a step; returning False or raising marks it failed
+
+        Dependents of a failed critical step are skipped; a failed
+        non-critical step still releases its dependents.
+        """
+        for dep in deps:
+            if dep not in self.steps:
+                raise ValueError(f"Step {name} depends on unknown step {dep}")
+        self.steps[name] = StartupStep(name, func, deps, critical)
+        return self
+
+    def _run_step(self, step):
+        step.started = time.perf_counter()
+        try:
+            step.result = step.func()
+            step.status = "ok" if step.result is not False else "failed"
+        except Exception as e:
+            step.error = e
+            step.status = "failed"
+        step.duration = time.perf_counter() - step.started
+        return step
+
+    def run(self):
+        """Run every step; returns False if a critical step failed"""
+        self.started = time.perf_counter()
+        pending = dict(self.steps)
+        running = {}
+        with ThreadPoolExecutor(self.max_workers, thread_name_prefix="startup") as pool:
+            while pending or running:
+                for name, step in list(pending.items()):
+                    deps = [self.steps[dep] for dep in step.deps]
+                    if any(dep.status == "skipped" or (dep.status == "failed" and dep.critical)
+                           for dep in deps):
+                        step.status = "skipped"
+                        del pending[name]
+                    elif all(dep.status in ("ok", "failed") for dep in deps):
+                        step.status = "running"
+                        running[pool.submit(self._run_step, step)] = step
+                        del pending[name]
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+        self.total = time.perf_counter() - self.started
+        return not any(step.critical and step.status != "ok" for step in self.steps.values())
+
+    def timings(self):
+        """Phase name -> (offset from start, duration) in seconds"""
+        return {
+            name: (step.started - self.started, step.duration)
+            for name, step in self.steps.items() if step.duration is not None
+        }
+
+    def report(self):
+        print("⏱ Startup phases:")
+        for name, step in sorted(self.steps.items(),
+                                 key=lambda item: item[1].started or float("inf")):
+            if step.duration is None:
+                print(f"  {name:<16} {step.status}")
+                continue
+            offset = step.started - self.started
+            mark = "✓" if step.status == "ok" else "✗"
+            line = f"  {mark} {name:<14} +{offset:6.3f}s  {step.duration:6.3f}s"
+            if step.error:
+                line += f"  ({step.error})"
+            print(line)
+        if self.total is not None:
+            print(f"  Total: {self.total:.3f}s")
@@ -0,0 +1,165 @@
+"""
+Event-driven process supervisor
+Learns about child exits from pidfds on the asyncio loop (a blocked waiter
+thread where pidfd_open is unavailable) and restarts each service with
+exponential backoff and crash-loop detection
+"""
+
+import os
+import time
+import asyncio
+
+BACKOFF_BASE = 0.05     # first restart delay in seconds
+BACKOFF_MAX = 30.0
+STABLE_AFTER = 10.0     # uptime that resets the backoff
+CRASH_WINDOW = 60.0
+CRASH_LIMIT = 5         # restarts inside CRASH_WINDOW before giving up
+
+
+class Service:
+    def __init__(self, name, start, requires=()):
+        self.name = name
+        self.start = start
+        self.requires = tuple(requires)
+        self.handle = None
+        self.state = "stopped"
+        self.started_at = None
+        self.failures = 0
+        self.restarts = []
+        self.exit_code = None
+
+    def backoff(self):
+        return min(BACKOFF_BASE * (2 ** max(self.failures - 1, 0)), BACKOFF_MAX)
+
+
+class Supervisor:
+    def __init__(self, tail=None):
+        """``tail(name)`` returns a service's last output lines, shown when it exits"""
+        self.services = {}
+        self.tail = tail
+        self.loop = None
+        self.stopping = False
+        self.done = None
+
+    def add(self, name, start, handle=None, requires=()):
+        """Supervise a service
+
+        ``start`` is a blocking callable returning the new handle (a Popen,
+        or an object with ``thread`` and ``on_exit`` such as VNCProxy) or a
+        false value on failure.  ``handle`` adopts an already running
+        instance.  ``requires`` names services that must be running before
+        this one is restarted.
+        """
+        service = Service(name, start, requires)
+        service.handle = handle
+        self.services[name] = service
+        return service
+
+    # watching
+
+    def _watch(self, service):
+        handle = service.handle
+        service.state = "running"
+        service.started_at = time.monotonic()
+        if hasattr(handle, "pid"):
+            self._watch_process(service, handle)
+        else:
+            self._watch_thread(service, handle)
+
+    def _watch_process(self, service, process):
+        try:
+            fd = os.pidfd_open(process.pid)
+        except (AttributeError, OSError):
+            # No pidfd support: a waiter thread blocks in waitpid() instead
+            future = self.loop.run_in_executor(None, process.wait)
+            future.add_done_callback(lambda _: self._exited(service, process))
+            return
+
+        def on_readable():
+            self.loop.remove_reader(fd)
+            os.close(fd)
+            self._exited(service, process)
+
+        self.loop.add_reader(fd, on_readable)
+
+    def _watch_thread(self, service, handle):
+        handle.on_exit = lambda: self.loop.call_soon_threadsafe(self._exited, service, handle)
+        if not handle.thread.is_alive():
+            self._exited(service, handle)
+
+    def _exited(self, service, handle):
+        if handle is not service.handle or service.state != "running":
+            return
+        if hasattr(handle, "wait"):
+            service.exit_code = handle.wait()
+        service.state = "exited"
+        if not self.stopping:
+            if self.tail:
+                for line in self.tail(service.name):
+                    print(f"  {line}")
+            self._schedule_restart(service)
+
+    def _schedule_restart(self, service):
+        uptime = time.monotonic() - (service.started_at or time.monotonic())
+        service.failures = 1 if uptime >= STABLE_AFTER else service.failures + 1
+        now = time.monotonic()
+        service.restarts = [t for t in service.restarts if now - t < CRASH_WINDOW] + [now]
+        if len(service.restarts) > CRASH_LIMIT:
+            service.state = "crashloop"
+            print(f"✗ {service.name} crashed {len(service.restarts)} times in "
+                  f"{CRASH_WINDOW:.0f}s, not restarting")
+            return
+        delay = service.backoff()
+        print(f"🔄 {service.name} exited ({service.exit_code}), restarting in {delay * 1000:.0f} ms")
+        self.loop.call_later(delay, lambda: self.loop.create_task(self._restart(service)))
+
+    async def _restart(self, service):
+        if self.stopping or service.state != "exited":
+            return
+        for name in service.requires:
+            dep = self.services.get(name)
+            if dep is not None and dep.state != "running":
+                # Restarted again when the dependency comes back
+                service.state = "waiting"
+                return
+        service.state = "starting"
+        try:
+            handle = await self.loop.run_in_executor(None, service.start)
+        except Exception as e:
+            print(f"⚠ {service.name} restart failed: {e}")
+            handle = None
+        if not handle:
+            service.started_at = time.monotonic()
+            service.state = "exited"
+            self._schedule_restart(service)
+            return
+        service.handle = handle
+        self._watch(service)
+        print(f"✓ {service.name} restarted")
+        for other in self.services.values():
+            if other.state == "waiting" and service.name in other.requires:
+                other.state = "exited"
+                self.loop.create_task(self._restart(other))
+
+    # lifecycle
+
+    async def run(self):
+        """Watch every service until stop() is called; idle costs no CPU"""
+        self.loop = asyncio.get_running_loop()
+        self.done = asyncio.Event()
+        for service in self.services.values():
+            if service.handle:
+                self._watch(service)
+            else:
+                service.state = "exited"
+                self.loop.create_task(self._restart(service))
+        await self.done.wait()
+
+    def stop(self):
+        self.stopping = True
+        if self.loop and self.done:
+            self.loop.call_soon_threadsafe(self.done.set)
+
+    def status(self):
+        return {name: {"state": s.state, "restarts": len(s.restarts), "exit_code": s.exit_code}
+                for name, s in self.services.items()}
@@ -12,6 +12,18 @@ function message(str) {
     cell.scrollTop = cell.scrollHeight;
 }
 
+// Results are POSTed here as JSON when set (used by playback_benchmark.py)
+const reportUrl = WebUtil.getQueryVar('report', null);
+
+function report(result) {
+    if (!reportUrl) {
+        return;
+    }
+    fetch(reportUrl, { method: 'POST',
+                       headers: { 'Content-Type': 'application/json' },
+                       body: JSON.stringify(result) });
+}
+
 function loadFile() {
     const fname = WebUtil.getQueryVar('data', null);
 
@@ -98,6 +110,10 @@ function enableUI() {
     }
 
     message("Ready");
+
+    if (WebUtil.getQueryVar('autostart', false)) {
+        start();
+    }
 }
 
 class IterationPlayer {
@@ -130,6 +146,7 @@ class IterationPlayer {
     _nextIteration() {
         const player = new RecordingPlayer(this._frames, this._disconnected.bind(this));
         player.onfinish = this._iterationFinish.bind(this);
+        this._player = player;
 
         if (this._state !== 'running') { return; }
 
@@ -157,7 +174,8 @@ class IterationPlayer {
         const evt = new CustomEvent('iterationfinish',
                                     { detail:
                                       { duration: duration,
-                                        number: this._iteration } } );
+                                        number: this._iteration,
+                                        stats: this._player.stats } } );
         this.oniterationfinish(evt);
 
         this._nextIteration();
@@ -194,8 +212,18 @@ function start() {
     }
 
     const player = new IterationPlayer(iterations, frames);
+    const results = [];
     player.oniterationfinish = (evt) => {
-        message(`Iteration ${evt.detail.number} took ${evt.detail.duration}ms`);
+        const stats = evt.detail.stats;
+        const fps = stats.updates * 1000 / Math.max(evt.detail.duration, 1);
+        message(`Iteration ${evt.detail.number} took ${evt.detail.duration}ms ` +
+                `(${stats.updates} updates, ${fps.toFixed(1)} fps)`);
+        for (const [name, enc] of Object.entries(stats.encodings)) {
+            message(`  ${name}: ${enc.rects} rects, ${enc.ms.toFixed(1)}ms decoding`);
+        }
+        results.push({ duration: evt.detail.duration,
+                       updates: stats.updates,
+                       encodings: stats.encodings });
     };
     player.onrfbdisconnected = (evt) => {
         if (!evt.detail.clean) {
@@ -203,11 +231,13 @@ function start() {
 
             document.getElementById('startButton').disabled = false;
             document.getElementById('startButton').value = "Start";
+            report({ error: `disconnected at frame ${evt.detail.frame}`, iterations: results });
         }
     };
     player.onfinish = (evt) => {
         const iterTime = parseInt(evt.detail.duration / evt.detail.iterations, 10);
         message(`${evt.detail.iterations} iterations took ${evt.detail.duration}ms (average ${iterTime}ms / iteration)`);
+        report({ iterations: results });
 
         document.getElementById('startButton').disabled = false;
         document.getElementById('startButton').value = "Start";
@@ -215,4 +245,7 @@ function start() {
     player.start(realtime);
 }
 
-loadFile().then(enableUI).catch(e => message("Error loading recording: " + e));
+loadFile().then(enableUI).catch((e) => {
+    message("Error loading recording: " + e);
+    report({ error: String(e) });
+});
@@ -6,6 +6,7 @@
 
 import RFB from '../core/rfb.js';
 import * as Log from '../core/util/logging.js';
+import { encodingName } from '../core/encodings.js';
 
 // Immediate polyfill
 if (window.setImmediate === undefined) {
@@ -76,6 +77,8 @@ export default class RecordingPlayer {
 
         this._running = false;
 
+        this.stats = { updates: 0, encodings: {} };
+
         this.onfinish = () => {};
     }
 
@@ -88,6 +91,7 @@ export default class RecordingPlayer {
                                    this._handleDisconnect.bind(this));
         this._rfb.addEventListener("credentialsrequired",
                                    this._handleCredentials.bind(this));
+        this._instrument();
 
         // reset the frame index and timer
         this._frameIndex = 0;
@@ -100,6 +104,39 @@ export default class RecordingPlayer {
         this._queueNextPacket();
     }
 
+    // Count completed framebuffer updates and time every decoder call
+    _instrument() {
+        const stats = { updates: 0, encodings: {} };
+        this.stats = stats;
+
+        const rfb = this._rfb;
+        const framebufferUpdate = rfb._framebufferUpdate.bind(rfb);
+        rfb._framebufferUpdate = () => {
+            const done = framebufferUpdate();
+            if (done) {
+                stats.updates++;
+            }
+            return done;
+        };
+
+        for (const [num, decoder] of Object.entries(rfb._decoders)) {
+            const name = encodingName(parseInt(num, 10));
+            const decodeRect = decoder.decodeRect.bind(decoder);
+            decoder.decodeRect = (...args) => {
+                const start = performance.now();
+                const done = decodeRect(...args);
+                if (!(name in stats.encodings)) {
+                    stats.encodings[name] = { rects: 0, ms: 0 };
+                }
+                stats.encodings[name].ms += performance.now() - start;
+                if (done) {
+                    stats.encodings[name].rects++;
+                }
+                return done;
+            };
+        }
+    }
+
     _queueNextPacket() {
         if (!this._running) { return; }
 
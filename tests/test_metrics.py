@@ -0,0 +1,55 @@
+"""
+Prometheus text rendering of counters, gauges and histograms
+"""
+
+from metrics import Counter, Gauge, Histogram, Registry, _format
+
+
+def _samples(registry):
+    return [line for line in registry.render().splitlines() if not line.startswith("#")]
+
+
+def test_values_are_rendered_exactly():
+    assert _format(123456789) == "123456789"
+    assert _format(1073750016.0) == "1073750016"
+    assert _format(0.1) == "0.1"
+    assert _format(12.000001) == "12.000001"
+    assert _format(float("inf")) == "+Inf"
+    assert _format(float("-inf")) == "-Inf"
+    assert _format(float("nan")) == "NaN"
+
+
+def test_counter_and_gauge_samples():
+    registry = Registry()
+    sent = Counter("x_bytes_total", "Bytes", ["direction"], registry=registry)
+    sent.labels("out").inc(123456789)
+    sent.labels("in").inc(2)
+    rss = Gauge("x_rss_bytes", "RSS", registry=registry)
+    rss.set(1073750016)
+
+    assert _samples(registry) == [
+        'x_bytes_total{direction="in"} 2',
+        'x_bytes_total{direction="out"} 123456789',
+        "x_rss_bytes 1073750016",
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = Histogram("x_seconds", "Latency", buckets=(0.1, 1), registry=registry)
+    for value in (0.05, 0.5, 0.5, 7):
+        latency.observe(value)
+
+    assert _samples(registry) == [
+        'x_seconds_bucket{le="0.1"} 1',
+        'x_seconds_bucket{le="1"} 3',
+        'x_seconds_bucket{le="+Inf"} 4',
+        "x_seconds_sum 8.05",
+        "x_seconds_count 4",
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    Gauge("x_info", "Info", ["path"], registry=registry).labels('a"b\\c\nd').set(1)
+    assert _samples(registry) == ['x_info{path="a\\"b\\\\c\\nd"} 1']
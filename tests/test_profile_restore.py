@@ -0,0 +1,29 @@
+"""
+Lazy profile restore when staging fails
+"""
+
+import time
+
+from profile_restore import LazyProfileRestore
+
+
+def test_failed_staging_is_not_left_pending(tmp_path):
+    backups = tmp_path / "firefox_backups"
+    backups.mkdir()
+    (backups / "firefox_session_20260101_000000.tar.gz").write_bytes(b"not a tar archive")
+    restore = LazyProfileRestore(tmp_path / "firefox_profile", backups)
+
+    assert restore.start()
+    restore.thread.join()
+    assert restore.error is not None
+    # Shutdown must still back up the session
+    assert not restore.pending()
+
+    assert restore.finish() is False
+    assert restore.thread is None
+    restore_dir = tmp_path / ".firefox_restore"
+    for _ in range(100):
+        if not restore_dir.exists():
+            break
+        time.sleep(0.01)
+    assert not restore_dir.exists()
@@ -0,0 +1,36 @@
+"""
+Readiness probes give up as soon as the service's process has exited
+"""
+
+import sys
+import time
+import socket
+import subprocess
+
+from readiness import wait_for_x_socket, wait_for_rfb, wait_for_port
+
+
+def _exited():
+    process = subprocess.Popen([sys.executable, "-c", "raise SystemExit(3)"])
+    process.wait()
+    return process
+
+
+def _unused_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_probe_returns_at_once_for_an_exited_process():
+    process = _exited()
+    started = time.monotonic()
+    assert wait_for_x_socket(":987", timeout=5, process=process) is False
+    assert wait_for_rfb("127.0.0.1", _unused_port(), timeout=5, process=process) is False
+    assert time.monotonic() - started < 0.5
+
+
+def test_probe_without_a_process_still_times_out():
+    started = time.monotonic()
+    assert wait_for_port("127.0.0.1", _unused_port(), timeout=0.3) is False
+    assert time.monotonic() - started >= 0.3
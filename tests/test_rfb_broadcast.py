@@ -0,0 +1,69 @@
+"""
+Dirty-region merging and framebuffer updates in the broadcast proxy
+"""
+
+from rfb_broadcast import DirtyRegion, Framebuffer, TILE
+from rfb_client import BYTES_PER_PIXEL
+
+
+def test_take_returns_tiles_and_clears():
+    region = DirtyRegion(200, 150)
+    assert not region
+    assert region.take() == []
+
+    region.add(10, 10, 5, 5)
+    region.add(500, 10, 5, 5)     # off screen
+    region.add(10, 10, 0, 5)      # empty
+    assert region
+    assert region.take() == [(0, 0, TILE, TILE)]
+    assert not region
+    assert region.take() == []
+
+
+def test_take_joins_equal_runs_on_adjacent_rows():
+    region = DirtyRegion(200, 150)
+    region.add(0, 0, 130, 100)
+    assert region.take() == [(0, 0, 3 * TILE, 2 * TILE)]
+
+    region.add(0, 0, 10, 10)
+    region.add(TILE, TILE, 10, 10)
+    assert region.take() == [(0, 0, TILE, TILE), (TILE, TILE, TILE, TILE)]
+
+
+def test_take_clips_edge_tiles_to_the_screen():
+    region = DirtyRegion(100, 70)
+    region.add_all()
+    assert region.take() == [(0, 0, 100, 70)]
+    region.add(90, 65, 50, 50)
+    assert region.take() == [(TILE, TILE, 100 - TILE, 70 - TILE)]
+
+
+def _pixels(width, height):
+    """A framebuffer whose every pixel holds its own index"""
+    return b"".join(index.to_bytes(BYTES_PER_PIXEL, "little") for index in range(width * height))
+
+
+def _grid(fb):
+    return [[fb.get(x, y, 1, 1) for x in range(fb.width)] for y in range(fb.height)]
+
+
+def test_put_and_get_round_trip():
+    fb = Framebuffer(8, 4)
+    fb.put(0, 0, 8, 4, _pixels(8, 4))
+    assert fb.get(0, 0, 8, 4) == _pixels(8, 4)
+    fb.put(2, 1, 2, 2, b"\xff" * 4 * BYTES_PER_PIXEL)
+    assert fb.get(2, 1, 2, 2) == b"\xff" * 4 * BYTES_PER_PIXEL
+    assert fb.get(1, 1, 1, 1) == (9).to_bytes(BYTES_PER_PIXEL, "little")
+
+
+def test_copy_handles_overlapping_moves():
+    for x, y, source_x, source_y in [(1, 0, 0, 0), (0, 0, 1, 0), (2, 1, 1, 0), (0, 0, 2, 1)]:
+        fb = Framebuffer(8, 4)
+        fb.put(0, 0, 8, 4, _pixels(8, 4))
+        before = _grid(fb)
+        fb.copy(x, y, 5, 3, source_x, source_y)
+        expected = [row[:] for row in before]
+        for dy in range(3):
+            for dx in range(5):
+                expected[y + dy][x + dx] = before[source_y + dy][source_x + dx]
+        assert _grid(fb) == expected
@@ -0,0 +1,58 @@
+"""
+Ring-buffered capture and rotated log files for child output
+"""
+
+import sys
+import subprocess
+
+from service_logs import LogPipeline, RotatingFile, MAX_LINE
+
+
+def _child(code):
+    return subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def test_ring_keeps_the_last_lines_and_files_keep_all(tmp_path):
+    logs = LogPipeline(tmp_path, ring_lines=5).start()
+    try:
+        writer = logs.attach("xvnc", _child("for i in range(10): print(f'line {i}')"))
+        # Last words without a newline, on stderr, with a CRLF line before them
+        logs.attach("firefox", _child("import sys; sys.stderr.write('crash\\r\\nbye')"))
+        assert logs.wait_closed("xvnc", timeout=10)
+        assert logs.wait_closed("firefox", timeout=10)
+        writer.wait()
+
+        tail = logs.tail("xvnc", 20)
+        assert [line.split("] ", 1)[1] for line in tail] == [f"stdout: line {i}" for i in range(5, 10)]
+        assert [line.split("] ", 1)[1] for line in logs.tail("firefox")] == ["stderr: crash", "stderr: bye"]
+        assert [line.split("] ", 1)[1] for line in logs.tail("xvnc", 2)] == ["stdout: line 8", "stdout: line 9"]
+        assert logs.tail("missing") == []
+    finally:
+        logs.stop()
+
+    written = (tmp_path / "xvnc.log").read_text().splitlines()
+    assert [line.split("] ", 1)[1] for line in written] == [f"stdout: line {i}" for i in range(10)]
+
+
+def test_lines_without_newlines_are_cut(tmp_path):
+    logs = LogPipeline().start()
+    try:
+        logs.attach("noisy", _child(f"print('x' * {MAX_LINE * 3})")).wait()
+        assert logs.wait_closed("noisy", timeout=10)
+        lines = [entry[2] for entry in logs.rings["noisy"]]
+        assert all(len(line) <= MAX_LINE for line in lines)
+        assert sum(len(line) for line in lines) <= MAX_LINE * 3
+    finally:
+        logs.stop()
+
+
+def test_rotating_file_keeps_the_newest_files(tmp_path):
+    path = tmp_path / "fluxbox.log"
+    log = RotatingFile(path, max_bytes=10, keep=2)
+    for i in range(5):
+        log.write(b"%d-abcdef\n" % i)
+    log.close()
+    assert path.read_bytes() == b"4-abcdef\n"
+    assert (tmp_path / "fluxbox.log.1").read_bytes() == b"3-abcdef\n"
+    assert (tmp_path / "fluxbox.log.2").read_bytes() == b"2-abcdef\n"
+    assert not (tmp_path / "fluxbox.log.3").exists()
@@ -0,0 +1,50 @@
+"""
+Size parsing and launcher flags for per-session cgroups
+"""
+
+import argparse
+
+import pytest
+
+from session_cgroup import parse_size, limits_from_args, add_limit_arguments
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("1048576", 1048576),
+    (4096, 4096),
+    (" 4k ", 4096),
+    ("512M", 512 << 20),
+    ("512MB", 512 << 20),
+    ("512MiB", 512 << 20),
+    ("2G", 2 << 30),
+    ("1.5g", 3 << 29),
+    ("1T", 1 << 40),
+])
+def test_parse_size(value, expected):
+    assert parse_size(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "M", "lots", "2X"])
+def test_parse_size_rejects_garbage(value):
+    with pytest.raises(ValueError):
+        parse_size(value)
+
+
+def _parse(argv, monkeypatch):
+    monkeypatch.delenv("VNC_CGROUP", raising=False)
+    parser = argparse.ArgumentParser()
+    add_limit_arguments(parser)
+    return limits_from_args(parser.parse_args(argv))
+
+
+def test_no_cgroup_without_flags(monkeypatch):
+    assert _parse([], monkeypatch) is None
+
+
+def test_cgroup_flag_without_limits(monkeypatch):
+    assert _parse(["--cgroup"], monkeypatch) == {}
+
+
+def test_any_limit_implies_a_cgroup(monkeypatch):
+    assert _parse(["--memory-max", "2G", "--cpu-quota", "1.5", "--io-weight", "50"], monkeypatch) == {
+        "memory_max": "2G", "cpu_quota": 1.5, "io_weight": 50}
@@ -0,0 +1,88 @@
+"""
+Viewer counting between the WebSocket proxy and the session hibernator
+"""
+
+import os
+import time
+import base64
+import socket
+import struct
+import threading
+
+from vnc_proxy import VNCProxy, OP_CLOSE
+from session_hibernation import SessionHibernator
+
+
+def _backend():
+    """A TCP listener standing in for Xvnc: accepts and keeps connections open"""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    accepted = []
+
+    def accept():
+        while True:
+            try:
+                accepted.append(server.accept()[0])
+            except OSError:
+                return
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server, accepted
+
+
+def _open_viewer(port):
+    sock = socket.create_connection(("127.0.0.1", port))
+    key = base64.b64encode(os.urandom(16)).decode()
+    sock.sendall((f"GET /websockify HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\n"
+                  f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+                  f"Sec-WebSocket-Version: 13\r\n\r\n").encode())
+    response = b""
+    while b"\r\n\r\n" not in response:
+        response += sock.recv(4096)
+    assert response.startswith(b"HTTP/1.1 101")
+    return sock
+
+
+def _wait(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_closing_the_last_viewer_starts_the_idle_timer():
+    backend, accepted = _backend()
+    hibernator = SessionHibernator({}, idle_timeout=3600)
+    counts = []
+
+    def on_viewers(count):
+        counts.append(count)
+        hibernator.viewers_changed(count)
+
+    proxy = VNCProxy(port=0, host="127.0.0.1", target_port=backend.getsockname()[1], cache_assets=False)
+    proxy.on_viewers = on_viewers
+    proxy.start_in_thread()
+    try:
+        port = proxy.server.sockets[0].getsockname()[1]
+        sock = _open_viewer(port)
+        assert _wait(lambda: accepted)
+        assert counts == [1]
+        assert hibernator.idle_since is None
+
+        # A browser close frame (masked, status 1000)
+        mask = os.urandom(4)
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(struct.pack("!H", 1000)))
+        sock.sendall(bytes([0x80 | OP_CLOSE, 0x80 | 2]) + mask + payload)
+        assert _wait(lambda: counts[-1] == 0)
+        assert _wait(lambda: not proxy.connections)
+        sock.close()
+
+        assert counts == [1, 0]
+        assert hibernator.viewers == 0
+        assert hibernator.idle_since is not None
+    finally:
+        proxy.stop()
+        backend.close()
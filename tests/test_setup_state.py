@@ -0,0 +1,69 @@
+"""
+Skipping setup steps whose fingerprint has not changed
+"""
+
+import os
+
+from setup_state import SetupState, write_if_changed
+
+
+def test_run_skips_until_an_input_changes(tmp_path):
+    state = SetupState(tmp_path / "state.json")
+    output = tmp_path / "passwd"
+    calls = []
+
+    def step():
+        calls.append(1)
+        output.write_text(f"run {len(calls)}")
+
+    inputs = ["secret", output]
+    assert state.run("vncpasswd", step, inputs) is True
+    assert state.run("vncpasswd", step, inputs) is None
+    assert len(calls) == 1
+
+    # A warm launch reads the recorded fingerprints back
+    assert SetupState(tmp_path / "state.json").run("vncpasswd", step, inputs) is None
+
+    assert state.run("vncpasswd", step, ["changed", output]) is True
+    assert len(calls) == 2
+
+    # Outputs are inputs too: a deleted file makes the step run again
+    output.unlink()
+    assert state.run("vncpasswd", step, ["changed", output]) is True
+    assert len(calls) == 3
+
+
+def test_failed_runs_are_not_recorded(tmp_path):
+    state = SetupState(tmp_path / "state.json")
+    results = [False, True]
+    assert state.run("step", lambda: results.pop(0), ["a"]) is False
+    assert state.run("step", lambda: results.pop(0), ["a"]) is True
+    assert state.run("step", lambda: results.pop(0), ["a"]) is None
+
+
+def test_callable_inputs_forget_and_a_broken_file(tmp_path):
+    path = tmp_path / "state.json"
+    version = ["1.0"]
+    state = SetupState(path)
+    assert state.run("firefox", lambda: None, [lambda: version[0]]) is True
+    assert state.run("firefox", lambda: None, [lambda: version[0]]) is None
+    version[0] = "1.1"
+    assert state.run("firefox", lambda: None, [lambda: version[0]]) is True
+
+    state.forget("firefox")
+    assert state.run("firefox", lambda: None, [lambda: version[0]]) is True
+
+    path.write_text("{not json")
+    assert SetupState(path).steps == {}
+
+
+def test_write_if_changed(tmp_path):
+    path = tmp_path / "xstartup"
+    assert write_if_changed(path, "#!/bin/bash\n", 0o755) is True
+    mtime = path.stat().st_mtime_ns
+    assert write_if_changed(path, "#!/bin/bash\n", 0o755) is False
+    assert path.stat().st_mtime_ns == mtime
+    path.chmod(0o644)
+    assert write_if_changed(path, "#!/bin/bash\n", 0o755) is False
+    assert os.stat(path).st_mode & 0o777 == 0o755
+    assert write_if_changed(path, b"#!/bin/sh\n") is True
@@ -0,0 +1,68 @@
+"""
+Planning, committing and collecting in the content-addressed snapshot store
+"""
+
+import os
+
+from snapshot_store import SnapshotStore, CHECKPOINT_TAG, snapshot_tag
+
+
+def _store(tmp_path):
+    source = tmp_path / "profile"
+    (source / "sub").mkdir(parents=True)
+    (source / "prefs.js").write_text("user_pref('a', 1);\n")
+    (source / "sub" / "big.bin").write_bytes(os.urandom(10000))
+    return SnapshotStore(tmp_path / "store", chunk_size=4096), source
+
+
+def test_plan_only_changes_what_differs_from_the_last_snapshot(tmp_path):
+    store, source = _store(tmp_path)
+    manifest, changed = store.plan(source)
+    assert sorted(changed) == ["prefs.js", "sub/big.bin"]
+    stats = store.store_changed(source, manifest, changed)
+    assert stats == {"files": 2, "chunked": 2, "reused": 0, "bytes": 10000 + 19}
+    assert len(manifest["files"]["sub/big.bin"]["chunks"]) == 3
+    first = store.commit(manifest)
+
+    manifest, changed = store.plan(source)
+    assert changed == []
+    assert manifest["files"] == store.load_manifest(first)["files"]
+
+    (source / "prefs.js").write_text("user_pref('a', 2); // longer\n")
+    manifest, changed = store.plan(source)
+    assert changed == ["prefs.js"]
+    assert manifest["files"]["sub/big.bin"]["chunks"] == store.load_manifest(first)["files"]["sub/big.bin"]["chunks"]
+
+
+def test_restore_rebuilds_the_committed_tree(tmp_path):
+    store, source = _store(tmp_path)
+    name, _ = store.snapshot(source)
+    target = tmp_path / "restored"
+    store.restore(name, target)
+    assert (target / "prefs.js").read_bytes() == (source / "prefs.js").read_bytes()
+    assert (target / "sub" / "big.bin").read_bytes() == (source / "sub" / "big.bin").read_bytes()
+
+
+def test_prune_keeps_other_tags_and_gc_collects_unreferenced_chunks(tmp_path):
+    store, source = _store(tmp_path)
+    session, _ = store.snapshot(source)
+    checkpoints = []
+    for i in range(3):
+        (source / "prefs.js").write_text(f"user_pref('a', {i});\n" * (i + 2))
+        checkpoints.append(store.snapshot(source, tag=CHECKPOINT_TAG)[0])
+    assert [snapshot_tag(name) for name in checkpoints] == [CHECKPOINT_TAG] * 3
+    assert store.list_snapshots("") == [session]
+
+    # A chunk still being written by another process survives collection
+    in_progress = store.chunk_dir / "00" / ".00ab.123.tmp"
+    in_progress.parent.mkdir(parents=True, exist_ok=True)
+    in_progress.write_bytes(b"partial")
+
+    removed = store.prune(keep=1, tag=CHECKPOINT_TAG)
+    assert removed == 2
+    assert store.list_snapshots() == [session, checkpoints[-1]]
+    assert in_progress.exists()
+    for name in store.list_snapshots():
+        target = tmp_path / name
+        store.restore(name, target)
+        assert (target / "sub" / "big.bin").exists()
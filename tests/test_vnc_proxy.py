@@ -0,0 +1,49 @@
+"""
+Frame limits in the WebSocket proxy
+"""
+
+import os
+import base64
+import socket
+import struct
+
+from vnc_proxy import VNCProxy, OP_BINARY, OP_CLOSE, MAX_FRAME
+
+
+def _recv_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def test_oversized_frame_is_closed_with_1009():
+    backend = socket.socket()
+    backend.bind(("127.0.0.1", 0))
+    backend.listen()
+    proxy = VNCProxy(port=0, host="127.0.0.1", target_port=backend.getsockname()[1], cache_assets=False)
+    proxy.start_in_thread()
+    try:
+        port = proxy.server.sockets[0].getsockname()[1]
+        sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+        key = base64.b64encode(os.urandom(16)).decode()
+        sock.sendall((f"GET /websockify HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\n"
+                      f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+                      f"Sec-WebSocket-Version: 13\r\n\r\n").encode())
+        response = b""
+        while b"\r\n\r\n" not in response:
+            response += sock.recv(4096)
+        assert response.startswith(b"HTTP/1.1 101")
+
+        # Only the header of a frame announcing more than MAX_FRAME bytes
+        sock.sendall(bytes([0x80 | OP_BINARY, 0x80 | 127]) + struct.pack("!Q", MAX_FRAME + 1)
+                     + os.urandom(4))
+        assert _recv_exactly(sock, 4) == bytes([0x80 | OP_CLOSE, 2]) + struct.pack("!H", 1009)
+        assert _recv_exactly(sock, 1) == b""
+        sock.close()
+    finally:
+        proxy.stop()
+        backend.close()
@@ -0,0 +1,79 @@
+"""
+permessage-deflate negotiation and message round trips
+"""
+
+import os
+import zlib
+
+import pytest
+
+from ws_deflate import DeflateSettings, DeflateError, TAIL, MAX_MESSAGE
+
+
+def _browser_deflate(messages, window_bits=15):
+    """Compress like a browser with context takeover: one sync-flushed block per message"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -window_bits)
+    for message in messages:
+        data = compressor.compress(message) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        assert data.endswith(TAIL)
+        yield data[:-4]
+
+
+def test_negotiate_picks_the_first_acceptable_offer():
+    settings = DeflateSettings()
+    assert settings.negotiate(None) is None
+    assert settings.negotiate("x-webkit-deflate-frame") is None
+    assert settings.negotiate("permessage-deflate; client_max_window_bits").response() == "permessage-deflate"
+
+    # zlib cannot deflate with 8 bits: the next offer is taken instead
+    deflate = settings.negotiate("permessage-deflate; server_max_window_bits=8, "
+                                 "permessage-deflate; server_max_window_bits=10; server_no_context_takeover")
+    assert deflate.window_bits == 10
+    assert not deflate.server_takeover
+    assert deflate.response() == "permessage-deflate; server_no_context_takeover; server_max_window_bits=10"
+    assert settings.negotiate("permessage-deflate; unknown_param") is None
+
+
+def test_window_bits_are_validated():
+    with pytest.raises(ValueError):
+        DeflateSettings(window_bits=8)
+
+
+@pytest.mark.parametrize("offer", ["permessage-deflate",
+                                   "permessage-deflate; server_no_context_takeover; server_max_window_bits=9"])
+def test_server_messages_inflate_in_the_browser(offer):
+    deflate = DeflateSettings().negotiate(offer)
+    inflater = zlib.decompressobj(-deflate.window_bits)
+    for i in range(3):
+        message = b"framebuffer update %d " % i * 200
+        data, compressed = deflate.compress(message)
+        assert compressed
+        assert len(data) < len(message)
+        assert inflater.decompress(data + TAIL) == message
+
+
+def test_small_and_incompressible_messages_are_sent_as_is():
+    deflate = DeflateSettings().negotiate("permessage-deflate")
+    assert deflate.compress(b"\x00" * 8) == (b"\x00" * 8, False)
+    noise = os.urandom(64 * 1024)
+    assert deflate.compress(noise) == (noise, False)
+    assert deflate.skipped == 8 + len(noise)
+
+
+def test_browser_messages_inflate_across_fragments():
+    deflate = DeflateSettings().negotiate("permessage-deflate")
+    messages = [b"key event %d " % i * 50 for i in range(3)]
+    for message, data in zip(messages, _browser_deflate(messages)):
+        middle = len(data) // 2
+        assert deflate.decompress(data[:middle], False) + deflate.decompress(data[middle:], True) == message
+
+
+def test_corrupt_and_oversized_messages_are_rejected():
+    deflate = DeflateSettings().negotiate("permessage-deflate")
+    with pytest.raises(DeflateError):
+        deflate.decompress(b"\xff\xff\xff\xff", True)
+
+    deflate = DeflateSettings().negotiate("permessage-deflate")
+    bomb = next(_browser_deflate([b"\x00" * (MAX_MESSAGE + 1)]))
+    with pytest.raises(DeflateError, match="too large"):
+        deflate.decompress(bomb, True)
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+RAM-backed Firefox profile with write-back to disk
+Copies the profile to tmpfs before Firefox starts, syncs changed files back
+to the on-disk profile periodically and at shutdown, and recovers from the
+last synced copy after a crash (in the manner of profile-sync-daemon)
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import secrets
+import argparse
+import threading
+from pathlib import Path
+
+from profile_checkpoint import IOThrottle, set_idle_priority
+from sqlite_backup import is_database_name, is_sidecar, copy_database
+from metrics import BACKUP_SECONDS, BACKUP_BYTES, PROFILE_TMPFS_BYTES
+
+RUNTIME_DIR = "/dev/shm"
+MEMORY_CAP = 512 * 1024 * 1024     # larger profiles stay on disk
+HEADROOM = 64 * 1024 * 1024        # tmpfs space left free after the copy
+SYNC_INTERVAL = 300.0              # seconds between write-backs
+WRITE_RATE = 32 * 1024 * 1024      # bytes per second during periodic write-back
+COPY_BUFFER = 1024 * 1024
+TMP_SUFFIX = ".tmpfs-sync"
+# Written into the tmpfs copy by load(); without it there is nothing to write back
+LOAD_MARKER = ".tmpfs-loaded"
+
+
+def tree_size(root):
+    """Bytes held by the regular files under root"""
+    total = 0
+    for directory, _, filenames in os.walk(root):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(directory, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def _database_mtime(path, st):
+    """Newest mtime of a database and its -wal: WAL commits leave the database file alone"""
+    try:
+        return max(st.st_mtime_ns, os.stat(f"{path}-wal").st_mtime_ns)
+    except FileNotFoundError:
+        return st.st_mtime_ns
+
+
+def _copy_file(src, dst, throttle=None):
+    """Copy src over dst through a temporary file; dst is replaced atomically
+
+    SQLite databases are copied through SQLite (see sqlite_backup), so a
+    database Firefox is writing lands on disk whole, its WAL folded in.
+    """
+    tmp = dst.with_name(dst.name + TMP_SUFFIX)
+    mtime_ns = None
+    if is_database_name(src.name):
+        # Taken before the copy, so a commit made meanwhile is synced next time
+        mtime_ns = _database_mtime(src, src.stat())
+        tmp.unlink(missing_ok=True)
+    if mtime_ns is not None and copy_database(src, tmp, throttle):
+        with open(tmp, "rb+") as fout:
+            os.fsync(fout.fileno())
+    else:
+        with open(src, "rb") as fin, open(tmp, "wb") as fout:
+            while True:
+                data = fin.read(COPY_BUFFER)
+                if not data:
+                    break
+                fout.write(data)
+                if throttle:
+                    throttle(len(data))
+            fout.flush()
+            os.fsync(fout.fileno())
+    shutil.copystat(src, tmp)
+    if mtime_ns is not None:
+        os.utime(tmp, ns=(mtime_ns, mtime_ns))
+    os.replace(tmp, dst)
+
+
+def sync_tree(src, dst, throttle=None):
+    """Make dst a copy of src, writing only files whose size or mtime differ
+
+    Databases are compared by mtime only (their copy is rebuilt by SQLite)
+    and their -wal/-shm/-journal files are not copied.  Returns the number
+    of bytes copied.
+    """
+    src, dst = Path(src), Path(dst)
+    dst.mkdir(parents=True, exist_ok=True)
+    copied = 0
+    seen = set()
+    for directory, dirnames, filenames in os.walk(src):
+        rel_dir = Path(directory).relative_to(src)
+        target_dir = dst / rel_dir
+        seen.add(rel_dir)
+        for name in dirnames + filenames:
+            source = Path(directory) / name
+            target = target_dir / name
+            if (rel_dir == Path(".") and name == LOAD_MARKER) or is_sidecar(name):
+                continue
+            seen.add(rel_dir / name)
+            try:
+                st = source.lstat()
+            except FileNotFoundError:
+                # Firefox removed it while we were walking
+                continue
+            try:
+                old = target.lstat()
+            except FileNotFoundError:
+                old = None
+            if source.is_symlink():
+                link = os.readlink(source)
+                if old is None or not target.is_symlink() or os.readlink(target) != link:
+                    _remove(target)
+                    os.symlink(link, target)
+            elif source.is_dir():
+                if old is not None and not target.is_dir():
+                    _remove(target)
+                target.mkdir(exist_ok=True)
+            else:
+                if is_database_name(name):
+                    changed = old is None or old.st_mtime_ns != _database_mtime(source, st)
+                else:
+                    changed = (old is None or old.st_size != st.st_size
+                               or old.st_mtime_ns != st.st_mtime_ns)
+                if not changed:
+                    continue
+                if old is not None and target.is_dir() and not target.is_symlink():
+                    _remove(target)
+                try:
+                    _copy_file(source, target, throttle)
+                except FileNotFoundError:
+                    continue
+                except sqlite3.DatabaseError as e:
+                    # The last copy in dst stays until the next sync
+                    print(f"⚠ {source.name}: no consistent copy ({e}), not synced")
+                    continue
+                copied += st.st_size
+
+    if len(seen) <= 1:
+        # src is missing or empty: an empty profile is never right, so keep dst as it is
+        return copied
+    # Drop what no longer exists in src, deepest paths first
+    for directory, dirnames, filenames in os.walk(dst, topdown=False):
+        rel_dir = Path(directory).relative_to(dst)
+        for name in filenames + dirnames:
+            if rel_dir / name not in seen:
+                _remove(Path(directory) / name)
+    return copied
+
+
+def _remove(path):
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    elif path.exists() or path.is_symlink():
+        path.unlink()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class TmpfsProfile:
+    def __init__(self, profile_dir=None, runtime_dir=None, cap=MEMORY_CAP,
+                 interval=SYNC_INTERVAL, write_rate=WRITE_RATE, on_fallback=None):
+        self.profile_dir = Path(profile_dir or Path.home() / "firefox_profile").resolve()
+        name = self.profile_dir.name
+        self.runtime_root = Path(runtime_dir or os.environ.get("VNC_TMPFS_DIR", RUNTIME_DIR))
+        self.runtime_dir = self.runtime_root / f"{name}-{os.getuid()}"
+        self.state_file = self.profile_dir.parent / f".{name}.tmpfs.json"
+        self.crash_prefix = f".{name}-crashrecovery-"
+        self.cap = cap
+        self.interval = interval
+        self.write_rate = write_rate
+        # Called from the sync thread once the profile outgrew the cap
+        self.on_fallback = on_fallback
+        self.active = False
+        self.reason = None
+        self.size = 0
+        self.lock = threading.RLock()
+        # Serialises write-backs; the periodic one is throttled, so it does not hold lock
+        self.sync_lock = threading.Lock()
+        # Also written to LOAD_MARKER in the tmpfs copy this process loaded
+        self.token = None
+        self.stopping = threading.Event()
+        self.thread = None
+
+    @property
+    def path(self):
+        """Directory Firefox should use right now"""
+        with self.lock:
+            return self.runtime_dir if self.active else self.profile_dir
+
+    def _write_state(self, **fields):
+        state = {"runtime": str(self.runtime_dir), "pid": os.getpid(), **fields}
+        tmp = self.state_file.with_name(self.state_file.name + ".tmp")
+        tmp.write_text(json.dumps(state))
+        os.replace(tmp, self.state_file)
+
+    def recover(self):
+        """After a crash, move the orphaned tmpfs copy aside; returns its new path or None
+
+        The on-disk profile is the last synced copy and is used as is; the
+        tmpfs copy may be newer but was never synced, so it is kept on disk
+        for inspection instead of being trusted.
+        """
+        try:
+            state = json.loads(self.state_file.read_text())
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            state = {}
+        pid = state.get("pid")
+        if pid and pid != os.getpid() and _pid_alive(pid):
+            raise RuntimeError(f"profile is held in tmpfs by running process {pid}")
+        runtime = Path(state.get("runtime") or self.runtime_dir)
+        saved = None
+        if runtime.is_dir():
+            for old in self.profile_dir.parent.glob(f"{self.crash_prefix}*"):
+                shutil.rmtree(old, ignore_errors=True)
+            saved = self.profile_dir.parent / f"{self.crash_prefix}{time.strftime('%Y%m%d_%H%M%S')}"
+            shutil.copytree(runtime, saved, symlinks=True)
+            shutil.rmtree(runtime, ignore_errors=True)
+        self.state_file.unlink(missing_ok=True)
+        return saved
+
+    def load(self):
+        """Copy the profile into tmpfs; returns the directory Firefox should use
+
+        Falls back to the on-disk profile (and records why in ``reason``) when
+        the profile is over the cap or tmpfs lacks space.
+        """
+        with self.lock:
+            if self.active:
+                return self.runtime_dir
+            self.recover()
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+            size = tree_size(self.profile_dir)
+            try:
+                stats = os.statvfs(self.runtime_root)
+            except OSError as e:
+                self.reason = f"{self.runtime_root} unavailable: {e}"
+                return self.profile_dir
+            free = stats.f_bavail * stats.f_frsize
+            if size > self.cap:
+                self.reason = f"profile is {size >> 20} MiB, over the {self.cap >> 20} MiB cap"
+                return self.profile_dir
+            if free < size + HEADROOM:
+                self.reason = f"only {free >> 20} MiB free in {self.runtime_root}"
+                return self.profile_dir
+
+            shutil.rmtree(self.runtime_dir, ignore_errors=True)
+            # Record the copy before making it so a crash mid-copy is cleaned up
+            self._write_state(synced=None)
+            try:
+                sync_tree(self.profile_dir, self.runtime_dir)
+            except OSError as e:
+                shutil.rmtree(self.runtime_dir, ignore_errors=True)
+                self.state_file.unlink(missing_ok=True)
+                self.reason = f"copy to tmpfs failed: {e}"
+                return self.profile_dir
+            self.token = secrets.token_hex(16)
+            (self.runtime_dir / LOAD_MARKER).write_text(self.token)
+            self._write_state(synced=time.time())
+            self.active = True
+            self.reason = None
+            self.size = size
+            PROFILE_TMPFS_BYTES.set(size)
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self._run, name="tmpfs-writeback", daemon=True)
+            self.thread.start()
+            return self.runtime_dir
+
+    def loaded(self):
+        """True while runtime_dir is still the copy load() made"""
+        try:
+            return (self.runtime_dir / LOAD_MARKER).read_text() == self.token
+        except OSError:
+            return False
+
+    def sync(self, throttle=None):
+        """Write changed files back to the on-disk profile; returns bytes written
+
+        Raises RuntimeError instead of writing back a tmpfs copy that was
+        unmounted, cleaned or never finished loading: mirroring it would
+        delete the on-disk profile.
+        """
+        with self.sync_lock:
+            if not self.active:
+                return 0
+            if not self.loaded():
+                raise RuntimeError(f"{self.runtime_dir} is not the loaded profile any more, "
+                                   f"{self.profile_dir} left as is")
+            started = time.perf_counter()
+            copied = sync_tree(self.runtime_dir, self.profile_dir, throttle)
+            self._write_state(synced=time.time())
+            BACKUP_SECONDS.labels("writeback").observe(time.perf_counter() - started)
+            BACKUP_BYTES.labels("writeback").set(copied)
+            return copied
+
+    def _run(self):
+        set_idle_priority()
+        throttle = IOThrottle(self.write_rate) if self.write_rate else None
+        while not self.stopping.wait(self.interval):
+            try:
+                if throttle:
+                    throttle.reset()
+                self.sync(throttle)
+                self.size = tree_size(self.runtime_dir)
+                PROFILE_TMPFS_BYTES.set(self.size)
+            except Exception as e:
+                print(f"⚠ tmpfs profile write-back failed: {e}")
+                continue
+            if self.size > self.cap:
+                self.reason = (f"profile grew to {self.size >> 20} MiB, "
+                               f"over the {self.cap >> 20} MiB cap")
+                print(f"⚠ Moving the Firefox profile back to disk: {self.reason}")
+                if self.on_fallback:
+                    self.on_fallback()
+                else:
+                    self.unload()
+                return
+
+    def unload(self):
+        """Final write-back, then release the tmpfs copy; Firefox must have exited"""
+        self.stopping.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+        with self.lock:
+            if not self.active:
+                return False
+            self.sync()
+            self.active = False
+            shutil.rmtree(self.runtime_dir, ignore_errors=True)
+            self.state_file.unlink(missing_ok=True)
+            PROFILE_TMPFS_BYTES.set(0)
+            return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or recover a tmpfs Firefox profile")
+    parser.add_argument("command", choices=["status", "recover"])
+    parser.add_argument("--profile", default=None, help="On-disk profile directory")
+    parser.add_argument("--runtime", default=None, help=f"tmpfs directory (default: {RUNTIME_DIR})")
+
+    args = parser.parse_args()
+
+    profile = TmpfsProfile(args.profile, args.runtime)
+    if args.command == "status":
+        if profile.state_file.exists():
+            state = json.loads(profile.state_file.read_text())
+            alive = _pid_alive(state["pid"])
+            synced = time.ctime(state["synced"]) if state.get("synced") else "never"
+            print(f"{state['runtime']} held by pid {state['pid']} "
+                  f"({'running' if alive else 'dead'}), last synced {synced}")
+        else:
+            print(f"{profile.profile_dir} is on disk")
+        sys.exit(0)
+    try:
+        saved = profile.recover()
+    except RuntimeError as e:
+        print(f"✗ {e}")
+        sys.exit(1)
+    print(f"✓ Unsynced tmpfs copy saved to {saved}" if saved else "✓ Nothing to recover")
+    sys.exit(0)
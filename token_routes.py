@@ -0,0 +1,89 @@
+"""
+Token routing table for the WebSocket proxy
+Maps the token in a connection URL to a VNC backend; the table is held in a
+dict and swapped whole when the file changes, so lookups stay O(1)
+"""
+
+import os
+import time
+import threading
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+
+
+def parse_routes(text):
+    """Parse websockify-style token lines: ``token: host:port``"""
+    routes = {}
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        token, _, target = line.partition(":")
+        host, _, port = target.strip().rpartition(":")
+        if not token.strip() or not host or not port.isdigit():
+            continue
+        routes[token.strip()] = (host, int(port))
+    return routes
+
+
+def write_routes(path, routes):
+    """Atomically replace the routes file so readers never see a partial table"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text("".join(f"{token}: {host}:{port}\n"
+                           for token, (host, port) in sorted(routes.items())))
+    os.replace(tmp, path)
+
+
+def token_from_request(target):
+    """Token from ``?token=`` or from the last path segment of the request target"""
+    parts = urlsplit(target)
+    tokens = parse_qs(parts.query).get("token")
+    if tokens:
+        return tokens[0]
+    segment = parts.path.rstrip("/").rsplit("/", 1)[-1]
+    return segment if segment and segment != "websockify" else None
+
+
+class TokenRouter:
+    def __init__(self, path, check_interval=1.0):
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self.routes = {}
+        self.signature = None
+        self.checked = 0.0
+        self.lock = threading.Lock()
+        self.reload()
+
+    def _stat_signature(self):
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def reload(self):
+        """Re-read the file if it changed; returns True when the table was replaced"""
+        with self.lock:
+            self.checked = time.monotonic()
+            signature = self._stat_signature()
+            if signature == self.signature:
+                return False
+            try:
+                routes = parse_routes(self.path.read_text()) if signature else {}
+            except FileNotFoundError:
+                routes = {}
+            # Swap the whole dict: open connections already hold their target
+            self.routes = routes
+            self.signature = signature
+            return True
+
+    def lookup(self, token):
+        """Backend (host, port) for a token, or None"""
+        if time.monotonic() - self.checked >= self.check_interval:
+            self.reload()
+        return self.routes.get(token)
+
+    def __len__(self):
+        return len(self.routes)
@@ -0,0 +1,692 @@
+#!/usr/bin/env python3
+"""
+In-process WebSocket to RFB proxy
+Relays noVNC WebSocket traffic to the Xvnc TCP port and serves the web client
+"""
+
+import time
+import struct
+import base64
+import hashlib
+import asyncio
+import argparse
+import threading
+import mimetypes
+from pathlib import Path
+from urllib.parse import urlsplit, unquote, parse_qs
+
+from token_routes import TokenRouter, token_from_request
+from metrics import (PROXY_CONNECTIONS, PROXY_BYTES, PROXY_MESSAGES, PROXY_RELAY_SECONDS,
+                     PROXY_TRANSCODE_BYTES)
+from session_recorder import SessionRecorder, recording_path
+from rfb_transcoder import RFBTranscoder, create_pool
+from asset_cache import AssetCache, IMMUTABLE, REVALIDATE
+from ws_deflate import DeflateError, add_deflate_arguments, deflate_from_args
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+READ_SIZE = 64 * 1024
+HEADER_ROOM = 10          # largest server frame header (no mask)
+MAX_REQUEST = 16 * 1024   # largest HTTP request head we accept
+MAX_FRAME = 16 * 1024 * 1024  # largest client frame payload we buffer
+HIGH_WATER = 256 * 1024   # pause the peer above this many buffered bytes
+LOW_WATER = 64 * 1024
+
+# Metric children resolved once, they are updated on every relayed message
+TO_CLIENT_BYTES = PROXY_BYTES.labels("to_client")
+TO_SERVER_BYTES = PROXY_BYTES.labels("to_server")
+TO_CLIENT_MESSAGES = PROXY_MESSAGES.labels("to_client")
+TO_SERVER_MESSAGES = PROXY_MESSAGES.labels("to_server")
+TO_CLIENT_RELAY = PROXY_RELAY_SECONDS.labels("to_client")
+TO_SERVER_RELAY = PROXY_RELAY_SECONDS.labels("to_server")
+TRANSCODE_RAW_BYTES = PROXY_TRANSCODE_BYTES.labels("raw")
+TRANSCODE_ENCODED_BYTES = PROXY_TRANSCODE_BYTES.labels("encoded")
+
+
+def count_transcoded(raw, encoded):
+    TRANSCODE_RAW_BYTES.inc(raw)
+    TRANSCODE_ENCODED_BYTES.inc(encoded)
+
+
+def frame_header(opcode, length, fin=True, rsv1=False):
+    """Build an unmasked server frame header; rsv1 marks a deflated message"""
+    first = (0x80 if fin else 0) | (0x40 if rsv1 else 0) | opcode
+    if length < 126:
+        return struct.pack("!BB", first, length)
+    if length < 65536:
+        return struct.pack("!BBH", first, 126, length)
+    return struct.pack("!BBQ", first, 127, length)
+
+
+def unmask(payload, mask):
+    """XOR a client payload with its 4-byte mask in one pass"""
+    length = len(payload)
+    if not length:
+        return b""
+    key = (mask * (length // 4 + 1))[:length]
+    data = int.from_bytes(payload, "little") ^ int.from_bytes(key, "little")
+    return data.to_bytes(length, "little")
+
+
+def accept_key(key):
+    """Compute Sec-WebSocket-Accept for a client key"""
+    digest = hashlib.sha1(key.encode("ascii") + WS_GUID).digest()
+    return base64.b64encode(digest).decode("ascii")
+
+
+class ReceiveBuffer:
+    """Preallocated bytearray filled in place by a BufferedProtocol"""
+
+    def __init__(self, size=READ_SIZE):
+        self.data = bytearray(size)
+        self.view = memoryview(self.data)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def writable(self):
+        """Return a view of the free tail, compacting or growing as needed"""
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif len(self.data) - self.end < READ_SIZE // 4:
+            pending = self.end - self.start
+            if pending > len(self.data) // 2:
+                data = bytearray(len(self.data) * 2)
+                data[:pending] = self.view[self.start:self.end]
+                self.data = data
+                self.view = memoryview(data)
+            else:
+                self.view[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+        return self.view[self.end:]
+
+    def consume(self, count):
+        self.start += count
+
+
+class TargetProtocol(asyncio.BufferedProtocol):
+    """TCP side of a proxied connection (Xvnc)"""
+
+    def __init__(self, client):
+        self.client = client
+        self.transport = None
+        client.target = self
+        self._new_buffer()
+
+    def _new_buffer(self):
+        self.data = bytearray(HEADER_ROOM + READ_SIZE)
+        self.view = memoryview(self.data)
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(HIGH_WATER, LOW_WATER)
+
+    def get_buffer(self, sizehint):
+        return self.view[HEADER_ROOM:]
+
+    def buffer_updated(self, nbytes):
+        received = time.perf_counter()
+        if self.client.transcoder:
+            # Updates are re-encoded and reach the browser via send_message
+            self.client.transcoder.from_server(self.view[HEADER_ROOM:HEADER_ROOM + nbytes])
+            TO_CLIENT_BYTES.inc(nbytes)
+            TO_CLIENT_MESSAGES.inc()
+            TO_CLIENT_RELAY.observe(time.perf_counter() - received)
+            return
+        if self.client.deflate:
+            self.client.send_message(self.view[HEADER_ROOM:HEADER_ROOM + nbytes])
+        else:
+            # Write the frame header in front of the payload so the whole
+            # frame leaves in one send() without joining buffers
+            header = frame_header(OP_BINARY, nbytes)
+            start = HEADER_ROOM - len(header)
+            self.view[start:HEADER_ROOM] = header
+            self.client.send_raw(self.view[start:HEADER_ROOM + nbytes])
+            if self.client.recorder:
+                self.client.recorder.server(self.view[HEADER_ROOM:HEADER_ROOM + nbytes])
+        if self.client.transport.get_write_buffer_size():
+            # The transport still references this buffer, read into a new one
+            self._new_buffer()
+        TO_CLIENT_BYTES.inc(nbytes)
+        TO_CLIENT_MESSAGES.inc()
+        TO_CLIENT_RELAY.observe(time.perf_counter() - received)
+
+    def eof_received(self):
+        return False
+
+    def connection_lost(self, exc):
+        self.client.close(1000 if exc is None else 1011)
+
+    def pause_writing(self):
+        self.client.transport.pause_reading()
+
+    def resume_writing(self):
+        self.client.transport.resume_reading()
+
+
+class ProxyConnection(asyncio.BufferedProtocol):
+    """Browser side of a proxied connection: HTTP, WebSocket handshake and framing"""
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.transport = None
+        self.target = None
+        self.buffer = ReceiveBuffer()
+        self.state = "http"
+        self.busy = False
+        self.heartbeat = None
+        self.token = None
+        self.recorder = None
+        self.transcoder = None
+        self.deflate = None
+        self.inflating = False
+        # Shared-session viewer (rfb_broadcast.Viewer) instead of a target
+        self.viewer = None
+
+    # asyncio callbacks
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(HIGH_WATER, LOW_WATER)
+        self.proxy.connections.add(self)
+
+    def get_buffer(self, sizehint):
+        return self.buffer.writable()
+
+    def buffer_updated(self, nbytes):
+        self.buffer.end += nbytes
+        if self.state == "http":
+            self._handle_http()
+        elif self.state == "websocket":
+            self._handle_frames()
+
+    def eof_received(self):
+        return False
+
+    def connection_lost(self, exc):
+        was_open = self.state == "websocket"
+        if was_open:
+            PROXY_CONNECTIONS.dec()
+        self.state = "closed"
+        self.proxy.connections.discard(self)
+        if was_open:
+            self.proxy.viewers_changed()
+        if self.viewer:
+            self.viewer.detach()
+        if self.heartbeat:
+            self.heartbeat.cancel()
+        if self.recorder:
+            self.recorder.close()
+        if self.deflate and (self.deflate.raw or self.deflate.skipped):
+            print(f"  {self.deflate.summary()}")
+        if self.target and self.target.transport:
+            self.target.transport.close()
+
+    def pause_writing(self):
+        if self.viewer:
+            # One slow viewer must not hold up the shared desktop
+            self.viewer.pause()
+        elif self.target and self.target.transport:
+            self.target.transport.pause_reading()
+
+    def resume_writing(self):
+        if self.viewer:
+            self.viewer.resume()
+        elif self.target and self.target.transport:
+            self.target.transport.resume_reading()
+
+    # HTTP
+
+    def _handle_http(self):
+        while self.state == "http" and not self.busy:
+            head = self.buffer.view[self.buffer.start:self.buffer.end]
+            index = bytes(head).find(b"\r\n\r\n")
+            if index < 0:
+                if len(head) > MAX_REQUEST:
+                    self._respond(431, b"Request header too large", close=True)
+                return
+            request = bytes(head[:index]).decode("latin-1")
+            self.buffer.consume(index + 4)
+            lines = request.split("\r\n")
+            try:
+                method, target, _ = lines[0].split(" ", 2)
+            except ValueError:
+                self._respond(400, b"Bad request", close=True)
+                return
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if headers.get("upgrade", "").lower() == "websocket":
+                self._upgrade(target, headers)
+            else:
+                self._serve(method, target, headers)
+
+    def _respond(self, status, body=b"", headers=None, close=False):
+        reason = {200: "OK", 301: "Moved Permanently", 304: "Not Modified", 400: "Bad Request",
+                  403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+                  431: "Request Header Fields Too Large",
+                  502: "Bad Gateway"}.get(status, "")
+        lines = [f"HTTP/1.1 {status} {reason}"]
+        headers = dict(headers or {})
+        headers.setdefault("Content-Length", str(len(body)))
+        if close:
+            headers["Connection"] = "close"
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        self.transport.writelines([("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"), body])
+        if close:
+            self.state = "closed"
+            self.transport.close()
+
+    def _serve(self, method, target, headers):
+        if method not in ("GET", "HEAD"):
+            self._respond(405, b"Method not allowed", close=True)
+            return
+        parts = urlsplit(target)
+        path = unquote(parts.path)
+        if path == "/":
+            self._respond(301, headers={"Location": "/vnc.html"})
+            return
+        asset = self.proxy.assets.lookup(path) if self.proxy.assets else None
+        if asset is not None:
+            self._serve_asset(method, asset, parts.query, headers)
+            return
+        root = self.proxy.web_root
+        file_path = (root / path.lstrip("/")).resolve()
+        if root not in file_path.parents and file_path != root:
+            self._respond(403, b"Forbidden")
+            return
+        if not file_path.is_file():
+            self._respond(404, b"Not found")
+            return
+        content_type = mimetypes.guess_type(file_path.name)[0] or "application/octet-stream"
+        size = file_path.stat().st_size
+        head = {"Content-Type": content_type, "Content-Length": str(size),
+                "Cache-Control": "no-cache"}
+        self._respond(200, headers=head)
+        if method == "GET" and size:
+            self.busy = True
+            self.transport.pause_reading()
+            asyncio.ensure_future(self._send_file(file_path))
+
+    def _serve_asset(self, method, asset, query, headers):
+        body, encoding, etag = asset.variant(headers.get("accept-encoding", ""))
+        # URLs carrying the current version never change content
+        versioned = parse_qs(query).get("v") == [self.proxy.assets.version]
+        head = {"Content-Type": asset.content_type, "ETag": etag,
+                "Cache-Control": IMMUTABLE if versioned else REVALIDATE,
+                "Vary": "Accept-Encoding"}
+        if encoding:
+            head["Content-Encoding"] = encoding
+        if etag in (tag.strip() for tag in headers.get("if-none-match", "").split(",")):
+            self._respond(304, headers=head)
+            return
+        if method == "HEAD":
+            head["Content-Length"] = str(len(body))
+            self._respond(200, headers=head)
+            return
+        self._respond(200, body, head)
+
+    async def _send_file(self, file_path):
+        loop = asyncio.get_running_loop()
+        try:
+            with open(file_path, "rb") as f:
+                await loop.sendfile(self.transport, f)
+        except (OSError, RuntimeError):
+            self.transport.close()
+            return
+        self.busy = False
+        if self.state == "http":
+            self.transport.resume_reading()
+            self._handle_http()
+
+    # WebSocket
+
+    def _upgrade(self, target, headers):
+        key = headers.get("sec-websocket-key")
+        if not key:
+            self._respond(400, b"Missing Sec-WebSocket-Key", close=True)
+            return
+        backend = self.proxy.resolve(target)
+        if backend is None:
+            self._respond(404, b"Unknown token", close=True)
+            return
+        self.token = token_from_request(target) if self.proxy.router else None
+        response = [
+            "HTTP/1.1 101 Switching Protocols",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            f"Sec-WebSocket-Accept: {accept_key(key)}",
+        ]
+        offered = [p.strip() for p in headers.get("sec-websocket-protocol", "").split(",")]
+        if "binary" in offered:
+            response.append("Sec-WebSocket-Protocol: binary")
+        if self.proxy.deflate:
+            self.deflate = self.proxy.deflate.negotiate(headers.get("sec-websocket-extensions"))
+            if self.deflate:
+                response.append(f"Sec-WebSocket-Extensions: {self.deflate.response()}")
+        self.transport.write(("\r\n".join(response) + "\r\n\r\n").encode("latin-1"))
+        self.state = "websocket"
+        PROXY_CONNECTIONS.inc()
+        # Before the backend is dialled: a hibernating desktop is thawed first
+        self.proxy.viewers_changed()
+        if self.proxy.record_dir:
+            self.recorder = SessionRecorder(recording_path(
+                self.proxy.record_dir, self.token or f"port{backend[1]}"))
+        if self.proxy.broadcast:
+            self.viewer = self.proxy.broadcast.attach(self, backend)
+            if self.proxy.heartbeat:
+                self._schedule_heartbeat()
+            self._handle_frames()
+            return
+        if self.proxy.transcode:
+            self.transcoder = RFBTranscoder(self, self.proxy.pool, count_transcoded)
+        self.transport.pause_reading()
+        asyncio.ensure_future(self._connect_target(*backend))
+
+    async def _connect_target(self, host, port):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.create_connection(lambda: TargetProtocol(self), host, port)
+        except OSError as e:
+            print(f"⚠ Proxy could not reach {host}:{port}: {e}")
+            self.close(1011)
+            return
+        if self.state != "websocket":
+            self.target.transport.close()
+            return
+        if self.proxy.heartbeat:
+            self._schedule_heartbeat()
+        self.transport.resume_reading()
+        self._handle_frames()
+
+    def _schedule_heartbeat(self):
+        loop = asyncio.get_running_loop()
+        self.heartbeat = loop.call_later(self.proxy.heartbeat, self._ping)
+
+    def _ping(self):
+        if self.state == "websocket":
+            self.transport.write(frame_header(OP_PING, 0))
+            self._schedule_heartbeat()
+
+    def _handle_frames(self):
+        buf = self.buffer
+        if self.viewer is None and (self.target is None or self.target.transport is None):
+            return
+        while self.state == "websocket":
+            data = buf.view
+            pos = buf.start
+            available = buf.end - pos
+            if available < 2:
+                return
+            first, second = data[pos], data[pos + 1]
+            length = second & 0x7F
+            offset = 2
+            if length == 126:
+                if available < 4:
+                    return
+                length = struct.unpack_from("!H", data, pos + 2)[0]
+                offset = 4
+            elif length == 127:
+                if available < 10:
+                    return
+                length = struct.unpack_from("!Q", data, pos + 2)[0]
+                offset = 10
+            if not second & 0x80:
+                # RFC 6455 5.1: clients must mask every frame
+                self.close(1002)
+                return
+            if first & 0x30 or (first & 0x40 and not self.deflate):
+                # Reserved bits without an extension that defines them
+                self.close(1002)
+                return
+            if length > MAX_FRAME:
+                # RFC 6455 7.4.1: 1009, message too big to process
+                self.close(1009)
+                return
+            if available < offset + 4 + length:
+                return
+            mask = bytes(data[pos + offset:pos + offset + 4])
+            start = pos + offset + 4
+            payload = unmask(data[start:start + length], mask)
+            buf.consume(offset + 4 + length)
+            self._handle_message(first & 0x0F, payload, first & 0x80, first & 0x40)
+
+    def _handle_message(self, opcode, payload, fin=True, rsv1=False):
+        if opcode in (OP_BINARY, OP_TEXT, OP_CONTINUATION):
+            if opcode != OP_CONTINUATION:
+                # RSV1 on the first frame marks the whole message as deflated
+                self.inflating = bool(rsv1)
+            elif rsv1:
+                self.close(1002)
+                return
+            if self.inflating:
+                try:
+                    payload = self.deflate.decompress(payload, fin)
+                except DeflateError as e:
+                    print(f"⚠ Bad deflated message from the browser: {e}")
+                    self.close(1007)
+                    return
+                if fin:
+                    self.inflating = False
+            if payload:
+                received = time.perf_counter()
+                if self.recorder:
+                    self.recorder.client(payload)
+                if self.viewer:
+                    self.viewer.from_client(payload)
+                    return
+                if self.transcoder:
+                    payload = self.transcoder.from_client(payload)
+                self.target.transport.write(payload)
+                TO_SERVER_BYTES.inc(len(payload))
+                TO_SERVER_MESSAGES.inc()
+                TO_SERVER_RELAY.observe(time.perf_counter() - received)
+        elif rsv1:
+            # Control frames are never compressed
+            self.close(1002)
+        elif opcode == OP_PING:
+            self.transport.write(frame_header(OP_PONG, len(payload)) + payload)
+        elif opcode == OP_CLOSE:
+            self.close(struct.unpack("!H", payload[:2])[0] if len(payload) >= 2 else 1000)
+
+    def send_raw(self, frame):
+        if self.state == "websocket":
+            self.transport.write(frame)
+
+    def send_message(self, payload):
+        """Frame and send one binary message, deflated when negotiated"""
+        if self.state == "websocket":
+            if self.deflate:
+                data, compressed = self.deflate.compress(payload)
+                self.transport.writelines([frame_header(OP_BINARY, len(data), rsv1=compressed), data])
+            else:
+                self.transport.writelines([frame_header(OP_BINARY, len(payload)), payload])
+            if self.recorder:
+                self.recorder.server(payload)
+
+    def close(self, code=1000):
+        was_open = self.state == "websocket"
+        if was_open:
+            self.transport.write(frame_header(OP_CLOSE, 2) + struct.pack("!H", code))
+            PROXY_CONNECTIONS.dec()
+        # connection_lost sees "closed" and does not report this viewer again
+        self.state = "closed"
+        self.transport.close()
+        if self.target and self.target.transport:
+            self.target.transport.close()
+        if was_open:
+            self.proxy.viewers_changed()
+
+
+class VNCProxy:
+    def __init__(self, port=5000, target_host="localhost", target_port=5901,
+                 web_dir=".", host="", heartbeat=None, router=None, record_dir=None,
+                 transcode=False, transcode_workers=None, cache_assets=True, reuse_port=False,
+                 deflate=None, broadcast=None):
+        self.port = port
+        self.host = host
+        self.target_host = target_host
+        self.target_port = target_port
+        self.web_root = Path(web_dir).resolve()
+        self.heartbeat = heartbeat
+        self.router = router
+        # Sessions are recorded for tests/vnc_playback.html when set
+        self.record_dir = record_dir
+        # Re-encode Raw updates from Xvnc as Tight for thin links
+        self.transcode = transcode
+        self.transcode_workers = transcode_workers
+        self.pool = None
+        # Web client served from memory, precompressed (disk until it is built)
+        self.cache_assets = cache_assets
+        self.assets = None
+        # Several worker processes share the port (see proxy_workers.py)
+        self.reuse_port = reuse_port
+        # permessage-deflate preferences (DeflateSettings); None leaves it off
+        self.deflate = deflate
+        # BroadcastHub (rfb_broadcast.py): one Xvnc connection shared by view-only viewers
+        self.broadcast = broadcast
+        self.connections = set()
+        # Called with the open WebSocket count whenever it changes
+        self.on_viewers = None
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.on_exit = None
+
+    def resolve(self, target):
+        """Backend (host, port) for a WebSocket request target"""
+        if self.router is None:
+            return self.target_host, self.target_port
+        token = token_from_request(target)
+        return self.router.lookup(token) if token else None
+
+    def viewers(self, token=None):
+        """Open WebSocket connections, optionally only those routed by token"""
+        return sum(1 for conn in self.connections
+                   if conn.state == "websocket" and (token is None or conn.token == token))
+
+    def viewers_changed(self):
+        if self.on_viewers:
+            self.on_viewers(self.viewers())
+
+    async def start(self):
+        """Bind the listening socket on the running loop"""
+        self.loop = asyncio.get_running_loop()
+        if self.transcode and self.pool is None:
+            self.pool = create_pool(self.transcode_workers)
+        if self.cache_assets and self.assets is None:
+            self.assets = AssetCache(self.web_root)
+            self.assets.start()
+        self.server = await self.loop.create_server(
+            lambda: ProxyConnection(self), self.host or None, self.port,
+            reuse_address=True, reuse_port=self.reuse_port or None)
+        return self.server
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def run(self):
+        """Run the proxy in the calling thread until interrupted"""
+        asyncio.run(self.serve_forever())
+
+    def start_in_thread(self):
+        """Run the proxy on its own event loop in a daemon thread"""
+        ready = threading.Event()
+        errors = []
+
+        async def main():
+            try:
+                await self.start()
+            except OSError as e:
+                errors.append(e)
+                return
+            finally:
+                ready.set()
+            async with self.server:
+                try:
+                    await self.server.serve_forever()
+                except asyncio.CancelledError:
+                    pass
+
+        def runner():
+            try:
+                asyncio.run(main())
+            finally:
+                if self.pool:
+                    self.pool.shutdown(wait=False, cancel_futures=True)
+                    self.pool = None
+                if self.on_exit:
+                    self.on_exit()
+
+        self.thread = threading.Thread(target=runner, name="vnc-proxy", daemon=True)
+        self.thread.start()
+        ready.wait()
+        if errors:
+            raise errors[0]
+        return self.thread
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def shutdown(self):
+        """Close the server and every connection; call on the proxy's loop"""
+        self.server.close()
+        for conn in list(self.connections):
+            conn.close(1001)
+        for task in asyncio.all_tasks(self.loop):
+            task.cancel()
+
+    def stop(self):
+        """Stop accepting and close every relayed connection"""
+        if self.loop is None or self.server is None:
+            return
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.shutdown)
+        if self.thread:
+            self.thread.join(timeout=5)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-process WebSocket proxy for noVNC")
+    parser.add_argument("--port", type=int, default=5000, help="Listening port")
+    parser.add_argument("--target", type=int, default=5901, help="VNC server port")
+    parser.add_argument("--target-host", default="localhost", help="VNC server host")
+    parser.add_argument("--web", default=".", help="Directory served over HTTP")
+    parser.add_argument("--heartbeat", type=int, default=None, help="Ping interval in seconds")
+    parser.add_argument("--routes", default=None,
+                        help="Token file (token: host:port per line) to route by URL token")
+    parser.add_argument("--record", default=None, metavar="DIR",
+                        help="Record every session as a playback file in DIR")
+    parser.add_argument("--transcode", action="store_true",
+                        help="Re-encode Raw updates as Tight before sending them to the browser")
+    parser.add_argument("--transcode-workers", type=int, default=None,
+                        help="Encoder processes (default: all cores)")
+    add_deflate_arguments(parser)
+
+    args = parser.parse_args()
+
+    router = TokenRouter(args.routes) if args.routes else None
+    proxy = VNCProxy(args.port, args.target_host, args.target, args.web,
+                     heartbeat=args.heartbeat, router=router, record_dir=args.record,
+                     transcode=args.transcode, transcode_workers=args.transcode_workers,
+                     deflate=deflate_from_args(args))
+    if router:
+        print(f"✓ Proxy listening on port {args.port}, {len(router)} routes from {args.routes}")
+    else:
+        print(f"✓ Proxy listening on port {args.port} -> {args.target_host}:{args.target}")
+    try:
+        proxy.run()
+    except KeyboardInterrupt:
+        print("\nProxy stopped by user")
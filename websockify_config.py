@@ -10,14 +10,20 @@ import subprocess
 import argparse
 from pathlib import Path
 
+from vnc_proxy import VNCProxy
+
 class WebsockifyManager:
-    def __init__(self, port=5000, target_port=5901):
+    def __init__(self, port=5000, target_port=5901, external=False):
         self.websock_port = port
         self.target_port = target_port
         self.web_dir = "."
+        self.external = external
         
     def start_websockify(self):
-        """Start websockify with proper configuration"""
+        """Start the WebSocket proxy with proper configuration"""
+        if not self.external:
+            return self.start_builtin()
+            
         cmd = [
             sys.executable, "-m", "websockify",
             "--web", self.web_dir,
@@ -44,12 +50,32 @@ class WebsockifyManager:
             
         return True
 
+    def start_builtin(self):
+        """Run the in-process asyncio proxy instead of a websockify subprocess"""
+        print(f"Starting built-in proxy on port {self.websock_port}")
+        print(f"Proxying to VNC server on port {self.target_port}")
+        print(f"Web files served from: {self.web_dir}")
+        
+        proxy = VNCProxy(self.websock_port, target_port=self.target_port,
+                         web_dir=self.web_dir, heartbeat=30)
+        try:
+            proxy.run()
+        except KeyboardInterrupt:
+            print("\nProxy stopped by user")
+        except Exception as e:
+            print(f"Proxy failed: {e}")
+            return False
+            
+        return True
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Start websockify for noVNC")
     parser.add_argument("--port", type=int, default=5000, help="Websockify port")
     parser.add_argument("--target", type=int, default=5901, help="VNC server port")
+    parser.add_argument("--websockify", action="store_true",
+                        help="Use the external websockify process instead of the built-in proxy")
     
     args = parser.parse_args()
     
-    manager = WebsockifyManager(args.port, args.target)
+    manager = WebsockifyManager(args.port, args.target, external=args.websockify)
     manager.start_websockify()
\ No newline at end of file
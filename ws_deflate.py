@@ -0,0 +1,203 @@
+"""
+permessage-deflate (RFC 7692) for the WebSocket proxy
+Negotiates the extension from the browser's offer and compresses relayed
+messages, skipping payloads that are already compressed (JPEG, H.264)
+"""
+
+import time
+import zlib
+
+from metrics import PROXY_DEFLATE_BYTES, PROXY_DEFLATE_SECONDS
+
+EXTENSION = "permessage-deflate"
+TAIL = b"\x00\x00\xff\xff"    # removed from every compressed message (RFC 7692 7.2.1)
+MIN_WINDOW_BITS = 9           # zlib cannot deflate with an 8-bit window
+MAX_WINDOW_BITS = 15
+MIN_SIZE = 32                 # smaller messages are not worth a deflate block
+SAMPLE_SIZE = 2048            # bytes test-compressed to spot incompressible data
+SKIP_RATIO = 0.9              # a sample compressing worse than this is sent as is
+MAX_MESSAGE = 16 * 1024 * 1024  # largest inflated client message
+
+# Metric children resolved once, they are updated on every relayed message
+RAW_BYTES = PROXY_DEFLATE_BYTES.labels("raw")
+WIRE_BYTES = PROXY_DEFLATE_BYTES.labels("compressed")
+SKIPPED_BYTES = PROXY_DEFLATE_BYTES.labels("skipped")
+COMPRESS_SECONDS = PROXY_DEFLATE_SECONDS.labels("compress")
+DECOMPRESS_SECONDS = PROXY_DEFLATE_SECONDS.labels("decompress")
+
+
+class DeflateError(Exception):
+    pass
+
+
+def parse_extensions(header):
+    """[(name, {param: value or None})] from a Sec-WebSocket-Extensions header"""
+    offers = []
+    for offer in header.split(","):
+        parts = [part.strip() for part in offer.split(";")]
+        if not parts[0]:
+            continue
+        params = {}
+        for part in parts[1:]:
+            key, _, value = part.partition("=")
+            params[key.strip().lower()] = value.strip().strip('"') or None
+        offers.append((parts[0].lower(), params))
+    return offers
+
+
+class DeflateSettings:
+    """Server-side preferences, applied to whatever each browser offers"""
+
+    def __init__(self, window_bits=MAX_WINDOW_BITS, context_takeover=True, level=6,
+                 mem_level=8, min_size=MIN_SIZE, skip_ratio=SKIP_RATIO):
+        if not MIN_WINDOW_BITS <= window_bits <= MAX_WINDOW_BITS:
+            raise ValueError(f"window bits must be {MIN_WINDOW_BITS}..{MAX_WINDOW_BITS}")
+        self.window_bits = window_bits
+        # Without takeover every message is compressed alone: less memory and
+        # CPU per connection, worse ratios
+        self.context_takeover = context_takeover
+        self.level = level
+        self.mem_level = mem_level
+        self.min_size = min_size
+        self.skip_ratio = skip_ratio
+
+    def negotiate(self, header):
+        """A PerMessageDeflate for the first acceptable offer, or None"""
+        for name, params in parse_extensions(header or ""):
+            if name != EXTENSION:
+                continue
+            try:
+                return PerMessageDeflate.accept(self, params)
+            except DeflateError:
+                continue
+        return None
+
+
+class PerMessageDeflate:
+    def __init__(self, settings, window_bits, server_takeover, client_takeover):
+        self.settings = settings
+        self.window_bits = window_bits
+        self.server_takeover = server_takeover
+        self.client_takeover = client_takeover
+        self.compressor = None
+        self.decompressor = None
+        self.raw = 0
+        self.wire = 0
+        self.skipped = 0
+        self.cpu = 0.0
+
+    @classmethod
+    def accept(cls, settings, params):
+        window_bits = settings.window_bits
+        server_takeover = settings.context_takeover
+        client_takeover = settings.context_takeover
+        for key, value in params.items():
+            if key == "server_no_context_takeover" and value is None:
+                server_takeover = False
+            elif key == "client_no_context_takeover" and value is None:
+                pass    # the browser resets anyway; nothing to agree on
+            elif key == "server_max_window_bits":
+                if value is None or not value.isdigit():
+                    raise DeflateError(f"bad {key}")
+                window_bits = min(window_bits, int(value))
+                if window_bits < MIN_WINDOW_BITS:
+                    raise DeflateError("window too small for zlib")
+            elif key == "client_max_window_bits":
+                # Inflating with a 15-bit window reads any smaller one
+                if value is not None and not (value.isdigit() and 8 <= int(value) <= 15):
+                    raise DeflateError(f"bad {key}")
+            else:
+                raise DeflateError(f"unknown parameter {key}")
+        return cls(settings, window_bits, server_takeover, client_takeover)
+
+    def response(self):
+        """Sec-WebSocket-Extensions value for the 101 response"""
+        params = [EXTENSION]
+        if not self.server_takeover:
+            params.append("server_no_context_takeover")
+        if not self.client_takeover:
+            params.append("client_no_context_takeover")
+        if self.window_bits < MAX_WINDOW_BITS:
+            params.append(f"server_max_window_bits={self.window_bits}")
+        return "; ".join(params)
+
+    def _compressible(self, payload):
+        if len(payload) < self.settings.min_size:
+            return False
+        if len(payload) < SAMPLE_SIZE * 2:
+            return True
+        # Test the middle of the message: headers at the front compress well
+        # even when the rectangle data behind them is JPEG
+        middle = len(payload) // 2
+        sample = payload[middle:middle + SAMPLE_SIZE]
+        return len(zlib.compress(sample, 1)) < len(sample) * self.settings.skip_ratio
+
+    def compress(self, payload):
+        """(data, compressed) for one outgoing message; compressed sets RSV1"""
+        started = time.thread_time()
+        if not self._compressible(payload):
+            self.skipped += len(payload)
+            SKIPPED_BYTES.inc(len(payload))
+            self._account(COMPRESS_SECONDS, started)
+            return payload, False
+        if self.compressor is None:
+            self.compressor = zlib.compressobj(self.settings.level, zlib.DEFLATED,
+                                               -self.window_bits, self.settings.mem_level)
+        data = self.compressor.compress(payload) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data.endswith(TAIL):
+            data = data[:-4]
+        if not self.server_takeover:
+            self.compressor = None
+        self.raw += len(payload)
+        self.wire += len(data)
+        RAW_BYTES.inc(len(payload))
+        WIRE_BYTES.inc(len(data))
+        self._account(COMPRESS_SECONDS, started)
+        return data, True
+
+    def decompress(self, fragment, fin):
+        """Inflate one fragment of a compressed client message"""
+        started = time.thread_time()
+        if self.decompressor is None:
+            self.decompressor = zlib.decompressobj(-MAX_WINDOW_BITS)
+        try:
+            data = self.decompressor.decompress(fragment + TAIL if fin else fragment, MAX_MESSAGE)
+        except zlib.error as e:
+            raise DeflateError(str(e))
+        if self.decompressor.unconsumed_tail:
+            raise DeflateError("message too large")
+        if fin and not self.client_takeover:
+            self.decompressor = None
+        self._account(DECOMPRESS_SECONDS, started)
+        return data
+
+    def _account(self, child, started):
+        spent = time.thread_time() - started
+        self.cpu += spent
+        child.inc(spent)
+
+    def summary(self):
+        """One line for the log: ratio and CPU cost of this connection"""
+        ratio = self.wire / self.raw if self.raw else 1.0
+        return (f"permessage-deflate: {self.raw / 1048576:.1f} MiB -> {self.wire / 1048576:.1f} MiB "
+                f"({ratio:.1%}), {self.skipped / 1048576:.1f} MiB sent as is, "
+                f"{self.cpu * 1000:.0f} ms CPU")
+
+
+def add_deflate_arguments(parser):
+    """permessage-deflate flags shared by the proxy front ends"""
+    parser.add_argument("--deflate", action="store_true",
+                        help="Negotiate permessage-deflate compression with the browser")
+    parser.add_argument("--deflate-window-bits", type=int, default=MAX_WINDOW_BITS,
+                        help=f"Compression window, {MIN_WINDOW_BITS}-{MAX_WINDOW_BITS} bits "
+                             "(smaller saves memory per connection)")
+    parser.add_argument("--deflate-level", type=int, default=6, help="zlib level 1-9")
+    parser.add_argument("--deflate-no-context-takeover", action="store_true",
+                        help="Compress every message on its own (less memory, worse ratio)")
+
+
+def deflate_from_args(args):
+    if not args.deflate:
+        return None
+    return DeflateSettings(args.deflate_window_bits, not args.deflate_no_context_takeover,
+                           args.deflate_level)